@@ -0,0 +1,290 @@
+"""
+End-to-end benchmark of the event path on the simulated lgpio backend.
+
+Edge trains are injected into input lines of a sim_lgpio chip and go
+through the notification pipe, the log writer and the event server like
+real pin activity. Four runs are made:
+
+    pipeline    a plain subscriber decodes the events and measures sustained
+                events/s, edge-to-subscriber latency percentiles (receive
+                time minus the record timestamp), lost/dropped events, the
+                decode time per read and the producer's GPIO.metrics()
+    visualizer  a hidden GPIOPlotter subscribes, timing each
+                updatePlots() frame and a separate redraw of the same window
+                while its reader thread ingests the events, and how far the
+                reader fell behind
+    sampling    start_sampling() reads the lines at --sample-rate with no
+                other load and reports the rate it achieved and the sample
+                deadlines it missed
+    decoders    synthetic 115200 baud UART and 400 kHz I2C traffic is fed to
+                the protocol decoders in 100 ms batches, as the visualizer
+                does every frame
+
+Run from a scratch directory, the event socket is created in the current one:
+
+    python benchmark.py --rate 200000 --duration 5 --pins 4
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('GPIO_BACKEND', 'sim')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # No display needed
+
+import numpy as np
+
+import pigpio_lgpio
+import sim_lgpio
+from decoders import parse_decoder
+from event_format import RECORD_DTYPE, WIRE_VERSION, EventDecoder, expand_groups, split_pwm, split_stats
+from event_server import subscribe
+
+FIRST_PIN = 2  # Lowest GPIO the visualizer draws
+
+
+def percentiles(values_ns, points=(50, 90, 99, 99.9)):
+    if not len(values_ns):
+        return 'n/a'
+    result = np.percentile(values_ns, points)
+    return '  '.join(f'p{p:g} {v / 1e6:.2f} ms' for p, v in zip(points, result)) + f'  max {values_ns.max() / 1e6:.2f} ms'
+
+
+def frame_times(times_s):
+    if not times_s:
+        return 'n/a'
+    times = np.array(times_s) * 1e3
+    return f'mean {times.mean():.2f} ms  p99 {np.percentile(times, 99):.2f} ms  max {times.max():.2f} ms'
+
+
+def start_producer(args):
+    gpio = pigpio_lgpio.GPIO(backend='sim', overflow_policy=args.policy, max_log_size=args.max_log_size)
+    pins = range(FIRST_PIN, FIRST_PIN + args.pins)
+    for pin in pins:
+        gpio.set_mode(pin, gpio.INPUT)
+    return gpio, pins
+
+
+def inject(gpio, pins, args):
+    return [sim_lgpio.inject(gpio.gpiochip, pin, args.rate / len(pins), duration=args.duration,
+                             jitter_ns=args.jitter_ns, seed=pin) for pin in pins]
+
+
+def bench_log_event(args):
+    """
+    Producer hot path alone: log_event calls per second into an empty ring.
+    """
+    # Never opened, so there is no log writer and nothing is published
+    gpio = pigpio_lgpio.GPIO(backend='sim', max_log_size=args.max_log_size)
+    count = args.max_log_size
+    start = time.perf_counter()
+    for i in range(count):
+        gpio.log_event(FIRST_PIN, i & 1)
+    elapsed = time.perf_counter() - start
+    gpio.stop()
+    print(f'log_event:   {count / elapsed:,.0f} calls/s ({elapsed / count * 1e9:.0f} ns/call)')
+
+
+def bench_pipeline(args):
+    gpio, pins = start_producer(args)
+    events = subscribe(pins=pins)
+    decoder = EventDecoder()
+    latencies = []
+    decode_times = []
+    received = 0
+    end = time.perf_counter()
+    trains = inject(gpio, pins, args)
+    start = time.perf_counter()
+    idle_since = None
+    while True:
+        try:
+            data = events.recv(1 << 20)
+        except BlockingIOError:
+            data = b''
+        if not data:
+            if not any(train.is_alive() for train in trains):
+                injected = sum(train.sent for train in trains)
+                if received + gpio.dropped_events >= injected:
+                    break
+                # Whatever has not arrived a second after the last read is lost
+                idle_since = idle_since or time.perf_counter()
+                if time.perf_counter() - idle_since > 1:
+                    break
+            time.sleep(0.001)
+            continue
+        idle_since = None
+        now = time.time_ns()
+        t = time.perf_counter()
+        records = expand_groups(split_pwm(split_stats(decoder.feed(data))[0])[0])
+        decode_times.append(time.perf_counter() - t)
+        latencies.append(now - records['timestamp'])
+        received += len(records)
+        end = time.perf_counter()
+    elapsed = end - start
+    metrics = gpio.metrics()
+    gpio.stop()
+    events.close()
+    latencies = np.concatenate(latencies) if latencies else np.empty(0, dtype=np.int64)
+    print(f'pipeline:    {injected:,} edges injected, {received:,} received, {received / elapsed:,.0f} events/s')
+    print(f'  lost:      {injected - received:,} ({gpio.dropped_events:,} counted as dropped, '
+          f'{decoder.errors} decode errors)')
+    print(f'  latency:   {percentiles(latencies)}')
+    print(f'  delivery:  up to {max(train.late_ns for train in trains) / 1e6:.2f} ms after the edge time')
+    print(f'  decode:    {frame_times(decode_times)} per read')
+    print(f"  producer:  buffer high water {metrics['buffer_high_water']:,} of {metrics['buffer_capacity']:,}, "
+          f"flush p99 {metrics['flush_ns'].get('p99_ns', 0) / 1e6:.2f} ms, "
+          f"write latency p99 {metrics['write_latency_ns'].get('p99_ns', 0) / 1e6:.2f} ms")
+
+
+def bench_visualizer(args):
+    from PySide6 import QtCore, QtWidgets
+    import visualizer
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    plotter = visualizer.GPIOPlotter()
+    plotter.timer.stop()  # Frames are driven below
+    # Not shown: the frames measure our decoding and curve updates, not
+    # Qt's painting, which depends on the display
+    plotter.resize(1280, 900)
+    gpio, pins = start_producer(args)
+    trains = inject(gpio, pins, args)
+    frames = []
+    renders = []
+    backlogs = []
+    next_frame = time.perf_counter()
+    while any(train.is_alive() for train in trains):
+        next_frame += 0.1
+        time.sleep(max(next_frame - time.perf_counter(), 0))
+        t = time.perf_counter()
+        plotter.updatePlots()
+        frames.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        plotter.renderPlots(*plotter.plots[-1].getViewBox().viewRange()[0])
+        renders.append(time.perf_counter() - t)
+        backlogs.append(plotter.backlog)
+        app.processEvents()
+    # The reader first, so it does not retry the subscription once the server is gone
+    plotter.stopReader()
+    gpio.stop()
+    plotter.close()
+    plotter.deleteLater()
+    app.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+    print(f'visualizer:  {len(frames)} frames at 10 Hz')
+    print(f'  frame:     {frame_times(frames)} (updatePlots: stats, trigger, curve update)')
+    print(f'  redraw:    {frame_times(renders)}')
+    print(f'  behind:    up to {max(backlogs, default=0):,} events not yet stored by the reader thread')
+
+
+def bench_sampling(args):
+    gpio = pigpio_lgpio.GPIO(backend='sim')
+    pins = range(FIRST_PIN, FIRST_PIN + args.pins)
+    gpio.start_sampling(pins, args.sample_rate)
+    time.sleep(args.duration)
+    status = gpio.stop_sampling()
+    metrics = gpio.metrics()
+    gpio.stop()
+    print(f"sampling:    {status['achieved_rate']:,.0f} of {status['rate']:,.0f} samples/s on {args.pins} lines, "
+          f"{status['missed']:,} deadlines missed, {metrics['produced']:,} edges")
+
+
+def edge_records(pins, levels, timestamps):
+    order = np.argsort(timestamps, kind='stable')
+    records = np.zeros(len(order), dtype=RECORD_DTYPE)
+    records['version'] = WIRE_VERSION
+    records['pin'] = np.asarray(pins)[order]
+    records['level'] = np.asarray(levels)[order]
+    records['timestamp'] = np.asarray(timestamps)[order]
+    return records
+
+
+def uart_records(pin, baud, duration, start_ns):
+    """
+    Back to back random 8N1 bytes for duration seconds.
+    """
+    count = int(duration * baud / 10)
+    data = np.random.default_rng(0).integers(0, 256, count)
+    bits = np.ones((count, 10), dtype=np.uint8)
+    bits[:, 0] = 0
+    bits[:, 1:9] = (data[:, None] >> np.arange(8)) & 1
+    timestamps = start_ns + (np.arange(count * 10) * 1e9 / baud).astype(np.int64)
+    return edge_records(np.full(count * 10, pin), bits.ravel(), timestamps), count
+
+
+def i2c_records(sda, scl, frequency, duration, start_ns):
+    """
+    One write transfer of random bytes lasting duration seconds: SDA changes
+    at the start of every bit, SCL is high for the middle half of it.
+    """
+    period = 1e9 / frequency
+    count = int(duration * frequency / 9)
+    data = np.random.default_rng(0).integers(0, 256, count)
+    bits = np.zeros((count, 9), dtype=np.uint8)  # The 9th bit is the ACK
+    bits[:, :8] = (data[:, None] >> np.arange(7, -1, -1)) & 1
+    bit_ns = start_ns + period * np.arange(count * 9)
+    end_ns = start_ns + period * count * 9
+    # START before the first bit and STOP after the last
+    sda_times = np.concatenate([[start_ns - period], bit_ns, [end_ns, end_ns + period / 2]])
+    sda_levels = np.concatenate([[0], bits.ravel(), [0, 1]])
+    clock_ns = np.repeat(bit_ns, 2) + np.tile([period / 4, 3 * period / 4], len(bit_ns))
+    scl_times = np.concatenate([[start_ns - period / 2], clock_ns, [end_ns + period / 4]])
+    scl_levels = np.concatenate([[0], np.tile([1, 0], len(bit_ns)), [1]])
+    pins = np.concatenate([np.full(len(sda_times), sda), np.full(len(scl_times), scl)])
+    return edge_records(pins, np.concatenate([sda_levels, scl_levels]),
+                        np.concatenate([sda_times, scl_times]).astype(np.int64)), count
+
+
+def bench_decoders(args):
+    """
+    Decode time per visualizer frame at the fastest usual UART and I2C rates.
+    """
+    start_ns = time.time_ns()
+    runs = [('uart:2:115200', *uart_records(2, 115200, args.duration, start_ns)),
+            ('i2c:2,3', *i2c_records(2, 3, 400000, args.duration, start_ns))]
+    for spec, records, count in runs:
+        decoder = parse_decoder(spec)
+        batches = np.searchsorted(records['timestamp'], start_ns + np.arange(1, int(args.duration * 10) + 2) * 10**8)
+        times = []
+        first = 0
+        for i, last in enumerate(batches.tolist()):
+            t = time.perf_counter()
+            decoder.feed(records[first:last], start_ns + (i + 1) * 10**8)
+            times.append(time.perf_counter() - t)
+            first = last
+        print(f'{spec:<14} {len(records) / args.duration:,.0f} records/s, {count:,} bytes sent, '
+              f'{len(decoder.annotations):,} annotations')
+        print(f'  decode:    {frame_times(times)} per 100 ms frame')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rate', type=float, default=100000, help='edges per second over all pins')
+    parser.add_argument('--duration', type=float, default=3, help='seconds of injected activity per run')
+    parser.add_argument('--pins', type=int, default=4, help='number of input lines, from GPIO2 up')
+    parser.add_argument('--jitter-ns', type=int, default=0, help='standard deviation of the edge times')
+    parser.add_argument('--policy', default=pigpio_lgpio.GPIO.DROP_OLDEST,
+                        choices=[pigpio_lgpio.GPIO.DROP_OLDEST, pigpio_lgpio.GPIO.DROP_NEWEST,
+                                 pigpio_lgpio.GPIO.COUNT_AND_SKIP])
+    parser.add_argument('--max-log-size', type=int, default=100000)
+    parser.add_argument('--no-visualizer', action='store_true', help='skip the visualizer run')
+    parser.add_argument('--sample-rate', type=float, default=100000, help='samples per second of the sampling run')
+    args = parser.parse_args()
+    if not 1 <= args.pins <= 26:
+        parser.error('--pins must be between 1 and 26')
+    bench_log_event(args)
+    bench_pipeline(args)
+    if not args.no_visualizer:
+        bench_visualizer(args)
+    bench_sampling(args)
+    bench_decoders(args)
+    if not args.no_visualizer:
+        # PySide6 6.12 on Python 3.11 drops a reference to None or True in
+        # most calls and emits, which aborts the interpreter when it frees
+        # them at exit ("Fatal Python error: none_dealloc"). Everything is
+        # stopped and printed by now, so leave without finalizing.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
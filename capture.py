@@ -0,0 +1,344 @@
+"""
+Recorded capture files.
+
+A capture is a directory holding the event stream in the wire format of
+event_format.py, split into fixed-size segment files, plus:
+
+    index.rec   a header, then one entry per block of block_records records
+                with its time range and per-pin summary bit masks
+    pwm.rec     a copy of every PWM segment record pair, small enough to
+                load completely
+    waves.rec   a copy of every wave definition pair, loaded the same way
+
+CaptureWriter runs on the producer side and only needs the standard
+library. CaptureReader memory-maps the segments, finds a time in O(log n)
+through the index plus one block scan, and can summarize any time range
+from the index alone without touching the records.
+"""
+import glob
+import os
+import struct
+
+from event_format import FLAG_GROUP, FLAG_PAYLOAD, FLAG_PWM, FLAG_WAVE_PULSE, RECORD, RECORD_SIZE, split_pwm
+
+try:
+    import numpy as np
+except ImportError:  # the producer side runs without NumPy
+    np = None
+
+INDEX_NAME = 'index.rec'
+PWM_NAME = 'pwm.rec'
+WAVES_NAME = 'waves.rec'
+SEGMENT_NAME = 'segment-{:06d}.rec'
+
+CAPTURE_MAGIC = b'GPIOCAP1'
+HEADER = struct.Struct('<8sIIQ16x')  # magic, version, block_records, segment_records
+# Per block: start_ns, end_ns, first_record, and masks of pins (bit = GPIO
+# number) whose level is known after the block, those levels, pins that
+# changed in the block and pins that changed more than once.
+INDEX_ENTRY = struct.Struct('<qqQIIII')
+assert HEADER.size == INDEX_ENTRY.size
+
+MASK_PINS = 32  # Pins above this are not summarized in the index masks
+
+if np is not None:
+    from event_format import RECORD_DTYPE, WaveTable
+
+    INDEX_DTYPE = np.dtype([
+        ('start_ns', '<i8'),
+        ('end_ns', '<i8'),
+        ('first_record', '<u8'),
+        ('known', '<u4'),
+        ('levels', '<u4'),
+        ('changed', '<u4'),
+        ('toggled', '<u4'),
+    ])
+    assert INDEX_DTYPE.itemsize == INDEX_ENTRY.size
+
+
+class CaptureWriter:
+    """
+    Appends encoded records to a capture directory.
+
+    write() takes the same chunks the log writer publishes. Files
+    are flushed after every write so a capture can be opened while it is
+    still being recorded.
+    """
+    def __init__(self, directory, block_records=4096, segment_records=1 << 22):
+        if segment_records % block_records:
+            raise ValueError("segment_records must be a multiple of block_records.")
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, INDEX_NAME)):
+            raise FileExistsError(f"{directory} already holds a capture.")
+        self.directory = directory
+        self.block_records = block_records
+        self.segment_records = segment_records
+        self.records = 0
+        self.segment = None
+        self.index = open(os.path.join(directory, INDEX_NAME), 'wb')
+        self.index.write(HEADER.pack(CAPTURE_MAGIC, 1, block_records, segment_records))
+        self.pwm = open(os.path.join(directory, PWM_NAME), 'wb')
+        self.pwm_head = None  # PWM record waiting for its payload
+        self.waves = open(os.path.join(directory, WAVES_NAME), 'wb')
+        self.wave_head = None  # Wave pulse record waiting for its payload
+        self.group_head = None  # Group write record waiting for its payload
+        self.last_ns = -2**63
+        self.known = 0
+        self.levels = 0
+        self.start_block()
+
+    def start_block(self):
+        self.block_first = self.records
+        self.block_start_ns = None
+        self.block_counts = {}
+
+    def close_block(self):
+        if self.records == self.block_first:
+            return
+        changed = toggled = 0
+        for pin, count in self.block_counts.items():
+            changed |= 1 << pin
+            if count > 1:
+                toggled |= 1 << pin
+        self.index.write(INDEX_ENTRY.pack(self.block_start_ns, self.last_ns, self.block_first,
+                                          self.known, self.levels, changed, toggled))
+        self.start_block()
+
+    def write(self, chunks):
+        for chunk in chunks:
+            chunk = memoryview(chunk)
+            offset = 0
+            while offset < len(chunk):
+                if self.records % self.segment_records == 0 and (self.segment is None or self.records):
+                    self.open_segment()
+                # Never let a part cross a block or segment boundary
+                room = self.block_records - self.records % self.block_records
+                part = chunk[offset:offset + room * RECORD_SIZE]
+                self.segment.write(part)
+                self.summarize(part)
+                self.records += len(part) // RECORD_SIZE
+                offset += len(part)
+                if self.records % self.block_records == 0:
+                    self.close_block()
+        for f in (self.segment, self.index, self.pwm, self.waves):
+            if f is not None:
+                f.flush()
+
+    def open_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+        number = self.records // self.segment_records
+        self.segment = open(os.path.join(self.directory, SEGMENT_NAME.format(number)), 'wb')
+
+    def summarize(self, part):
+        """
+        Update the block summary with a run of whole records. Works on
+        strided byte slices so the per-record work stays in C.
+        """
+        flags = bytes(part[1::RECORD_SIZE])
+        pins = bytearray(part[2::RECORD_SIZE])
+        if flags.count(0) != len(flags):
+            for i, flag in enumerate(flags):
+                if flag & FLAG_GROUP:
+                    self.add_group(part[i * RECORD_SIZE:(i + 1) * RECORD_SIZE], flag)
+                elif flag & FLAG_WAVE_PULSE:
+                    self.keep_wave(part[i * RECORD_SIZE:(i + 1) * RECORD_SIZE], flag)
+                elif flag:
+                    self.keep_pwm(part[i * RECORD_SIZE:(i + 1) * RECORD_SIZE], flag)
+                if flag:
+                    pins[i] = 0xFF  # Not an edge
+        for i in (0, len(pins) - 1):
+            if pins[i] != 0xFF:
+                time_ns = RECORD.unpack_from(part, i * RECORD_SIZE)[5]
+                if self.block_start_ns is None:
+                    self.block_start_ns = time_ns
+                self.last_ns = max(self.last_ns, time_ns)
+        if self.block_start_ns is None:
+            self.block_start_ns = self.last_ns
+        for pin in set(pins):
+            if pin >= MASK_PINS:
+                continue
+            self.block_counts[pin] = self.block_counts.get(pin, 0) + pins.count(pin)
+            bit = 1 << pin
+            self.known |= bit
+            if part[pins.rfind(pin) * RECORD_SIZE + 3]:
+                self.levels |= bit
+            else:
+                self.levels &= ~bit
+
+    def keep_pwm(self, record, flag):
+        if flag == FLAG_PWM:
+            self.pwm_head = bytes(record)
+        elif flag == FLAG_PWM | FLAG_PAYLOAD and self.pwm_head is not None:
+            self.pwm.write(self.pwm_head + bytes(record))
+            self.pwm_head = None
+
+    def keep_wave(self, record, flag):
+        if flag == FLAG_WAVE_PULSE:
+            self.wave_head = bytes(record)
+        elif self.wave_head is not None:
+            self.waves.write(self.wave_head + bytes(record))
+            self.wave_head = None
+
+    def add_group(self, record, flag):
+        """
+        Count a group write as an edge on every pin it wrote.
+        """
+        if flag == FLAG_GROUP:
+            self.group_head = RECORD.unpack(record)
+            time_ns = self.group_head[5]
+            if self.block_start_ns is None:
+                self.block_start_ns = time_ns
+            self.last_ns = max(self.last_ns, time_ns)
+        elif flag == FLAG_GROUP | FLAG_PAYLOAD and self.group_head is not None:
+            levels, mask = self.group_head[4], RECORD.unpack(record)[5] & (2**MASK_PINS - 1)
+            for pin in range(MASK_PINS):
+                if mask >> pin & 1:
+                    self.block_counts[pin] = self.block_counts.get(pin, 0) + 1
+            self.known |= mask
+            self.levels = self.levels & ~mask | levels & mask
+            self.group_head = None
+
+    def close(self):
+        self.close_block()
+        for f in (self.segment, self.index, self.pwm, self.waves):
+            if f is not None:
+                f.close()
+
+
+class CaptureReader:
+    """
+    Read access to a capture directory through memory maps.
+
+    Only the index, the PWM segments and the wave definitions (a WaveTable
+    in self.waves) are loaded into memory. A capture
+    that is still being recorded can be picked up again with refresh().
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_NAME), 'rb') as f:
+            magic, version, self.block_records, self.segment_records = HEADER.unpack(f.read(HEADER.size))
+        if magic != CAPTURE_MAGIC or version != 1:
+            raise ValueError(f"{directory} is not a supported capture.")
+        self.segments = []
+        self.refresh()
+
+    def refresh(self):
+        self.index = np.fromfile(os.path.join(self.directory, INDEX_NAME), dtype=INDEX_DTYPE, offset=HEADER.size)
+        self.pwm = split_pwm(np.fromfile(os.path.join(self.directory, PWM_NAME), dtype=RECORD_DTYPE))[1]
+        self.waves = WaveTable()
+        waves_path = os.path.join(self.directory, WAVES_NAME)
+        if os.path.exists(waves_path):  # Not in captures made before waves
+            self.waves.define(np.fromfile(waves_path, dtype=RECORD_DTYPE))
+        paths = sorted(glob.glob(os.path.join(self.directory, SEGMENT_NAME.replace('{:06d}', '*'))))
+        # Earlier segments are complete, only the last one may have grown
+        self.segments = self.segments[:max(min(len(self.segments), len(paths)) - 1, 0)]
+        for path in paths[len(self.segments):]:
+            size = os.path.getsize(path) // RECORD_SIZE
+            self.segments.append(np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(size,)) if size else
+                                 np.empty(0, dtype=RECORD_DTYPE))
+        self.total = sum(len(segment) for segment in self.segments)
+
+    def __len__(self):
+        return self.total
+
+    def time_range(self):
+        if not self.total:
+            return None
+        first = self.block(0)
+        last = self.block(max(self.total - self.block_records, 0))
+        edges = last[last['flags'] & FLAG_PAYLOAD == 0]
+        return int(first['timestamp'][0]), int(edges['timestamp'].max()) if len(edges) else int(first['timestamp'][0])
+
+    def records(self, start, end):
+        """
+        Records start to end (record numbers). A view into the memory map
+        unless the range crosses a segment boundary.
+        """
+        parts = []
+        while start < end:
+            number, offset = divmod(start, self.segment_records)
+            part = self.segments[number][offset:offset + end - start]
+            if not len(part):
+                break
+            parts.append(part)
+            start += len(part)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else self.segments[0][:0]
+
+    def block(self, start):
+        return self.records(start, min(start + self.block_records, self.total))
+
+    def find(self, time_ns):
+        """
+        Number of the first record at or after time_ns: a binary search in
+        the index, then a scan of a single block.
+        """
+        i = int(np.searchsorted(self.index['end_ns'], time_ns, 'left'))
+        if i < len(self.index):
+            start = int(self.index['first_record'][i])
+        else:
+            # Records after the last complete block are not indexed yet
+            start = min(len(self.index) * self.block_records, self.total)
+        block = self.block(start)
+        after = (block['timestamp'] >= time_ns) & (block['flags'] & FLAG_PAYLOAD == 0)
+        hits = np.flatnonzero(after)
+        return start + (int(hits[0]) if len(hits) else len(block))
+
+    def levels_before(self, record):
+        """
+        (known, levels) pin masks at the start of the block holding record.
+        """
+        i = record // self.block_records
+        if i == 0 or i > len(self.index):
+            return 0, 0
+        entry = self.index[i - 1]
+        return int(entry['known']), int(entry['levels'])
+
+    def read(self, start_ns, end_ns):
+        """
+        Records from the start of the block holding start_ns up to end_ns.
+
+        Returns (records, known, levels) where the masks give the pin levels
+        before the first returned record.
+        """
+        start = self.find(start_ns)
+        start -= start % self.block_records
+        end = self.find(end_ns + 1)
+        known, levels = self.levels_before(start)
+        return self.records(start, end), known, levels
+
+    def overview(self, start_ns, end_ns, pins):
+        """
+        Summarize [start_ns, end_ns] from the index alone, one step per block.
+
+        Returns {pin: (timestamps, states)}: a block where the pin changed once
+        becomes an edge at its middle, one where it changed more often a pair
+        of points showing both levels, in the style of visualizer.decimate().
+        """
+        first = int(np.searchsorted(self.index['end_ns'], start_ns, 'left'))
+        last = int(np.searchsorted(self.index['start_ns'], end_ns, 'right'))
+        entries = self.index[first:last]
+        before = self.index[first - 1] if first > 0 else None
+        begin = entries['start_ns']
+        middle = begin + (entries['end_ns'] - begin) // 2
+        result = {}
+        for pin in pins:
+            if pin >= MASK_PINS:
+                continue
+            bit = np.uint32(1 << pin)
+            changed = (entries['changed'] & bit) != 0
+            toggled = (entries['toggled'] & bit) != 0
+            level = ((entries['levels'] & bit) != 0).astype(np.uint8)
+            x = [middle[changed & ~toggled], begin[toggled], middle[toggled]]
+            y = [level[changed & ~toggled], 1 - level[toggled], level[toggled]]
+            if before is not None and before['known'] & bit:
+                x.insert(0, np.array([before['end_ns']]))
+                y.insert(0, np.array([1 if before['levels'] & bit else 0], dtype=np.uint8))
+            x = np.concatenate(x)
+            if not len(x):
+                continue
+            order = np.argsort(x, kind='stable')
+            result[pin] = x[order], np.concatenate(y)[order]
+        return result
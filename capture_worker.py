@@ -0,0 +1,337 @@
+"""
+Out-of-process capture of input edges.
+
+With GPIO(capture_process=True) the monitored input lines are claimed by a
+CaptureWorker: a separate process with its own handle of the chip and its
+own lgpio notification pipe, optionally pinned to its own cores. It copies
+the notification messages into a SharedRing as they come, and the
+application process drains the ring and handles the messages exactly like
+those of its own pipe. The kernel timestamps the edges, so all the worker
+has to do is keep the pipe from overflowing, which it does whatever the
+application does with the GIL. Outputs, groups, PWM and waves stay in the
+application process; read() of a monitored line returns the level the
+worker saw last, from the ring's level table.
+
+SharedRing lives in multiprocessing.shared_memory and has exactly one
+producer (the worker) and one consumer (the application), and each side
+only stores its own index, in its own cache line. Python has no memory
+barriers, and on weakly ordered CPUs like the ARM64 of a Pi 4 or 5 the
+consumer can see the new write index before the messages it covers. So
+the producer also stores a commit word in the padding of every message:
+the CRC-32 of its first 12 bytes seeded with its sequence number. The
+consumer takes messages up to the first one whose commit word does not
+match and leaves the rest for the next take(); a stale or half written
+slot fails the check. Each side only stores its index after the checks
+or copies it depends on.
+
+    offset 0    write index, messages written ever        (producer)
+    offset 64   read index, messages taken ever           (consumer)
+    offset 128  messages dropped because the ring was full (producer)
+    offset 192  level of every GPIO, one byte each         (producer)
+    offset 448  capacity slots of MESSAGE_SIZE bytes
+
+The worker is started with subprocess rather than multiprocessing, so the
+application's main module is not imported again in it, and takes commands
+(claim, free, call) over a socket pair.
+"""
+import argparse
+import importlib
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+from pigpio_lgpio import load_backend, notification_path
+
+MESSAGE_SIZE = 16  # lgpio notification message, see pigpio_lgpio.NOTIFICATION
+COMMITTED = struct.Struct('<12sI')  # Message without its padding, and the commit word in it
+RING_CAPACITY = 1 << 16  # Messages
+WRITE_INDEX, READ_INDEX, DROPPED = 0, 8, 16  # Counter positions, in 8 byte words
+LEVELS_OFFSET = 192
+SLOTS_OFFSET = 448
+START_TIMEOUT = 10  # Seconds for the worker to open the chip
+BOTH_EDGES = 3
+
+
+def commit_word(message, index):
+    return zlib.crc32(message, index & 0xffffffff)
+
+
+class SharedRing:
+    """
+    Single-producer single-consumer ring of notification messages in shared
+    memory. Created by the consumer, attached to by name by the producer.
+    """
+    def __init__(self, capacity=RING_CAPACITY, name=None):
+        self.capacity = capacity
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=SLOTS_OFFSET + capacity * MESSAGE_SIZE)
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            # Only the creator may unlink it (before Python 3.13, every
+            # process tracking it would on exit)
+            resource_tracker.unregister(self.memory._name, 'shared_memory')
+        buf = self.memory.buf
+        self.counters = buf[:LEVELS_OFFSET].cast('Q')
+        self.levels = buf[LEVELS_OFFSET:LEVELS_OFFSET + 256]
+        self.slots = buf[SLOTS_OFFSET:SLOTS_OFFSET + capacity * MESSAGE_SIZE]
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def dropped(self):
+        return self.counters[DROPPED]
+
+    def __len__(self):
+        return self.counters[WRITE_INDEX] - self.counters[READ_INDEX]
+
+    def put(self, data):
+        """
+        Producer side: append whole messages, dropping those that do not
+        fit. Returns the number of messages appended.
+        """
+        counters = self.counters
+        write = counters[WRITE_INDEX]
+        count = len(data) // MESSAGE_SIZE
+        free = self.capacity - (write - counters[READ_INDEX])
+        if count > free:
+            counters[DROPPED] += count - free
+            count = free
+        slots = self.slots
+        pack_into = COMMITTED.pack_into
+        for index in range(write, write + count):
+            offset = (index - write) * MESSAGE_SIZE
+            message = data[offset:offset + 12]
+            pack_into(slots, index % self.capacity * MESSAGE_SIZE, message, commit_word(message, index))
+        counters[WRITE_INDEX] = write + count  # Publishes the messages
+        return count
+
+    def take(self):
+        """
+        Consumer side: remove and return the messages written so far, up
+        to the first one that is not completely visible yet.
+        """
+        counters = self.counters
+        write = counters[WRITE_INDEX]
+        read = counters[READ_INDEX]
+        count = write - read
+        if not count:
+            return b''
+        start = read % self.capacity
+        first = min(count, self.capacity - start)
+        data = bytes(self.slots[start * MESSAGE_SIZE:(start + first) * MESSAGE_SIZE])
+        if count > first:
+            data += bytes(self.slots[:(count - first) * MESSAGE_SIZE])
+        committed = 0
+        for index, (message, commit) in enumerate(COMMITTED.iter_unpack(data), read):
+            if commit != commit_word(message, index):
+                break
+            committed += 1
+        counters[READ_INDEX] = read + committed  # Frees the slots
+        return data[:committed * MESSAGE_SIZE]
+
+    def close(self, unlink=False):
+        for view in (self.counters, self.levels, self.slots):
+            view.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class CaptureWorker:
+    """
+    Application side of a capture worker process.
+
+    :param backend: As for GPIO: 'lgpio', 'sim' or an importable module
+        with the lgpio API.
+    :param cpus: CPUs to pin the worker to, e.g. {3}, or None.
+    :param capacity: Ring capacity in messages.
+    """
+    def __init__(self, backend, chip_number, cpus=None, capacity=RING_CAPACITY):
+        if backend is None:
+            backend = os.environ.get('GPIO_BACKEND', 'lgpio')
+        if not isinstance(backend, str):
+            backend = backend.__name__
+        self.ring = SharedRing(capacity)
+        ours, theirs = socket.socketpair()
+        command = [sys.executable, os.path.abspath(__file__), '--backend', backend, '--chip', str(chip_number),
+                   '--ring', self.ring.name, '--capacity', str(capacity), '--control', str(theirs.fileno())]
+        if cpus:
+            command += ['--cpus', ','.join(str(cpu) for cpu in sorted(cpus))]
+        # The backend module may only be importable through our sys.path
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        try:
+            self.process = subprocess.Popen(command, pass_fds=[theirs.fileno()], env=env)
+        except OSError:
+            ours.close()
+            self.ring.close(unlink=True)
+            raise
+        finally:
+            theirs.close()
+        self.control = Connection(ours.detach())
+        try:
+            if not self.control.poll(START_TIMEOUT):
+                raise RuntimeError("The capture worker did not start.")
+            self.reply()
+        except Exception:
+            self.stop()
+            self.ring.close(unlink=True)
+            raise
+
+    def request(self, *command):
+        self.control.send(command)
+        return self.reply()
+
+    def reply(self):
+        try:
+            status, value = self.control.recv()
+        except EOFError:
+            raise RuntimeError("The capture worker exited.") from None
+        if status == 'error':
+            raise value
+        return value
+
+    def claim(self, gpio, flag, bouncetime=0):
+        """
+        Claim an input line with alerts in the worker. Returns its level.
+        """
+        return self.request('claim', gpio, flag, bouncetime)
+
+    def free(self, gpio):
+        self.request('free', gpio)
+
+    def call(self, name, *args, **kwargs):
+        """
+        Call a function of the backend in the worker with the worker's chip
+        handle as first argument, e.g. call('gpio_read', 4). A result that
+        cannot be sent back is returned as None.
+        """
+        return self.request('call', name, args, kwargs)
+
+    def level(self, gpio):
+        return self.ring.levels[gpio]
+
+    def stop(self):
+        """
+        Stop the worker process. What it wrote to the ring can still be
+        taken until ring.close(unlink=True).
+        """
+        if self.process.poll() is None:
+            try:
+                self.control.send(('stop',))
+            except OSError:
+                pass
+            try:
+                self.process.wait(START_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.control.close()
+
+
+def load_module(backend):
+    if backend in ('lgpio', 'sim'):
+        return load_backend(backend)
+    return load_backend(importlib.import_module(backend))
+
+
+def execute(lgpio, handle, notify_handle, ring, command):
+    if command[0] == 'claim':
+        gpio, flag, bouncetime = command[1:]
+        lgpio.gpio_claim_alert(handle, gpio, BOTH_EDGES, flag, notify_handle)
+        if bouncetime:
+            lgpio.gpio_set_debounce_micros(handle, gpio, bouncetime)
+        ring.levels[gpio] = level = lgpio.gpio_read(handle, gpio)
+        return level
+    if command[0] == 'free':
+        return lgpio.gpio_free(handle, command[1])
+    if command[0] == 'call':
+        name, args, kwargs = command[1:]
+        return getattr(lgpio, name)(handle, *args, **kwargs)
+    raise ValueError(f"Unknown capture worker command: {command[0]}")
+
+
+def run(backend, chip_number, ring_name, capacity, control, cpus=None):
+    """
+    The worker process: copy the notifications of the claimed lines into
+    the ring and answer commands until told to stop or the application
+    goes away.
+    """
+    # Ctrl-C is for the application, which stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    ring = SharedRing(capacity, ring_name)
+    lgpio = handle = notify_handle = notify_fd = None
+    try:
+        lgpio = load_module(backend)
+        handle = lgpio.gpiochip_open(chip_number)
+        notify_handle = lgpio.notify_open()
+        notify_fd = os.open(notification_path(lgpio, notify_handle), os.O_RDONLY | os.O_NONBLOCK)
+    except Exception as e:
+        control.send(('error', RuntimeError(f"Capture worker: {e}")))
+        raise
+    control.send(('ok', None))
+    levels = ring.levels
+    remainder = b''
+    try:
+        while True:
+            ready = select.select([notify_fd, control], [], [], 1.0)[0]
+            if notify_fd in ready:
+                try:
+                    data = remainder + os.read(notify_fd, 4096 * MESSAGE_SIZE)
+                except BlockingIOError:
+                    data = remainder
+                usable = len(data) - len(data) % MESSAGE_SIZE
+                remainder = data[usable:]
+                data = data[:usable]
+                ring.put(data)
+                # Levels after the batch, watchdog and other flagged messages skipped
+                for gpio, level, flags in zip(data[9::MESSAGE_SIZE], data[10::MESSAGE_SIZE], data[11::MESSAGE_SIZE]):
+                    if level <= 1 and not flags:
+                        levels[gpio] = level
+            if control in ready:
+                try:
+                    command = control.recv()
+                except EOFError:
+                    break  # The application is gone
+                if command[0] == 'stop':
+                    break
+                try:
+                    result = ('ok', execute(lgpio, handle, notify_handle, ring, command))
+                except Exception as e:
+                    result = ('error', e)
+                try:
+                    control.send(result)
+                except Exception:  # Result or exception that does not pickle
+                    control.send(('ok', None) if result[0] == 'ok' else ('error', RuntimeError(str(result[1]))))
+    finally:
+        os.close(notify_fd)
+        lgpio.notify_close(notify_handle)
+        lgpio.gpiochip_close(handle)
+        ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture worker process, started by GPIO(capture_process=True).")
+    parser.add_argument('--backend', required=True)
+    parser.add_argument('--chip', type=int, required=True)
+    parser.add_argument('--ring', required=True)
+    parser.add_argument('--capacity', type=int, required=True)
+    parser.add_argument('--control', type=int, required=True)
+    parser.add_argument('--cpus')
+    args = parser.parse_args()
+    cpus = {int(cpu) for cpu in args.cpus.split(',')} if args.cpus else None
+    run(args.backend, args.chip, args.ring, args.capacity, Connection(args.control), cpus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+Export the event stream to VCD or sigrok files, and import VCD files.
+
+ExportWriter takes the same chunks of wire records as CaptureWriter, so it
+works as a live subscriber, as a GPIO recorder (start_recording('x.vcd'))
+and to convert a recorded capture. Group writes, waves and PWM segments
+are expanded into edges, and edges are held back until nothing older can
+arrive any more, so the file is written in time order while memory stays
+bounded by one batch.
+
+    python convert.py my_capture out.vcd          capture to VCD
+    python convert.py my_capture out.sr --samplerate 4MHz
+    python convert.py --live out.vcd --pins 4,17  live events until Ctrl-C
+    python convert.py in.vcd my_capture           VCD to capture
+"""
+import argparse
+import os
+import select
+import time
+
+import numpy as np
+
+from capture import CaptureReader
+from event_format import RECORD_DTYPE, WIRE_VERSION, EventDecoder, WaveTable, expand_groups, split_pwm, split_stats
+from event_server import EVENT_SOCKET_NAME, subscribe
+from sigrok import SigrokWriter
+from trigger import parse_duration
+from vcd import VCDWriter, import_vcd
+
+DEFAULT_PINS = range(2, 28)  # The pins the visualizer draws
+LIVE_LATENCY_NS = 300_000_000  # How late live events may arrive
+MAX_PWM_EDGES = 1 << 20  # PWM edges generated at once
+CAPTURE_CHUNK = 1 << 20  # Records converted at once
+
+
+def edge_array(timestamps, pins, levels):
+    edges = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+    edges['version'] = WIRE_VERSION
+    edges['timestamp'] = timestamps
+    edges['pin'] = pins
+    edges['level'] = levels
+    return edges
+
+
+def pwm_edges(pin, start_ns, period_ns, high_ns, first_ns, last_ns):
+    """
+    Edges of a PWM segment started at start_ns in [first_ns, last_ns).
+    """
+    if high_ns <= 0 or high_ns >= period_ns:
+        # Constant level, one edge at the start
+        inside = first_ns <= start_ns < last_ns
+        return edge_array([start_ns] * inside, pin, [int(high_ns > 0)] * inside)
+    k = np.arange(max((first_ns - start_ns) // period_ns, 0), (last_ns - start_ns) // period_ns + 1)
+    times = (start_ns + k * period_ns)[:, None] + np.array([0, high_ns])
+    edges = edge_array(times.ravel(), pin, np.tile([1, 0], len(k)))
+    return edges[(edges['timestamp'] >= first_ns) & (edges['timestamp'] < last_ns)]
+
+
+class ExportWriter:
+    """
+    Writes wire records to a VCD (.vcd) or sigrok (.sr) file as they come.
+
+    :param pins: GPIO numbers to export.
+    :param samplerate: Samples per second of a sigrok file.
+    :param live: Records come from a running GPIO: edges are written once
+        they are LIVE_LATENCY_NS old. Otherwise they are written as soon as
+        the records of a batch are past them.
+    :param levels: {pin: level} known before the first record.
+    """
+    def __init__(self, path, pins=DEFAULT_PINS, samplerate=1_000_000, live=False, levels=None):
+        if not path.endswith(('.vcd', '.sr')):
+            raise ValueError(f"Unknown export format: {path}, use .vcd or .sr")
+        self.path = path
+        self.pins = list(pins)
+        self.samplerate = samplerate
+        self.live = live
+        self.levels = levels
+        self.writer = None  # Created with the first record, which gives the start time
+        self.decoder = EventDecoder()
+        self.waves = WaveTable()
+        self.pwm = []  # [pin, start_ns, period_ns, high_ns, stop_ns or None] of segments not written yet
+        self.held = np.empty(0, dtype=RECORD_DTYPE)  # Edges not written yet
+        self.written_ns = None  # Everything before this is written
+
+    def write(self, chunks):
+        self.add(self.decoder.feed(b''.join(chunks)))
+
+    def add(self, records):
+        """
+        Add decoded records and write what is complete: everything before
+        the newest record, or live, everything LIVE_LATENCY_NS old.
+        """
+        records = split_stats(records)[0]
+        until_ns = time.time_ns() - LIVE_LATENCY_NS if self.live else None
+        if len(records):
+            records = self.waves.expand(expand_groups(records))
+            records, segments = split_pwm(records)
+            edges = records[records['flags'] == 0]
+            times = np.concatenate([edges['timestamp'], segments['timestamp']])
+            if not len(times):
+                return
+            if self.writer is None:
+                self.start(int(times.min()))
+            self.held = np.concatenate([self.held, edges, self.add_segments(segments)])
+            if not self.live:
+                until_ns = int(times.max())
+        if until_ns is not None and self.writer is not None:
+            self.flush(until_ns)
+
+    def start(self, start_ns):
+        if self.path.endswith('.vcd'):
+            self.writer = VCDWriter(self.path, self.pins, start_ns, self.levels)
+        else:
+            self.writer = SigrokWriter(self.path, self.pins, start_ns, self.samplerate, self.levels)
+        self.written_ns = start_ns
+
+    def add_segments(self, segments):
+        """
+        Start or stop PWM segments. Returns the edges of the stops: the line
+        is low after a PWM channel stops.
+        """
+        stops = []
+        for pin, running, start_ns, period_ns, high_ns in segments.tolist():
+            for segment in self.pwm:
+                if segment[0] == pin and segment[4] is None:
+                    segment[4] = start_ns
+            if running:
+                self.pwm.append([pin, start_ns, period_ns, high_ns, None])
+            else:
+                stops.append((start_ns, pin, 0))
+        return edge_array(*zip(*stops)) if stops else np.empty(0, dtype=RECORD_DTYPE)
+
+    def add_edges(self, edges, segments=()):
+        """
+        Add edges (a RECORD_DTYPE array) and PWM segments given as [pin,
+        start_ns, period_ns, high_ns, stop_ns or None] that are already
+        decoded, e.g. a visualizer's pin histories. start() must have been
+        called.
+        """
+        self.held = np.concatenate([self.held, edges])
+        self.pwm += [list(segment) for segment in segments]
+
+    def flush(self, until_ns):
+        """
+        Write the held edges and the PWM edges before until_ns in time
+        order, generating at most about MAX_PWM_EDGES at a time.
+        """
+        while self.written_ns < until_ns:
+            rate = sum(2 / max(period_ns, 1) for _, _, period_ns, _, _ in self.pwm)
+            end_ns = until_ns if not rate else min(until_ns, self.written_ns + max(int(MAX_PWM_EDGES / rate), 1))
+            parts = [self.held]
+            for pin, start_ns, period_ns, high_ns, stop_ns in self.pwm:
+                last_ns = end_ns if stop_ns is None else min(end_ns, stop_ns)
+                parts.append(pwm_edges(pin, start_ns, period_ns, high_ns, max(self.written_ns, start_ns), last_ns))
+            edges = np.concatenate(parts)
+            edges = edges[np.argsort(edges['timestamp'], kind='stable')]
+            done = int(np.searchsorted(edges['timestamp'], end_ns, 'left'))
+            # Late edges are written at the current time, files cannot go back
+            self.writer.write(np.maximum(edges['timestamp'][:done], self.written_ns),
+                              edges['pin'][:done], edges['level'][:done])
+            self.held = edges[done:]  # PWM edges are only generated before end_ns
+            self.written_ns = end_ns
+            self.pwm = [segment for segment in self.pwm if segment[4] is None or segment[4] > end_ns]
+
+    def close(self, end_ns=None):
+        """
+        Write everything held and close the file. Running PWM segments end
+        at end_ns, by default now if live, else the last edge.
+        """
+        if self.writer is None:
+            return
+        if end_ns is None:
+            end_ns = time.time_ns() if self.live else self.written_ns
+        if len(self.held):
+            end_ns = max(end_ns, int(self.held['timestamp'].max()) + 1)
+        self.flush(end_ns)
+        self.writer.close(end_ns)
+        self.writer = None
+
+
+def export_capture(directory, path, start_ns=None, end_ns=None, **kwargs):
+    """
+    Convert a capture, or its records between start_ns and end_ns, to a VCD
+    or sigrok file. By default the exported pins are those seen in the
+    capture.
+    """
+    reader = CaptureReader(directory)
+    if not len(reader):
+        raise ValueError(f"{directory} holds no events.")
+    first = 0 if start_ns is None else reader.find(start_ns)
+    last = len(reader) if end_ns is None else reader.find(end_ns + 1)
+    if first >= last:
+        raise ValueError(f"{directory} holds no events in the range.")
+    if 'pins' not in kwargs:
+        seen = int(np.bitwise_or.reduce(reader.index['known'])) if len(reader.index) else 0
+        pins = [pin for pin in range(32) if seen >> pin & 1] + np.unique(reader.pwm['pin']).tolist()
+        kwargs['pins'] = sorted(set(pins)) or DEFAULT_PINS
+    if first:
+        kwargs['levels'] = levels_at(reader, first)
+    writer = ExportWriter(path, **kwargs)
+    writer.waves = reader.waves
+    if first:
+        # PWM channels left running before the exported range
+        writer.start(start_ns)
+        segments = reader.pwm[reader.pwm['timestamp'] < start_ns]
+        latest = np.unique(segments['pin'][::-1], return_index=True)[1]
+        running = segments[::-1][latest]
+        writer.add_segments(running[running['level'] == 1])
+    for start in range(first, last, CAPTURE_CHUNK):
+        writer.write([reader.records(start, min(start + CAPTURE_CHUNK, last)).tobytes()])
+    writer.close(end_ns)
+    return path
+
+
+def levels_at(reader, record):
+    """
+    {pin: level} of the pins known just before a record of a capture: the
+    index masks of its block, then the edges in the block before it.
+    """
+    block = record - record % reader.block_records
+    known, masks = reader.levels_before(block)
+    levels = {pin: masks >> pin & 1 for pin in range(32) if known >> pin & 1}
+    records = EventDecoder().feed(reader.records(block, record).tobytes())
+    edges = split_pwm(reader.waves.expand(expand_groups(split_stats(records)[0])))[0]
+    edges = edges[(edges['flags'] == 0) & (edges['timestamp'] < reader.records(record, record + 1)['timestamp'][0])]
+    edges = edges[np.argsort(edges['timestamp'], kind='stable')]
+    levels.update(zip(edges['pin'].tolist(), edges['level'].tolist()))
+    return levels
+
+
+def export_live(path, socket_path=EVENT_SOCKET_NAME, **kwargs):
+    """
+    Subscribe to an event server and export its events until interrupted.
+    """
+    events = subscribe(socket_path, pins=kwargs.get('pins', DEFAULT_PINS))
+    writer = ExportWriter(path, live=True, **kwargs)
+    try:
+        while True:
+            if not select.select([events], [], [], 0.1)[0]:
+                writer.add(np.empty(0, dtype=RECORD_DTYPE))
+                continue
+            data = events.recv(1 << 20)
+            if not data:
+                break  # The server went away
+            writer.write([data])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        events.close()
+        writer.close()
+    return path
+
+
+def parse_samplerate(text):
+    """
+    Samples per second in a rate like '4MHz', '500 kHz' or '1000000'.
+    """
+    scales = {'': 1, 'hz': 1, 'khz': 10**3, 'mhz': 10**6, 'ghz': 10**9}
+    number = text.strip().lower().rstrip('hz').rstrip('kmg')
+    unit = text.strip().lower()[len(number):].strip()
+    try:
+        return int(float(number) * scales[unit])
+    except (KeyError, ValueError):
+        raise ValueError(f"Bad sample rate: {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source', nargs='?', help='capture directory or .vcd file')
+    parser.add_argument('destination', help='.vcd or .sr file, or a capture directory for a .vcd source')
+    parser.add_argument('--live', action='store_true', help='export live events instead of a source')
+    parser.add_argument('--socket', default=EVENT_SOCKET_NAME, help='event server of --live')
+    parser.add_argument('--pins', help='GPIOs to export, e.g. 4,17')
+    parser.add_argument('--samplerate', default='1MHz', help='sample rate of a .sr file')
+    parser.add_argument('--start', help='export from this long after the start of the capture, e.g. 2s')
+    parser.add_argument('--length', help='export this long, e.g. 500ms')
+    args = parser.parse_args()
+    try:
+        kwargs = {'samplerate': parse_samplerate(args.samplerate)}
+        if args.pins:
+            kwargs['pins'] = [int(pin) for pin in args.pins.split(',')]
+        if args.live:
+            if args.source is not None:
+                parser.error('--live takes no source')
+            export_live(args.destination, args.socket, **kwargs)
+        elif args.source is None:
+            parser.error('a source is needed without --live')
+        elif args.source.endswith('.vcd'):
+            import_vcd(args.source, args.destination)
+        elif os.path.isdir(args.source):
+            start_ns = end_ns = None
+            if args.start or args.length:
+                begin = CaptureReader(args.source).time_range()[0]
+                start_ns = begin + (parse_duration(args.start) if args.start else 0)
+                end_ns = start_ns + parse_duration(args.length) if args.length else None
+            export_capture(args.source, args.destination, start_ns, end_ns, **kwargs)
+        else:
+            parser.error(f'{args.source} is neither a capture directory nor a .vcd file')
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
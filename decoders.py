@@ -0,0 +1,396 @@
+"""
+Protocol decoders turning the edges of the event stream into annotations.
+
+A decoder is fed batches of plain edge records in time order (the same
+arrays the visualizer stores) with feed(). Its pins' edges are kept only
+until they have been decoded: every decode() call works on the edges since
+the end of the last complete frame, so old edges are never decoded twice.
+Start bits and clock edges are found with NumPy over the whole batch and
+the data bits are sampled with one np.searchsorted per line.
+
+Decoded frames are cached as ANNOTATION_DTYPE arrays; window() returns
+those overlapping a time range and label() the text of one of them.
+
+Decoders are written as short specs, see parse_decoder():
+
+    uart:15:115200       UART on GPIO15, 8N1 at 115200 baud
+    uart:15:9600:8E2     with data bits, parity (N, E, O) and stop bits
+    i2c:2,3              I2C, SDA on GPIO2 and SCL on GPIO3
+    spi:11,10,9,8        SPI: SCLK, MOSI, MISO and CS (active low); MISO
+                         and CS may be left out, '-' skips MISO
+    spi:11,10,-,8:3      ... in SPI mode 3
+    onewire:4            1-Wire on GPIO4
+"""
+import abc
+
+import numpy as np
+
+ANNOTATION_DTYPE = np.dtype([
+    ('start_ns', '<i8'),
+    ('end_ns', '<i8'),
+    ('kind', '<u1'),
+    ('value', '<u4'),
+])
+
+MAX_ANNOTATIONS = 100000  # Decoded frames cached per decoder
+MAX_PENDING = 1 << 20  # Undecoded edges kept per pin
+
+
+def parse_decoder(spec):
+    """
+    The Decoder described by a spec string, see the module docstring.
+    """
+    kind, _, arguments = spec.strip().partition(':')
+    fields = arguments.split(':')
+    try:
+        if kind == 'uart':
+            pin, baud = int(fields[0]), float(fields[1])
+            if len(fields) > 2:
+                bits, parity, stop_bits = fields[2][0], fields[2][1].upper(), fields[2][2]
+                return UARTDecoder(pin, baud, int(bits), {'N': None, 'E': 'even', 'O': 'odd'}[parity],
+                                   int(stop_bits))
+            return UARTDecoder(pin, baud)
+        if kind == 'i2c':
+            sda, scl = fields[0].split(',')
+            return I2CDecoder(int(sda), int(scl))
+        if kind == 'spi':
+            pins = [None if pin.strip() == '-' else int(pin) for pin in fields[0].split(',')]
+            pins += [None] * (4 - len(pins))
+            return SPIDecoder(*pins, mode=int(fields[1]) if len(fields) > 1 else 0)
+        if kind == 'onewire':
+            return OneWireDecoder(int(fields[0]))
+    except (ValueError, IndexError, KeyError, TypeError):
+        pass
+    raise ValueError(f"Bad decoder: {spec}")
+
+
+def complete_words(segments, size):
+    """
+    Index of the first sample of every complete word of size samples, given
+    the segment number of each sample (non-decreasing). Words start anew in
+    every segment and an incomplete word at the end of one is skipped.
+    """
+    starts = np.flatnonzero(np.diff(segments, prepend=-1))
+    counts = np.diff(np.append(starts, len(segments)))
+    position = np.arange(len(segments)) - np.repeat(starts, counts)
+    count = np.repeat(counts, counts)
+    return np.flatnonzero((position % size == 0) & (position + size <= count))
+
+
+def pack_bits(bits, starts, size, msb_first=True):
+    """
+    Values of the words of size bits starting at the indices starts.
+    """
+    weights = 1 << np.arange(size - 1, -1, -1) if msb_first else 1 << np.arange(size)
+    return (bits[starts[:, None] + np.arange(size)].astype(np.int64) * weights).sum(axis=1)
+
+
+class Decoder(abc.ABC):
+    """
+    Base class keeping the undecoded edges of the decoder's pins.
+
+    Subclasses implement decode(until_ns), returning the annotations found
+    in the pending edges and the time up to which those edges are used up.
+    """
+    name = 'decoder'
+    idle = 1  # Level of a line before its first edge
+    labels = {}  # kind -> format string of value
+
+    def __init__(self, pins):
+        self.pins = [pin for pin in pins if pin is not None]
+        self.edges = {pin: (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)) for pin in self.pins}
+        self.before = {pin: None for pin in self.pins}  # Level before the pending edges
+        self.annotations = np.empty(0, dtype=ANNOTATION_DTYPE)
+        self.last_ns = -2**63
+
+    def feed(self, records, until_ns=None):
+        """
+        Decode a batch of plain edge records in time order. until_ns is the
+        time up to which all edges have been received, by default the last
+        one; it ends frames that finish with the line idle. Returns the new
+        annotations.
+        """
+        for pin in self.pins:
+            mine = records['pin'] == pin
+            if not mine.any():
+                continue
+            timestamps, levels = self.edges[pin]
+            new_timestamps, new_levels = records['timestamp'][mine], records['level'][mine]
+            last = levels[-1] if len(levels) else self.before[pin]
+            if last is None:
+                last = self.before[pin] = 1 - new_levels[0]
+            # Keep changes only, writes of the same level are not edges
+            changed = new_levels != np.concatenate([[last], new_levels[:-1]])
+            timestamps = np.concatenate([timestamps, new_timestamps[changed]])
+            levels = np.concatenate([levels, new_levels[changed]])
+            if len(timestamps) > MAX_PENDING:
+                self.before[pin] = levels[-MAX_PENDING - 1]
+                timestamps, levels = timestamps[-MAX_PENDING:], levels[-MAX_PENDING:]
+            self.edges[pin] = timestamps, levels
+            if len(timestamps):
+                self.last_ns = max(self.last_ns, int(timestamps[-1]))
+        annotations, consumed_ns = self.decode(self.last_ns if until_ns is None else until_ns)
+        for pin in self.pins:
+            timestamps, levels = self.edges[pin]
+            used = int(np.searchsorted(timestamps, consumed_ns, 'left'))
+            if used:
+                self.before[pin] = levels[used - 1]
+                self.edges[pin] = timestamps[used:], levels[used:]
+        if len(annotations):
+            annotations = annotations[np.argsort(annotations['start_ns'], kind='stable')]
+            self.annotations = np.concatenate([self.annotations, annotations])[-MAX_ANNOTATIONS:]
+        return annotations
+
+    @abc.abstractmethod
+    def decode(self, until_ns):
+        """
+        Annotations found in the pending edges up to until_ns, and the time
+        up to which those edges are used up.
+        """
+
+    def level_at(self, pin, times):
+        """
+        Level of a pin at each of times, edges at the same time included.
+        """
+        timestamps, levels = self.edges[pin]
+        before = self.before[pin] if self.before[pin] is not None else self.idle
+        index = np.searchsorted(timestamps, times, 'right') - 1
+        if not len(levels):
+            return np.full(len(index), before, dtype=np.uint8)
+        return np.where(index >= 0, levels[np.maximum(index, 0)], before).astype(np.uint8)
+
+    def window(self, start_ns, end_ns):
+        """
+        Cached annotations overlapping [start_ns, end_ns].
+        """
+        annotations = self.annotations
+        first = int(np.searchsorted(annotations['end_ns'], start_ns, 'left'))
+        last = int(np.searchsorted(annotations['start_ns'], end_ns, 'right'))
+        return annotations[first:max(first, last)]
+
+    def label(self, kind, value):
+        return self.labels[kind].format(value=value)
+
+    @staticmethod
+    def make_annotations(start_ns, end_ns, kind, value):
+        annotations = np.empty(len(start_ns), dtype=ANNOTATION_DTYPE)
+        annotations['start_ns'] = start_ns
+        annotations['end_ns'] = end_ns
+        annotations['kind'] = kind
+        annotations['value'] = value
+        return annotations
+
+
+class UARTDecoder(Decoder):
+    """
+    Asynchronous serial, idle high, LSB first. A frame is decoded once the
+    time for its stop bits has passed.
+    """
+    name = 'UART'
+    DATA, ERROR = 0, 1
+    labels = {DATA: '{value:#04x}', ERROR: '{value:#04x}!'}
+
+    def __init__(self, pin, baud, bits=8, parity=None, stop_bits=1):
+        if parity not in (None, 'even', 'odd'):
+            raise ValueError(f"Unknown parity: {parity}")
+        super().__init__([pin])
+        self.pin = pin
+        self.bit_ns = 1e9 / baud
+        self.bits = bits
+        self.parity = parity
+        self.stop_bits = stop_bits
+        self.frame_bits = 1 + bits + (parity is not None) + stop_bits
+
+    def decode(self, until_ns):
+        timestamps, levels = self.edges[self.pin]
+        falls = timestamps[levels == 0]
+        frame_ns = self.frame_bits * self.bit_ns
+        # The start bit following the one at each falling edge can only begin
+        # after the middle of the last stop bit; following the chain from the
+        # first edge picks the start bits out of the data edges
+        following = np.searchsorted(falls, falls + (frame_ns - self.bit_ns / 2), 'left').tolist()
+        complete = int(np.searchsorted(falls, until_ns - frame_ns, 'right'))
+        chain = []
+        i = 0
+        while i < complete:
+            chain.append(i)
+            i = following[i]
+        if not chain:
+            return np.empty(0, dtype=ANNOTATION_DTYPE), falls[0] if len(falls) else until_ns
+        starts = falls[chain]
+        middles = (np.arange(self.frame_bits) + 0.5) * self.bit_ns
+        samples = self.level_at(self.pin, (starts[:, None] + middles).ravel()).reshape(len(starts), -1)
+        data = samples[:, 1:1 + self.bits]
+        values = (data.astype(np.int64) << np.arange(self.bits)).sum(axis=1)
+        ok = (samples[:, 0] == 0) & (samples[:, -self.stop_bits:] == 1).all(axis=1)
+        if self.parity is not None:
+            ones = data.sum(axis=1) + samples[:, 1 + self.bits]
+            ok &= ones % 2 == (0 if self.parity == 'even' else 1)
+        ends = starts + int(frame_ns)
+        annotations = self.make_annotations(starts, ends, np.where(ok, self.DATA, self.ERROR), values)
+        return annotations, int(ends[-1])
+
+
+class I2CDecoder(Decoder):
+    """
+    I2C: START and STOP conditions, then 9 bits per byte sampled on the
+    rising edges of SCL, the first byte of a transfer being the address.
+    """
+    name = 'I2C'
+    START, REPEATED_START, STOP, ADDRESS, DATA = range(5)
+    NACK = 1 << 8  # Set in the value of a byte that was not acknowledged
+    labels = {START: 'S', REPEATED_START: 'Sr', STOP: 'P'}
+
+    def __init__(self, sda, scl):
+        super().__init__([sda, scl])
+        self.sda = sda
+        self.scl = scl
+        self.byte_index = None  # Bytes of the current transfer so far, None outside of one
+
+    def label(self, kind, value):
+        nack = ' NACK' if value & self.NACK else ''
+        if kind == self.ADDRESS:
+            return f"{(value & 0xff) >> 1:#04x} {'R' if value & 1 else 'W'}{nack}"
+        if kind == self.DATA:
+            return f'{value & 0xff:#04x}{nack}'
+        return super().label(kind, value)
+
+    def decode(self, until_ns):
+        sda_times, sda_levels = self.edges[self.sda]
+        scl_times, scl_levels = self.edges[self.scl]
+        # SDA changing while SCL is high is a START (falling) or STOP (rising)
+        condition = self.level_at(self.scl, sda_times) == 1
+        condition_times = sda_times[condition]
+        starts = sda_levels[condition] == 0
+        rises = scl_times[scl_levels == 1]
+        bits = self.level_at(self.sda, rises)
+        # Bits belong to the transfer opened by the last condition before them
+        segments = np.searchsorted(condition_times, rises, 'right')
+        states = [self.byte_index]
+        for is_start in starts.tolist():
+            states.append(0 if is_start else None)
+        words = complete_words(segments, 9)
+        in_transfer = np.array([states[segment] is not None for segment in segments[words].tolist()], dtype=bool)
+        first = words[in_transfer]
+        values = pack_bits(bits, first, 8) | np.where(bits[first + 8] == 1, self.NACK, 0)
+        # Index of each byte in its transfer decides which one is the address
+        segment_first = np.searchsorted(segments, segments[first], 'left')
+        index = (first - segment_first) // 9
+        carried = self.byte_index or 0
+        index += np.where(segments[first] == 0, carried, 0)
+        kinds = [self.REPEATED_START if is_start and states[i] is not None else
+                 self.START if is_start else self.STOP for i, is_start in enumerate(starts.tolist())]
+        annotations = np.concatenate([
+            self.make_annotations(condition_times, condition_times, kinds, 0),
+            self.make_annotations(rises[first], rises[first + 8], np.where(index == 0, self.ADDRESS, self.DATA),
+                                  values),
+        ])
+        consumed_ns = -2**63
+        if len(condition_times):
+            consumed_ns = int(condition_times[-1]) + 1
+            self.byte_index = 0 if starts[-1] else None
+        # Words outside of a transfer are skipped but used up as well
+        if len(words) and rises[words[-1] + 8] >= consumed_ns:
+            consumed_ns = int(rises[words[-1] + 8]) + 1
+            self.byte_index = int(index[-1]) + 1 if in_transfer[-1] else None
+        return annotations, consumed_ns
+
+
+class SPIDecoder(Decoder):
+    """
+    SPI words of bits bits, MSB first, sampled on the clock edge of the SPI
+    mode. With a CS line, words start when CS goes low and bits are only
+    taken while it is low.
+    """
+    name = 'SPI'
+    DATA = 0
+    idle = 1  # CS is active low; the clock's idle level does not matter
+
+    def __init__(self, sclk, mosi, miso=None, cs=None, mode=0, bits=8):
+        if mode not in range(4) or not 1 <= bits <= 16:
+            raise ValueError("SPI mode must be 0 to 3 and words 1 to 16 bits.")
+        super().__init__([sclk, mosi, miso, cs])
+        self.sclk = sclk
+        self.mosi = mosi
+        self.miso = miso
+        self.cs = cs
+        self.sample_level = 1 if mode in (0, 3) else 0  # Clock level after the sampling edge
+        self.bits = bits
+
+    def label(self, kind, value):
+        mosi = f'{value & 0xffff:#x}'
+        return mosi if self.miso is None else f'{mosi}/{value >> 16:#x}'
+
+    def decode(self, until_ns):
+        clock_times, clock_levels = self.edges[self.sclk]
+        samples = clock_times[clock_levels == self.sample_level]
+        consumed_ns = -2**63
+        if self.cs is not None:
+            cs_times, cs_levels = self.edges[self.cs]
+            selects = cs_times[cs_levels == 0]
+            samples = samples[self.level_at(self.cs, samples) == 0]
+            segments = np.searchsorted(selects, samples, 'right')
+            if len(selects):
+                # A word cut short by a new select is dropped
+                consumed_ns = int(selects[-1])
+        else:
+            segments = np.zeros(len(samples), dtype=np.intp)
+        first = complete_words(segments, self.bits)
+        values = pack_bits(self.level_at(self.mosi, samples), first, self.bits)
+        if self.miso is not None:
+            values |= pack_bits(self.level_at(self.miso, samples), first, self.bits) << 16
+        ends = samples[first + self.bits - 1]
+        if len(first) and ends[-1] >= consumed_ns:
+            consumed_ns = int(ends[-1]) + 1
+        return self.make_annotations(samples[first], ends, self.DATA, values), consumed_ns
+
+
+class OneWireDecoder(Decoder):
+    """
+    1-Wire: reset and presence pulses, then bytes LSB first. A low pulse
+    longer than sample_ns is a 0 bit.
+    """
+    name = '1-Wire'
+    RESET, PRESENCE, DATA = range(3)
+    labels = {RESET: 'Reset', PRESENCE: 'Presence', DATA: '{value:#04x}'}
+    RESET_NS = 480_000
+    PRESENCE_NS = (60_000, 300_000)
+
+    def __init__(self, pin, sample_ns=15_000):
+        super().__init__([pin])
+        self.pin = pin
+        self.sample_ns = sample_ns
+        self.after_reset = False  # The last pulse decoded was a reset
+
+    def decode(self, until_ns):
+        timestamps, levels = self.edges[self.pin]
+        falls = np.flatnonzero(levels[:-1] == 0)
+        if not len(falls):
+            return np.empty(0, dtype=ANNOTATION_DTYPE), -2**63
+        lows, highs = timestamps[falls], timestamps[falls + 1]
+        widths = highs - lows
+        resets = widths >= self.RESET_NS
+        previous_reset = np.concatenate([[self.after_reset], resets[:-1]])
+        presences = previous_reset & (widths >= self.PRESENCE_NS[0]) & (widths <= self.PRESENCE_NS[1])
+        is_bit = ~resets & ~presences
+        bits = (widths[is_bit] <= self.sample_ns).astype(np.uint8)
+        bit_lows, bit_highs = lows[is_bit], highs[is_bit]
+        reset_times = lows[resets]
+        segments = np.searchsorted(reset_times, bit_lows, 'right')
+        first = complete_words(segments, 8)
+        values = pack_bits(bits, first, 8, msb_first=False)
+        annotations = np.concatenate([
+            self.make_annotations(lows[resets], highs[resets], self.RESET, 0),
+            self.make_annotations(lows[presences], highs[presences], self.PRESENCE, 0),
+            self.make_annotations(bit_lows[first], bit_highs[first + 7], self.DATA, values),
+        ])
+        consumed_ns = -2**63
+        pulses = resets | presences
+        if pulses.any():
+            last = int(np.flatnonzero(pulses)[-1])
+            consumed_ns = int(highs[last]) + 1
+            self.after_reset = bool(resets[last])
+        if len(first) and bit_highs[first[-1] + 7] >= consumed_ns:
+            consumed_ns = int(bit_highs[first[-1] + 7]) + 1
+            self.after_reset = False
+        return annotations, consumed_ns
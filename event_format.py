@@ -0,0 +1,426 @@
+"""
+Wire format for GPIO activity events sent from pigpio_lgpio to the visualizer.
+
+Every event is a fixed 16 byte little-endian record:
+
+    version    u8   WIRE_VERSION, checked by the reader
+    flags      u8   FLAG_* bits, 0 for a plain pin edge
+    pin        u8   GPIO number
+    level      u8   0 or 1
+    value      u32  payload for flagged records, 0 for plain edges
+    timestamp  i64  time.time_ns() of the event
+
+A PWM channel is not sent as edges but as one periodic segment, which
+takes two consecutive records:
+
+    FLAG_PWM                 level 1 = running, 0 = stopped,
+                             value = duty cycle in parts per billion,
+                             timestamp = start (or stop) time
+    FLAG_PWM | FLAG_PAYLOAD  same pin, timestamp field = period in ns
+
+A group write (several pins updated at once) is also a pair:
+
+    FLAG_GROUP                 pin = group leader, value = new levels,
+                               bit n being GPIO n
+    FLAG_GROUP | FLAG_PAYLOAD  same pin, timestamp field = mask of the GPIOs
+                               that were written
+
+A wave (see GPIO.wave_create) is described once by one pair per pulse:
+
+    FLAG_WAVE_PULSE                 value = wave id, timestamp = offset of
+                                    the pulse from the start of the wave;
+                                    offset 0 starts a new definition
+    FLAG_WAVE_PULSE | FLAG_PAYLOAD  value = mask of the GPIOs switched on,
+                                    timestamp field = mask of those switched off
+
+and every transmission of it by a pair:
+
+    FLAG_WAVE                 pin = group leader, value = wave id,
+                              timestamp = start time
+    FLAG_WAVE | FLAG_PAYLOAD  value = number of repeats, timestamp field =
+                              length of the wave in ns
+
+Once a second the producer also reports its own health, one pair per
+metric of STATS_METRICS:
+
+    FLAG_STATS                 pin = index of the metric in STATS_METRICS,
+                               timestamp = time of the report
+    FLAG_STATS | FLAG_PAYLOAD  same pin, timestamp field = value of the metric
+
+The producer only needs the struct module; decoding on the visualizer side
+uses NumPy so a whole read is turned into columns in one call. NumPy is
+only imported by the first decoding call, or by importing RECORD_DTYPE or
+SEGMENT_DTYPE, so the producer does not pay for it.
+
+The old str(tuple) text lines are still available as a debug format.
+"""
+import struct
+
+WIRE_VERSION = 1
+
+RECORD = struct.Struct('<BBBBIq')
+RECORD_SIZE = RECORD.size
+
+FLAG_PWM = 0x01
+FLAG_GROUP = 0x02
+FLAG_WAVE = 0x04
+FLAG_WAVE_PULSE = 0x08
+FLAG_STATS = 0x10
+FLAG_PAYLOAD = 0x80  # Second record of a pair, carries data in its timestamp field
+
+DUTY_SCALE = 10**9  # Duty cycle resolution, parts per billion
+
+# Metrics of a stats report. Counters are totals since the GPIO was
+# created, the peaks and maxima are over the time since the last report.
+STATS_METRICS = (
+    'produced',          # events logged
+    'dropped',           # events lost in the buffer or a subscriber queue
+    'buffer_peak',       # most events waiting in the buffer at a flush
+    'buffer_capacity',
+    'bytes_published',
+    'flush_max_ns',      # longest flush of the buffer to subscribers
+    'latency_max_ns',    # oldest event of a flush, age when it was written
+    'subscribers',
+    'sample_rate',       # achieved samples/s of start_sampling(), 0 if off
+    'missed_samples',    # sample deadlines missed since sampling started
+)
+
+
+
+def load_numpy():
+    """
+    Import NumPy and define RECORD_DTYPE and SEGMENT_DTYPE, once. Returns
+    the numpy module.
+    """
+    global RECORD_DTYPE, SEGMENT_DTYPE
+    import numpy as np
+    if 'RECORD_DTYPE' not in globals():
+        RECORD_DTYPE = np.dtype([
+            ('version', '<u1'),
+            ('flags', '<u1'),
+            ('pin', '<u1'),
+            ('level', '<u1'),
+            ('value', '<u4'),
+            ('timestamp', '<i8'),
+        ])
+        assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+        SEGMENT_DTYPE = np.dtype([
+            ('pin', '<u1'),
+            ('level', '<u1'),
+            ('timestamp', '<i8'),
+            ('period_ns', '<i8'),
+            ('high_ns', '<i8'),
+        ])
+    return np
+
+
+def __getattr__(name):
+    if name in ('RECORD_DTYPE', 'SEGMENT_DTYPE'):
+        load_numpy()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def encode_events(events):
+    """
+    Pack an iterable of (gpio, state, time_ns) tuples into one bytes object.
+    """
+    pack = RECORD.pack
+    return b''.join([pack(WIRE_VERSION, 0, gpio, state, 0, time_ns) for gpio, state, time_ns in events])
+
+
+def encode_stats(metrics, time_ns):
+    """
+    A stats report of a {name: value} dict with the STATS_METRICS keys.
+    """
+    pack = RECORD.pack
+    return b''.join([pack(WIRE_VERSION, FLAG_STATS, index, 0, 0, time_ns) +
+                     pack(WIRE_VERSION, FLAG_STATS | FLAG_PAYLOAD, index, 0, 0, metrics[name])
+                     for index, name in enumerate(STATS_METRICS)])
+
+
+def format_text(chunks):
+    """
+    Debug format: one str((gpio, state, time_ns)) line per encoded record,
+    with flags and value appended for flagged records.
+    """
+    return ''.join([f'{(gpio, state, time_ns, flags, value) if flags else (gpio, state, time_ns)}\n'
+                    for chunk in chunks
+                    for _, flags, gpio, state, value, time_ns in RECORD.iter_unpack(chunk)]).encode()
+
+
+def split_pwm(records):
+    """
+    Separate PWM segments from plain edges in a decoded record array.
+
+    Returns (edges, segments), segments being a SEGMENT_DTYPE array. A
+    segment record whose payload was lost (e.g. overwritten in a full buffer)
+    is dropped.
+    """
+    np = load_numpy()
+    flags = records['flags']
+    pwm = (flags & FLAG_PWM) != 0
+    if not pwm.any():
+        return records, np.empty(0, dtype=SEGMENT_DTYPE)
+    heads = np.flatnonzero(flags == FLAG_PWM)
+    heads = heads[heads + 1 < len(records)]
+    payloads = heads + 1
+    paired = (flags[payloads] == FLAG_PWM | FLAG_PAYLOAD) & (records['pin'][payloads] == records['pin'][heads])
+    heads, payloads = heads[paired], payloads[paired]
+    segments = np.empty(len(heads), dtype=SEGMENT_DTYPE)
+    for name in ('pin', 'level', 'timestamp'):
+        segments[name] = records[name][heads]
+    segments['period_ns'] = records['timestamp'][payloads]
+    segments['high_ns'] = segments['period_ns'] * records['value'][heads].astype(np.int64) // DUTY_SCALE
+    return records[~pwm], segments
+
+
+def split_stats(records):
+    """
+    Take the stats reports out of a decoded record array.
+
+    Returns (records, metrics), metrics being {name: value} of the latest
+    report in the records, empty if there was none.
+    """
+    np = load_numpy()
+    flags = records['flags']
+    stats = (flags & FLAG_STATS) != 0
+    if not stats.any():
+        return records, {}
+    metrics = {}
+    heads = np.flatnonzero(flags == FLAG_STATS)
+    heads = heads[heads + 1 < len(records)]
+    heads = heads[flags[heads + 1] == FLAG_STATS | FLAG_PAYLOAD]
+    for index, value in zip(records['pin'][heads].tolist(), records['timestamp'][heads + 1].tolist()):
+        if index < len(STATS_METRICS):
+            metrics[STATS_METRICS[index]] = value
+    return records[~stats], metrics
+
+
+def expand_groups(records):
+    """
+    Replace group write pairs in a decoded record array by one plain edge
+    record per written pin. The result is no longer in stream order.
+    """
+    np = load_numpy()
+    flags = records['flags']
+    group = (flags & FLAG_GROUP) != 0
+    if not group.any():
+        return records
+    heads = np.flatnonzero(flags == FLAG_GROUP)
+    heads = heads[heads + 1 < len(records)]
+    payloads = heads + 1
+    paired = (flags[payloads] == FLAG_GROUP | FLAG_PAYLOAD) & (records['pin'][payloads] == records['pin'][heads])
+    heads, payloads = heads[paired], payloads[paired]
+    masks = records['timestamp'][payloads]
+    levels = records['value'][heads]
+    parts = [records[~group]]
+    for pin in range(32):
+        selected = ((masks >> pin) & 1) == 1
+        if selected.any():
+            edges = records[heads[selected]].copy()
+            edges['flags'] = 0
+            edges['pin'] = pin
+            edges['level'] = (levels[selected] >> pin) & 1
+            edges['value'] = 0
+            parts.append(edges)
+    return np.concatenate(parts)
+
+
+class WaveTable:
+    """
+    Wave definitions seen in a stream, to turn wave transmissions into
+    plain edge records. At most max_edges edges are produced per
+    transmission.
+    """
+    def __init__(self, max_edges=100000):
+        self.max_edges = max_edges
+        self.edges = {}  # wave id -> list of (offset, pin, level)
+        self.waves = {}  # wave id -> offsets, pins and levels of its edges as arrays
+
+    def define(self, records):
+        np = load_numpy()
+        flags = records['flags']
+        heads = np.flatnonzero(flags == FLAG_WAVE_PULSE)
+        heads = heads[heads + 1 < len(records)]
+        heads = heads[flags[heads + 1] == FLAG_WAVE_PULSE | FLAG_PAYLOAD]
+        changed = set()
+        for head in heads.tolist():
+            wave_id, offset = int(records['value'][head]), int(records['timestamp'][head])
+            on, off = int(records['value'][head + 1]), int(records['timestamp'][head + 1])
+            if offset == 0 or wave_id not in self.edges:
+                self.edges[wave_id] = []
+            self.edges[wave_id] += [(offset, pin, 1) for pin in range(32) if on >> pin & 1]
+            self.edges[wave_id] += [(offset, pin, 0) for pin in range(32) if off >> pin & 1]
+            changed.add(wave_id)
+        for wave_id in changed:
+            offsets, pins, levels = zip(*self.edges[wave_id]) if self.edges[wave_id] else ((), (), ())
+            self.waves[wave_id] = (np.array(offsets, dtype=np.int64), np.array(pins, dtype=np.uint8),
+                                   np.array(levels, dtype=np.uint8))
+
+    def expand(self, records):
+        """
+        Learn the wave definitions in a decoded record array and replace
+        them and the wave transmissions by plain edge records. The result
+        is no longer in stream order.
+        """
+        np = load_numpy()
+        flags = records['flags']
+        wave = (flags & (FLAG_WAVE | FLAG_WAVE_PULSE)) != 0
+        if not wave.any():
+            return records
+        self.define(records)
+        heads = np.flatnonzero(flags == FLAG_WAVE)
+        heads = heads[heads + 1 < len(records)]
+        heads = heads[flags[heads + 1] == FLAG_WAVE | FLAG_PAYLOAD]
+        parts = [records[~wave]]
+        for head in heads.tolist():
+            definition = self.waves.get(int(records['value'][head]))
+            if definition is None or not len(definition[0]):
+                continue
+            offsets, pins, levels = definition
+            start, repeats = int(records['timestamp'][head]), int(records['value'][head + 1])
+            length = int(records['timestamp'][head + 1])
+            repeats = max(min(repeats, self.max_edges // len(offsets)), 1)
+            edges = np.zeros(repeats * len(offsets), dtype=RECORD_DTYPE)
+            edges['version'] = WIRE_VERSION
+            edges['timestamp'] = (start + np.arange(repeats, dtype=np.int64)[:, None] * length + offsets).ravel()
+            edges['pin'] = np.tile(pins, repeats)
+            edges['level'] = np.tile(levels, repeats)
+            parts.append(edges)
+        return np.concatenate(parts)
+
+
+class EventRing:
+    """
+    Fixed-capacity ring of encoded records in one preallocated bytearray.
+
+    append() packs straight into the buffer, so logging an event creates no
+    tuple or list entry, and once full it overwrites the oldest record.
+    drain() hands out memoryviews of the used region (two when it wraps) that
+    can be passed to os.writev as they are.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, gpio, state, time_ns, flags=0, value=0):
+        index = self.start + self.count
+        if index >= self.capacity:
+            index -= self.capacity
+        RECORD.pack_into(self.buffer, index * RECORD_SIZE, WIRE_VERSION, flags, gpio, state, value, time_ns)
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = index + 1 if index + 1 < self.capacity else 0
+
+    def drain(self):
+        """
+        Return the buffered records oldest first and empty the ring. The views
+        are only valid until the next append.
+        """
+        if not self.count:
+            return []
+        view = memoryview(self.buffer)
+        end = self.start + self.count
+        if end <= self.capacity:
+            chunks = [view[self.start * RECORD_SIZE:end * RECORD_SIZE]]
+        else:
+            chunks = [view[self.start * RECORD_SIZE:], view[:(end - self.capacity) * RECORD_SIZE]]
+        self.clear()
+        return chunks
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+    def oldest_pin(self):
+        """
+        Pin of the record the next append overwrites once the ring is full.
+        """
+        return self.buffer[self.start * RECORD_SIZE + 2]
+
+    def time_range(self):
+        """
+        (oldest, newest) event time in the ring, payload records skipped,
+        or None if it holds none.
+        """
+        times = []
+        for indexes in (range(self.count), range(self.count - 1, -1, -1)):
+            for i in indexes:
+                index = self.start + i
+                if index >= self.capacity:
+                    index -= self.capacity
+                _, flags, _, _, _, time_ns = RECORD.unpack_from(self.buffer, index * RECORD_SIZE)
+                if not flags & FLAG_PAYLOAD:
+                    times.append(time_ns)
+                    break
+        return tuple(times) if times else None
+
+
+class EventDecoder:
+    """
+    Turns raw bytes received from the event server into a NumPy record array.
+
+    Reads that end in the middle of a record keep the tail until the next
+    feed(), so records are never split, and the first record of a pair is
+    held back until its payload record has arrived too. Records with an unknown
+    version are dropped and counted in self.errors.
+    """
+    def __init__(self):
+        np = load_numpy()
+        self.remainder = b''
+        self.held = np.empty(0, dtype=RECORD_DTYPE)
+        self.errors = 0
+
+    def decode(self, data):
+        np = load_numpy()
+        if self.remainder:
+            data = self.remainder + data
+        usable = len(data) - len(data) % RECORD_SIZE
+        self.remainder = data[usable:]
+        return np.frombuffer(data, dtype=RECORD_DTYPE, count=usable // RECORD_SIZE)
+
+    def feed(self, data):
+        np = load_numpy()
+        records = self.decode(data)
+        valid = records['version'] == WIRE_VERSION
+        if not valid.all():
+            self.errors += int(len(records) - valid.sum())
+            records = records[valid]
+        if len(self.held):
+            records = np.concatenate([self.held, records])
+            self.held = self.held[:0]
+        # Every flagged record without FLAG_PAYLOAD starts a pair
+        if len(records) and records['flags'][-1] and not records['flags'][-1] & FLAG_PAYLOAD:
+            self.held = records[-1:].copy()
+            records = records[:-1]
+        return records
+
+
+class TextEventDecoder(EventDecoder):
+    """
+    Debug counterpart of EventDecoder for the str(tuple) line format. Lines
+    that do not parse are skipped and counted in self.errors.
+    """
+    def decode(self, data):
+        import ast
+        np = load_numpy()
+        data = self.remainder + data
+        lines = data.split(b'\n')
+        self.remainder = lines.pop()
+        events = []
+        for line in lines:
+            try:
+                fields = ast.literal_eval(line.decode())
+                gpio, state, time_ns, flags, value = fields if len(fields) == 5 else fields + (0, 0)
+                events.append((WIRE_VERSION, flags, gpio, state, value, time_ns))
+            except (SyntaxError, ValueError, TypeError):
+                self.errors += 1
+        return np.array(events, dtype=RECORD_DTYPE)
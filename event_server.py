@@ -0,0 +1,291 @@
+"""
+Local event server fanning the event stream out to several subscribers.
+
+GPIO publishes every flushed batch of records (see event_format.py) to an
+EventServer listening on a Unix domain socket. Each subscriber gets its own
+pin filter, bounded queue and slow-consumer policy, so a client that falls
+behind never delays the producer or the other clients.
+
+A subscriber connects and sends one SUBSCRIBE message:
+
+    magic        4s   SUBSCRIBE_MAGIC
+    version      u8   1
+    policy       u8   index into POLICIES, 0 for the server default
+    reserved     u16
+    max_records  u32  queue bound in records, 0 for the server default
+    pins         u64  bit n = GPIO n, 0 for all pins
+
+and then receives the records of its pins in the wire format, or as text
+lines if the server was started with text=True. Group writes, waves and
+stats reports reach every subscriber, they are filtered when expanded. Data the producer
+asks to retain, like wave definitions, running PWM channels and the last
+group levels, is sent to every new subscriber first. subscribe() does the client side.
+
+The server has no thread of its own: the log writer calls publish() on
+every flush, which accepts new clients and works on non-blocking sockets.
+"""
+import errno
+import os
+import socket
+import struct
+
+from event_format import FLAG_GROUP, FLAG_STATS, FLAG_WAVE, FLAG_WAVE_PULSE, RECORD_SIZE, format_text
+
+EVENT_SOCKET_NAME = 'pin_activity.sock'
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COUNT_AND_SKIP = 'count_and_skip'
+DISCONNECT = 'disconnect'
+POLICIES = (None, DROP_OLDEST, DROP_NEWEST, COUNT_AND_SKIP, DISCONNECT)
+
+SUBSCRIBE_MAGIC = b'GSUB'
+SUBSCRIBE = struct.Struct('<4sBBHIQ')
+
+
+def subscribe(path=EVENT_SOCKET_NAME, pins=None, policy=None, max_records=0):
+    """
+    Connect to an event server and return the non-blocking socket to read
+    the events from. Raises OSError while no server is listening.
+
+    :param pins: GPIO numbers to receive, None for all.
+    :param policy: One of POLICIES for this client's queue, None for the
+        server default.
+    :param max_records: Bound of this client's queue, 0 for the server default.
+    """
+    mask = 0
+    for pin in pins or ():
+        mask |= 1 << pin
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(SUBSCRIBE.pack(SUBSCRIBE_MAGIC, 1, POLICIES.index(policy), 0, max_records, mask))
+    except OSError:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+class Subscriber:
+    def __init__(self, sock):
+        self.sock = sock
+        self.request = b''
+        self.subscribed = False
+        self.pin_table = None  # bytes.translate table, 1 for wanted pins
+        self.policy = None
+        self.max_records = 0
+        self.pending = b''  # bytes not taken by the socket yet
+        self.dropped = 0
+
+    def parse_request(self, default_policy, default_max_records):
+        magic, version, policy, _, max_records, pins = SUBSCRIBE.unpack(self.request[:SUBSCRIBE.size])
+        if magic != SUBSCRIBE_MAGIC or version != 1 or policy >= len(POLICIES):
+            raise ValueError("Bad subscription request.")
+        self.policy = POLICIES[policy] or default_policy
+        self.max_records = max_records or default_max_records
+        if pins:
+            self.pin_table = bytes((pins >> pin) & 1 if pin < 64 else 0 for pin in range(256))
+        self.subscribed = True
+
+    def select(self, data):
+        """
+        The records of data this client subscribed to.
+        """
+        if self.pin_table is None or not data:
+            return data
+        keep = bytes(data[2::RECORD_SIZE]).translate(self.pin_table)
+        if keep.count(1) == len(keep):
+            return data
+        flags = data[1::RECORD_SIZE]
+        shared = FLAG_GROUP | FLAG_WAVE | FLAG_WAVE_PULSE | FLAG_STATS
+        return b''.join([data[i * RECORD_SIZE:(i + 1) * RECORD_SIZE]
+                         for i, wanted in enumerate(keep) if wanted or flags[i] & shared])
+
+
+class EventServer:
+    """
+    Unix domain socket server publishing event records to subscribers.
+
+    :param text: Send str(tuple) lines instead of binary records.
+    :param policy: Default slow-consumer policy: DROP_OLDEST or DROP_NEWEST
+        keep up to max_records unsent events and drop from the given end,
+        COUNT_AND_SKIP drops whatever the client cannot take at once and
+        DISCONNECT closes a client whose queue overflows.
+    :param max_records: Default bound of the per-client queues.
+    :param on_dropped: Called with the number of events dropped for a client.
+    """
+    def __init__(self, path=EVENT_SOCKET_NAME, text=False, policy=DROP_OLDEST, max_records=10000,
+                 on_dropped=None):
+        if policy not in POLICIES[1:]:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.path = path
+        self.text = text
+        self.policy = policy
+        self.max_records = max_records
+        self.on_dropped = on_dropped
+        self.clients = []
+        self.bytes_sent = 0  # To all subscribers together
+        self.retained = {}  # key -> records sent to every new subscriber
+        self.send_errors = 0  # Clients disconnected after an unexpected error
+        if os.path.exists(path):
+            self.remove_stale(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+        self.sock.setblocking(False)
+
+    @staticmethod
+    def remove_stale(path):
+        """
+        Remove a socket left over by a previous run. A socket another server
+        still listens on is not taken over.
+        """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+        except FileNotFoundError:
+            return
+        finally:
+            probe.close()
+        raise ValueError(f"{path} is already served by another process.")
+
+    def close(self):
+        for client in self.clients:
+            client.sock.close()
+        self.clients = []
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def retain(self, key, data):
+        """
+        Keep the records of data, replacing those kept under key, to send
+        them to subscribers that connect later.
+        """
+        self.retained[key] = data
+
+    def forget(self, key):
+        self.retained.pop(key, None)
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            self.clients.append(Subscriber(sock))
+
+    def receive(self, client):
+        """
+        Read the subscription request of a new client, and notice clients
+        that closed their end. Returns False once the client is gone.
+        """
+        while True:
+            try:
+                data = client.sock.recv(4096)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not data:
+                return False
+            if not client.subscribed:
+                client.request += data
+                if len(client.request) >= SUBSCRIBE.size:
+                    try:
+                        client.parse_request(self.policy, self.max_records)
+                    except ValueError:
+                        return False
+                    retained = b''.join(self.retained.values())
+                    if retained:
+                        client.pending = format_text([retained]) if self.text else retained
+
+    def publish(self, chunks):
+        """
+        Queue the records of chunks for every subscriber and send as much as
+        each one accepts without blocking.
+        """
+        self.accept()
+        if not self.clients:
+            return
+        data = b''.join(chunks)
+        connected = []
+        for client in self.clients:
+            if self.receive(client) and (not client.subscribed or self.send(client, data)):
+                connected.append(client)
+            else:
+                client.sock.close()
+        self.clients = connected
+
+    def send(self, client, data):
+        """
+        Returns False if the client has to be disconnected.
+        """
+        data = client.select(data)
+        if data and self.text:
+            data = format_text([data])
+        data = client.pending + data if client.pending else data
+        if not data:
+            return True
+        try:
+            written = client.sock.send(data)
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                # Whatever went wrong with this client, keep serving the others
+                self.send_errors += 1
+            return False
+        self.bytes_sent += written
+        client.pending = data[written:]
+        if client.policy == DISCONNECT:
+            if self.count(client.pending) > client.max_records:
+                self.add_dropped(client, self.count(client.pending))
+                return False
+            return True
+        client.pending = self.limit(client, client.pending)
+        return True
+
+    def count(self, data):
+        return data.count(b'\n') if self.text else len(data) // RECORD_SIZE
+
+    def add_dropped(self, client, count):
+        if count:
+            client.dropped += count
+            if self.on_dropped is not None:
+                self.on_dropped(count)
+
+    def limit(self, client, data):
+        """
+        Apply the client's policy to bytes its socket did not take.
+        """
+        if client.policy == COUNT_AND_SKIP:
+            # Keep only the end of an event that was partly sent, so the
+            # stream stays aligned
+            keep = data.find(b'\n') + 1 if self.text else len(data) % RECORD_SIZE
+            self.add_dropped(client, self.count(data[keep:]))
+            return data[:keep]
+        if self.text:
+            lines = data.splitlines(keepends=True)
+            if len(lines) <= client.max_records:
+                return data
+            self.add_dropped(client, len(lines) - client.max_records)
+            if client.policy == DROP_OLDEST:
+                return b''.join(lines[-client.max_records:])
+            return b''.join(lines[:client.max_records])
+        limit = client.max_records * RECORD_SIZE
+        if len(data) <= limit:
+            return data
+        # The end of a partly sent event leads the data and must be kept
+        partial = len(data) % RECORD_SIZE
+        excess = len(data) - partial - limit
+        excess += -excess % RECORD_SIZE
+        self.add_dropped(client, excess // RECORD_SIZE)
+        if client.policy == DROP_OLDEST:
+            return data[:partial] + data[partial + excess:]
+        return data[:len(data) - excess]
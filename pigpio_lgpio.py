@@ -1,57 +1,636 @@
-import lgpio
 import threading
 import time
 import os
 import atexit
+import select
+import struct
+import itertools
+from collections import deque
+from pulse_stats import PulseStats, WidthHistogram
+import event_server
+from event_format import (DUTY_SCALE, FLAG_GROUP, FLAG_PAYLOAD, FLAG_PWM, FLAG_WAVE, FLAG_WAVE_PULSE, RECORD,
+                          WIRE_VERSION, EventRing, encode_stats)
 
-LOG_PIPE_NAME = "log_pipe"
+# Modes, and line flags and edges with lgpio's values. Defined here so that
+# importing this module does not import lgpio, which opens a notification
+# pipe and starts a thread on import.
+INPUT = 'in'
+OUTPUT = 'out'
+SET_ACTIVE_LOW = 4
+SET_OPEN_DRAIN = 8
+SET_OPEN_SOURCE = 16
+SET_PULL_UP = 32
+SET_PULL_DOWN = 64
+SET_PULL_NONE = 128
+RISING_EDGE = 1
+FALLING_EDGE = 2
+BOTH_EDGES = 3
+TX_PWM = 0
+TX_WAVE = 1
+
+# Event sockets served by open GPIO instances of this process
+serving_paths = set()
+
+# Working directory of each loaded backend, where it creates its notification pipes
+work_dirs = {}
+
+
+def load_backend(backend=None):
+    """
+    Module providing the lgpio API: 'lgpio' for real hardware, 'sim' for the
+    simulated chip in sim_lgpio.py, or a module object. Defaults to the
+    GPIO_BACKEND environment variable, else 'lgpio'.
+    """
+    if backend is None:
+        backend = os.environ.get('GPIO_BACKEND', 'lgpio')
+    if not isinstance(backend, str):
+        module = backend
+    elif backend == 'lgpio':
+        import lgpio as module
+    elif backend == 'sim':
+        import sim_lgpio as module
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+    # lgpio works in LG_WD, else in the directory it was imported in,
+    # which is this one unless the module was imported before
+    work_dirs.setdefault(module.__name__, getattr(module, 'WORK_DIR', None) or os.environ.get('LG_WD') or os.getcwd())
+    return module
+
+
+def notification_path(backend_module, handle):
+    """
+    Path of the notification pipe the backend opened for handle.
+    """
+    directory = work_dirs.get(backend_module.__name__) or os.environ.get('LG_WD') or os.getcwd()
+    return os.path.join(directory, f'.lgd-nfy{handle}')
+
+
+# lgpio notification pipe message: tick, chip, gpio, level, flags, padding
+NOTIFICATION = struct.Struct('<QBBBBI')
+
+# lgpio wave pulse as passed to the C library: group bits, group mask, delay in us
+WAVE_PULSE = struct.Struct('<QQQ')
+
+# Shortest stretch of a repeated wave submitted as one lgpio queue entry
+WAVE_REPEAT_NS = 10_000_000
+
+# Most pulses a wave chain may expand to, it is submitted as one queue entry
+MAX_CHAIN_PULSES = 1 << 20
+
+# Time between reads of the capture worker's ring
+RING_DRAIN_INTERVAL = 0.005
+
+# Time between the stats reports sent to subscribers
+STATS_INTERVAL_NS = 1_000_000_000
+
+
+def pair_bytes(gpio, state, time_ns, flags, value, payload, payload_value=0):
+    """
+    Wire bytes of a record and its FLAG_PAYLOAD record, see GPIO.log_pair().
+    """
+    return (RECORD.pack(WIRE_VERSION, flags, gpio, state, value, time_ns) +
+            RECORD.pack(WIRE_VERSION, flags | FLAG_PAYLOAD, gpio, 0, payload_value, payload))
+
+
+def add_run(runs, wave_id, repeats):
+    """
+    Append a run of a wave chain, merged with the run before if it repeats
+    the same wave.
+    """
+    if runs and wave_id is not None and runs[-1][0] == wave_id:
+        runs[-1] = (wave_id, runs[-1][1] + repeats)
+    else:
+        runs.append((wave_id, repeats))
+
+
+class TickClock:
+    """
+    Maps the kernel timestamps of line events to time.time_ns().
+
+    Depending on the kernel they count from boot (CLOCK_MONOTONIC, the same
+    clock as time.monotonic_ns()) or from the epoch. The offset between the
+    monotonic and the wall clock is measured from the tightest of a few
+    back to back readings and refreshed every second, so the mapping follows
+    wall clock adjustments.
+    """
+    EPOCH_TICKS = 10**18  # Boot based ticks never get this large (31 years)
+    RECALIBRATE_NS = 10**9
+
+    def __init__(self):
+        self.offset = 0
+        self.calibrated_ns = None
+
+    def calibrate(self):
+        best = None
+        for _ in range(5):
+            before = time.time_ns()
+            monotonic = time.monotonic_ns()
+            after = time.time_ns()
+            if best is None or after - before < best[0]:
+                best = (after - before, (before + after) // 2 - monotonic)
+        self.offset = best[1]
+        self.calibrated_ns = time.monotonic_ns()
+
+    def offset_for(self, tick):
+        """
+        What to add to tick, and to the other ticks of its batch.
+        """
+        if tick >= self.EPOCH_TICKS:
+            return 0
+        if self.calibrated_ns is None or time.monotonic_ns() - self.calibrated_ns > self.RECALIBRATE_NS:
+            self.calibrate()
+        return self.offset
+
+
+class pulse:
+    """
+    One step of a wave, as in pigpio: switch the GPIOs in the gpio_on mask
+    on and those in the gpio_off mask off, then wait delay microseconds.
+    Bit n of the masks is GPIO n.
+    """
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+
+class Callback:
+    """
+    Edge callback registered with GPIO.callback(), with the interface of
+    lgpio's callback objects.
+    """
+    def __init__(self, gpio_instance, gpio, edge, func=None):
+        self.gpio_instance = gpio_instance
+        self.gpio = gpio
+        self.levels = {RISING_EDGE: (1, 2), FALLING_EDGE: (0, 2)}.get(edge, (0, 1, 2))
+        self.count = 0
+        self.func = func or self._tally
+
+    def cancel(self):
+        self.gpio_instance.remove_callback(self)
+
+    def _tally(self, chip, gpio, level, tick):
+        self.count += 1
+
+    def tally(self):
+        return self.count
+
+    def reset_tally(self):
+        self.count = 0
+
+
+class EdgeStream:
+    """
+    Edges of some input pins for one asyncio consumer.
+
+    push() runs on lgpio's callback thread and only schedules a wakeup of
+    the event loop when none is pending, so a burst of edges costs one
+    call_soon_threadsafe no matter how many edges it holds. The consumer
+    pops from the other end of the deque concurrently, so push() never
+    pops: a full deque discards its oldest edge by itself. With keep_first
+    the first edge is kept instead and later ones are dropped.
+    """
+    def __init__(self, loop, edge, max_pending, keep_first=False):
+        self.loop = loop
+        self.levels = {RISING_EDGE: (1,), FALLING_EDGE: (0,)}.get(edge, (0, 1))
+        self.pending = deque(maxlen=max_pending)
+        self.keep_first = keep_first
+        self.dropped = 0
+        self.wakeup_scheduled = False
+        import asyncio  # Only loaded by asyncio users, it is slow to import
+        self.ready = asyncio.Event()
+
+    def push(self, gpio, level, tick):
+        if level not in self.levels:
+            return
+        if len(self.pending) >= self.pending.maxlen:
+            self.dropped += 1
+            if self.keep_first:
+                return
+        self.pending.append((gpio, level, tick))
+        if not self.wakeup_scheduled:
+            self.wakeup_scheduled = True
+            try:
+                self.loop.call_soon_threadsafe(self.wake)
+            except RuntimeError:
+                pass  # The loop is closed
+
+    def wake(self):
+        self.wakeup_scheduled = False
+        self.ready.set()
+
+    async def wait(self):
+        while not self.pending:
+            self.ready.clear()
+            await self.ready.wait()
 
-# Check if the named pipe exists, if not, create it
-if not os.path.exists(LOG_PIPE_NAME):
-    os.mkfifo(LOG_PIPE_NAME)
 
 class GPIO:
     """"
       BOTH_EDGES, RISING_EDGE, or FALLING_EDGE.
+
+    Creating an instance does no I/O. The chip, the event server and the
+    log writer thread are opened by the first call that needs them, or by
+    open(), and released by stop(). As a context manager the instance is
+    stopped deterministically on exit:
+
+        with GPIO() as pi:
+            pi.set_mode(4, INPUT)
+
+    Several instances, e.g. one per chip, can be open at once as long as
+    each serves its events on its own socket_path.
     """
-    INPUT = 'in'
-    OUTPUT = 'out'
-    RISING_EDGE = lgpio.RISING_EDGE
-    FALLING_EDGE = lgpio.FALLING_EDGE
-    BOTH_EDGES = lgpio.BOTH_EDGES
-    EITHER_EDGE = lgpio.BOTH_EDGES
-
-    def __init__(self, gpiochip=4):
-        self.gpiochip = lgpio.gpiochip_open(gpiochip)
-        self.callback_threads = {}
-        self.stop_threads = False
+    INPUT = INPUT
+    OUTPUT = OUTPUT
+    RISING_EDGE = RISING_EDGE
+    FALLING_EDGE = FALLING_EDGE
+    BOTH_EDGES = BOTH_EDGES
+    EITHER_EDGE = BOTH_EDGES
+
+    # What to do with events a subscriber cannot take in time
+    DROP_OLDEST = event_server.DROP_OLDEST
+    DROP_NEWEST = event_server.DROP_NEWEST
+    COUNT_AND_SKIP = event_server.COUNT_AND_SKIP
+    DISCONNECT = event_server.DISCONNECT
+
+    def __init__(self, gpiochip=4, text_log=False, overflow_policy=DROP_OLDEST, max_log_size=10000,
+                 pwm_sysfs_root='/sys/class/pwm', backend=None, socket_path=event_server.EVENT_SOCKET_NAME,
+                 stats_window=1.0, capture_process=False, capture_cpus=None):
+        """
+        :param text_log: Send str(tuple) lines to subscribers instead of
+            binary records. Only meant for debugging, the visualizer needs --text.
+        :param overflow_policy: Default policy for subscribers that fall
+            behind, see event_server.EventServer. DROP_OLDEST or DROP_NEWEST
+            keep up to max_log_size unsent events per subscriber and drop
+            from the given end, COUNT_AND_SKIP discards whatever cannot be
+            sent at flush time and DISCONNECT closes the subscriber. Dropped
+            events are counted in dropped_events.
+        :param max_log_size: Capacity of the pending event buffers and the
+            default bound of the subscriber queues.
+        :param pwm_sysfs_root: Where the pwmchip directories for hardware_PWM
+            are, e.g. a temporary directory laid out like sysfs for testing.
+        :param backend: 'lgpio', 'sim' or a module with the lgpio API, see
+            load_backend().
+        :param socket_path: Unix domain socket the events are served on.
+        :param stats_window: Seconds over which stats() estimates frequency
+            and duty cycle.
+        :param capture_process: Claim input lines in a separate worker
+            process that hands their edges over through shared memory, so
+            a busy application does not delay capture, see
+            capture_worker.py. Uses one more CPU.
+        :param capture_cpus: CPUs to pin the capture worker to, e.g. {3}.
+        """
+        if overflow_policy not in [self.DROP_OLDEST, self.DROP_NEWEST, self.COUNT_AND_SKIP, self.DISCONNECT]:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.chip_number = gpiochip
+        self.backend = backend
+        self.socket_path = socket_path
+        self.backend_module = None
+        self.handle = None
+        self.open_lock = threading.Lock()
+        self.stop_event = threading.Event()
         self.line_modes = {}
+        self.groups = {}  # leader gpio -> {'gpios': [...], 'mode': ...}
+        self.edge_streams = {}  # gpio -> tuple of EdgeStream, replaced on change
+        self.callbacks = {}  # gpio -> tuple of Callback, replaced on change
+        self.dispatch_lock = threading.Lock()
         self.pwm_channels = {}
-        self.pin_activity_logs = []
-        self.max_log_size = 10000
-        self.log_file = 'pin_activity.log'
+        self.pwm_sysfs_root = pwm_sysfs_root
+        self.pwm_sysfs = {}  # gpio -> open sysfs fds and last written values
+        # Double buffer: log_event fills pin_activity_logs, the writer swaps
+        # it with log_spare under the lock and does the I/O outside of it.
+        self.max_log_size = max_log_size
+        self.pin_activity_logs = EventRing(max_log_size)
+        self.log_spare = EventRing(max_log_size)
+        self.overflow_policy = overflow_policy
+        self.dropped_events = 0
+        self.text_log = text_log
         self.log_lock = threading.Lock()
-        self.log_thread = threading.Thread(target=self.log_writer, daemon=True)
-        self.log_thread.start()
+        # Updated from the drained batches by the log writer, see count_batch()
+        self.pulse_stats = PulseStats(stats_window)
+        self.stats_lock = threading.Lock()
+        # Pipeline metrics, see metrics(). Per pin lists are indexed by GPIO
+        self.produced = [0] * 256
+        self.dropped_pins = [0] * 256  # Lost in a full buffer
+        self.subscriber_dropped = 0
+        self.buffer_high_water = 0
+        self.bytes_published = 0
+        self.flush_times = WidthHistogram()
+        self.write_latency = WidthHistogram()
+        self.wave_underruns = 0
+        self.repeater_late = WidthHistogram()
+        # Peaks since the last stats report: buffer, flush time, latency
+        self.report_peaks = [0, 0, 0]
+        self.last_report_ns = 0
+        self.batch_times = None  # Oldest and newest event time of the batch being flushed
+        self.server = None
+        self.recorder = None
+        self.recorder_lock = threading.Lock()
+        self.log_thread = None
+        # Input edges are read in batches from our own lgpio notification
+        # pipe, opened with the first input
+        self.notify_handle = None
+        self.notify_fd = None
+        self.tick_clock = TickClock()
+        self.alert_thread = None
+        # Or from the ring of the capture worker, started with the first input
+        self.capture_process = capture_process
+        self.capture_cpus = capture_cpus
+        self.capture_worker = None
+        self.worker_dropped = 0
+        self.worker_ring_high_water = 0
+        # Waves: the one being built (time in us -> [on mask, off mask]), the
+        # compiled ones by id, and per output group the time its lgpio
+        # queue runs empty and its repeater thread
+        self.wave_steps = {}
+        self.wave_length_us = 0
+        self.waves = {}
+        self.wave_queue_end = {}
+        self.wave_repeaters = {}
+        self.group_levels = {}  # output group leader -> (mask, levels) written so far
+        # Wave definitions, published ahead of the next batch of events
+        self.log_control = []
+        self.sampler = None  # Fixed-rate sampling, see start_sampling()
+
+    def open(self):
+        """
+        Open the chip, start the event server and the log writer thread.
+        Returns the instance.
+        """
+        with self.open_lock:
+            if self.handle is not None:
+                return self
+            if self.socket_path in serving_paths:
+                raise ValueError(f"{self.socket_path} is already served by another GPIO instance.")
+            backend_module = load_backend(self.backend)
+            handle = backend_module.gpiochip_open(self.chip_number)
+            try:
+                self.server = event_server.EventServer(self.socket_path, self.text_log, self.overflow_policy,
+                                                       self.max_log_size, on_dropped=self.add_dropped)
+            except Exception:
+                backend_module.gpiochip_close(handle)
+                raise
+            serving_paths.add(self.socket_path)
+            self.backend_module = backend_module
+            self.handle = handle
+            self.stop_event.clear()
+            self.log_thread = threading.Thread(target=self.log_writer, daemon=True)
+            self.log_thread.start()
+            # Release the chip and turn hardware PWM off even without stop()
+            atexit.register(self.stop)
+        return self
+
+    @property
+    def gpiochip(self):
+        """lgpio handle of the chip, opened on first use."""
+        if self.handle is None:
+            self.open()
+        return self.handle
+
+    @property
+    def lgpio(self):
+        """Backend module with the lgpio API, loaded on first use."""
+        if self.backend_module is None:
+            self.open()
+        return self.backend_module
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
 
     def log_writer(self):
-        while not self.stop_threads:
-            time.sleep(0.1)
+        while not self.stop_event.wait(0.1):
+            self.flush_log()
+
+    def add_dropped(self, count):
+        with self.log_lock:
+            self.dropped_events += count
+            self.subscriber_dropped += count
+
+    def count_dropped(self, logs, gpio, count=1):
+        """
+        Count events lost to a full buffer, called under log_lock before the
+        append: the oldest record is overwritten under DROP_OLDEST, else the
+        new event of gpio is skipped. Lost events never reach count_batch(),
+        so they are counted as produced here.
+        """
+        pin = logs.oldest_pin() if self.overflow_policy == self.DROP_OLDEST else gpio
+        self.dropped_events += count
+        self.dropped_pins[pin] += count
+        self.produced[pin] += count
+
+    def take_batch(self):
+        with self.log_lock:
+            batch = self.pin_activity_logs
+            self.pin_activity_logs = self.log_spare
+            control, self.log_control = self.log_control, []
+        self.log_spare = batch
+        self.batch_times = batch.time_range()
+        peaks = self.report_peaks
+        peaks[0] = max(peaks[0], len(batch))
+        self.buffer_high_water = max(self.buffer_high_water, len(batch))
+        chunks = batch.drain()
+        self.count_batch(chunks)
+        return control + chunks
+
+    def count_batch(self, chunks):
+        """
+        Count the events of a drained batch and add its edges, group writes
+        included, to the pulse statistics. Runs on the log writer, outside of
+        log_lock, so logging an event only appends it. With NumPy the batch
+        is handled as arrays, else record by record.
+        """
+        if not chunks:
+            return
+        try:
+            from event_format import load_numpy
+            np = load_numpy()
+        except ImportError:  # the producer side runs without NumPy
+            return self.count_records(chunks)
+        from event_format import RECORD_DTYPE, expand_groups
+        records = np.frombuffer(b''.join(chunks), dtype=RECORD_DTYPE)
+        heads = records['pin'][(records['flags'] & FLAG_PAYLOAD) == 0]
+        produced = np.bincount(heads, minlength=256)
+        with self.log_lock:
+            for gpio in np.flatnonzero(produced).tolist():
+                self.produced[gpio] += int(produced[gpio])
+        edges = expand_groups(records)
+        edges = edges[edges['flags'] == 0]
+        if not len(edges):
+            return
+        edges = edges[np.lexsort((edges['timestamp'], edges['pin']))]
+        pins = edges['pin']
+        starts = np.flatnonzero(np.diff(pins, prepend=pins[0] + 1))
+        with self.stats_lock:
+            for start, end in zip(starts.tolist(), starts[1:].tolist() + [len(edges)]):
+                self.pulse_stats.add_edges(int(pins[start]), edges['timestamp'][start:end], edges['level'][start:end])
+
+    def count_records(self, chunks):
+        """
+        count_batch() without NumPy.
+        """
+        produced = [0] * 256
+        edges = []
+        group = None  # Head of a group write pair, the payload may be in the next chunk
+        for chunk in chunks:
+            for _, flags, gpio, state, value, time_ns in RECORD.iter_unpack(chunk):
+                if not flags:
+                    produced[gpio] += 1
+                    edges.append((gpio, state, time_ns))
+                elif not flags & FLAG_PAYLOAD:
+                    produced[gpio] += 1
+                    group = (gpio, value, time_ns) if flags == FLAG_GROUP else None
+                elif group is not None and flags == FLAG_GROUP | FLAG_PAYLOAD and gpio == group[0]:
+                    _, levels, start_ns = group
+                    edges += [(pin, levels >> pin & 1, start_ns) for pin in range(time_ns.bit_length())
+                              if time_ns >> pin & 1]
+        with self.log_lock:
+            for gpio, count in enumerate(produced):
+                if count:
+                    self.produced[gpio] += count
+        with self.stats_lock:
+            for gpio, state, time_ns in edges:
+                self.pulse_stats.add(gpio, state, time_ns)
+
+    def flush_log(self):
+        start = time.perf_counter_ns()
+        chunks = self.take_batch()
+        if chunks:
+            with self.recorder_lock:
+                if self.recorder is not None:
+                    self.recorder.write(chunks)
+        now_ns = time.time_ns()
+        if now_ns - self.last_report_ns >= STATS_INTERVAL_NS:
+            # Not recorded, captures only hold pin activity
+            chunks.append(self.stats_report(now_ns))
+            self.last_report_ns = now_ns
+        # Also retries what slow subscribers did not take yet
+        self.server.publish(chunks)
+        if self.batch_times is not None:
+            flush_ns = time.perf_counter_ns() - start
+            latency_ns = time.time_ns() - self.batch_times[0]
             with self.log_lock:
-                if self.pin_activity_logs:
-                    with open(LOG_PIPE_NAME, 'w') as f:
-                        for event in self.pin_activity_logs:
-                            f.write(str(event) + '\n')
-                    self.pin_activity_logs = []
+                self.bytes_published += sum(len(chunk) for chunk in chunks)
+                self.flush_times.add(flush_ns)
+                self.write_latency.add(latency_ns)
+                peaks = self.report_peaks
+                peaks[1] = max(peaks[1], flush_ns)
+                peaks[2] = max(peaks[2], latency_ns)
+
+    def stats_report(self, now_ns):
+        """
+        Encoded stats report for subscribers, see event_format.STATS_METRICS.
+        """
+        sampling = self.sampling_status()
+        with self.log_lock:
+            peaks, self.report_peaks = self.report_peaks, [0, 0, 0]
+            return encode_stats({
+                'produced': sum(self.produced),
+                'dropped': self.dropped_events,
+                'buffer_peak': peaks[0],
+                'buffer_capacity': self.max_log_size,
+                'bytes_published': self.bytes_published,
+                'flush_max_ns': peaks[1],
+                'latency_max_ns': peaks[2],
+                'subscribers': len(self.server.clients),
+                'sample_rate': round(sampling['achieved_rate']) if sampling else 0,
+                'missed_samples': sampling['missed'] if sampling else 0,
+            }, now_ns)
+
+    def start_recording(self, directory='pin_activity_capture', **kwargs):
+        """
+        Record every event to a capture directory (see capture.py), whether
+        or not a visualizer is subscribed. Open the capture later with
+        visualizer.py --capture <directory>.
+
+        A path ending in .vcd or .sr is written as a VCD or sigrok file
+        instead (see convert.py, this needs NumPy), kwargs going to
+        ExportWriter, e.g. pins=[4, 17] or samplerate=4_000_000.
+        """
+        self.open()  # The log writer feeds the recorder
+        if directory.endswith(('.vcd', '.sr')):
+            from convert import ExportWriter
+            recorder = ExportWriter(directory, live=True, **kwargs)
+        else:
+            from capture import CaptureWriter
+            recorder = CaptureWriter(directory, **kwargs)
+        # Waves, running PWM and group levels from before the recording
+        recorder.write(list(self.server.retained.values()))
+        with self.recorder_lock:
+            if self.recorder is not None:
+                self.recorder.close()
+            self.recorder = recorder
+
+    def stop_recording(self):
+        with self.recorder_lock:
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
 
     def log_event(self, gpio, state):
-        event = (gpio, state, time.time_ns())
+        time_ns = time.time_ns()
         with self.log_lock:
-            self.pin_activity_logs.append(event)
-            if len(self.pin_activity_logs) > self.max_log_size:
-                self.pin_activity_logs = self.pin_activity_logs[-self.max_log_size:]
+            logs = self.pin_activity_logs
+            if logs.count == logs.capacity:
+                self.count_dropped(logs, gpio)
+                if self.overflow_policy != self.DROP_OLDEST:
+                    return
+            # A full ring overwrites its oldest record
+            logs.append(gpio, state, time_ns)
 
-    def set_mode(self, gpio, mode, level=0, flag=lgpio.SET_PULL_NONE, bouncetime=0):
+    def log_pwm(self, gpio, frequency, duty_cycle_percentage):
+        """
+        Publish a PWM channel as one periodic segment (start time, period and
+        duty cycle) instead of individual edges; the visualizer draws the
+        waveform from it. A frequency of 0 ends the segment.
+        """
+        time_ns = time.time_ns()
+        period_ns = round(1e9 / frequency) if frequency > 0 else 0
+        duty_ppb = round(duty_cycle_percentage / 100 * DUTY_SCALE) if frequency > 0 else 0
+        self.log_pair(gpio, 1 if frequency > 0 else 0, time_ns, FLAG_PWM, duty_ppb, period_ns)
+        # Running channels are also sent to subscribers that connect later
+        if self.server is None:
+            return
+        if frequency > 0:
+            self.server.retain(('pwm', gpio), pair_bytes(gpio, 1, time_ns, FLAG_PWM, duty_ppb, period_ns))
+        else:
+            self.server.forget(('pwm', gpio))
+
+    def log_group(self, leader, mask, levels):
+        """
+        Publish a write to several pins as one event. Bit n of mask and
+        levels is GPIO n.
+        """
+        time_ns = time.time_ns()
+        with self.log_lock:
+            # Levels of all pins the group wrote so far, for later subscribers
+            known_mask, known_levels = self.group_levels.get(leader, (0, 0))
+            known_mask |= mask
+            known_levels = known_levels & ~mask | levels
+            self.group_levels[leader] = (known_mask, known_levels)
+        self.log_pair(leader, 0, time_ns, FLAG_GROUP, levels, mask)
+        if self.server is not None:
+            self.server.retain(('group', leader), pair_bytes(leader, 0, time_ns, FLAG_GROUP, known_levels, known_mask))
+
+    def log_pair(self, gpio, state, time_ns, flags, value, payload, payload_value=0):
+        """
+        Append a record and the FLAG_PAYLOAD record carrying payload in its
+        timestamp field and payload_value in its value field, both or neither.
+        """
+        with self.log_lock:
+            logs = self.pin_activity_logs
+            free = logs.capacity - logs.count
+            if free < 2:
+                if self.overflow_policy != self.DROP_OLDEST:
+                    self.count_dropped(logs, gpio)
+                    return
+                self.count_dropped(logs, gpio, 2 - free)
+            logs.append(gpio, state, time_ns, flags, value)
+            logs.append(gpio, 0, payload, flags | FLAG_PAYLOAD, payload_value)
+
+    def set_mode(self, gpio, mode, level=0, flag=SET_PULL_NONE, bouncetime=0):
         """
         Flags:
         lgpio.SET_ACTIVE_LOW
@@ -75,36 +654,733 @@ class GPIO:
         """
         if gpio in [18, 19]:
             raise ValueError("GPIOs 18 or 19 are reserved for hardware PWM.")
-        if mode == self.INPUT:
+        if mode == self.INPUT and self.capture_process:
+            if self.capture_worker is None:
+                self.open_capture_worker()
+            self.capture_worker.claim(gpio, flag, bouncetime)
+            self.line_modes[gpio] = 'in'
+        elif mode == self.INPUT:
+            if self.notify_handle is None:
+                self.open_notifications()
             # gpio_claim_alert(handle, gpio, eFlags, lFlags=0, notify_handle=None)
-            lgpio.gpio_claim_alert(self.gpiochip, gpio, lgpio.BOTH_EDGES, flag)
+            self.lgpio.gpio_claim_alert(self.gpiochip, gpio, BOTH_EDGES, flag, self.notify_handle)
             if bouncetime:
-                lgpio.gpio_set_debounce_micros(self.gpiochip, gpio, bouncetime)
-            lgpio.callback(self.gpiochip, gpio, lgpio.BOTH_EDGES, self.input_callback)
+                self.lgpio.gpio_set_debounce_micros(self.gpiochip, gpio, bouncetime)
             self.line_modes[gpio] = 'in'
         elif mode == self.OUTPUT:
             # gpio_claim_output(handle, gpio, level=0, lFlags=0)
-            lgpio.gpio_claim_output(self.gpiochip, gpio, level, flag)
+            self.lgpio.gpio_claim_output(self.gpiochip, gpio, level, flag)
             self.line_modes[gpio] = 'out'
 
-    def input_callback(self, chip, gpio, level, tick):
-        self.log_event(gpio, level)
+    def open_notifications(self):
+        """
+        Open an lgpio notification pipe for the alerts of our input lines
+        and start the thread reading it.
+        """
+        self.notify_handle = self.lgpio.notify_open()
+        self.notify_fd = os.open(notification_path(self.lgpio, self.notify_handle), os.O_RDONLY | os.O_NONBLOCK)
+        self.alert_thread = threading.Thread(target=self.alert_reader, daemon=True)
+        self.alert_thread.start()
+
+    def close_notifications(self):
+        if self.notify_handle is None:
+            return
+        self.lgpio.notify_close(self.notify_handle)
+        if self.alert_thread is not None and self.alert_thread is not threading.current_thread():
+            self.alert_thread.join()
+        os.close(self.notify_fd)
+        self.notify_handle = self.notify_fd = self.alert_thread = None
+
+    def open_capture_worker(self):
+        """
+        Start the capture worker process and the thread draining its ring.
+        """
+        self.open()
+        from capture_worker import CaptureWorker  # Loads multiprocessing
+        self.capture_worker = CaptureWorker(self.backend, self.chip_number, self.capture_cpus)
+        self.alert_thread = threading.Thread(target=self.ring_reader, daemon=True)
+        self.alert_thread.start()
+
+    def close_capture_worker(self):
+        if self.capture_worker is None:
+            return
+        if self.alert_thread is not None and self.alert_thread is not threading.current_thread():
+            self.alert_thread.join()
+        self.capture_worker.stop()
+        # What arrived since the last drain
+        self.drain_ring()
+        self.capture_worker.ring.close(unlink=True)
+        self.capture_worker = self.alert_thread = None
+
+    def ring_reader(self):
+        while not self.stop_event.wait(RING_DRAIN_INTERVAL):
+            self.drain_ring()
+
+    def drain_ring(self):
+        ring = self.capture_worker.ring
+        backlog = len(ring)
+        data = ring.take()
+        with self.log_lock:
+            self.worker_ring_high_water = max(self.worker_ring_high_water, backlog)
+            dropped = ring.dropped - self.worker_dropped
+            if dropped:
+                self.worker_dropped += dropped
+                self.dropped_events += dropped
+        if data:
+            self.ingest_alerts(data)
+
+    def alert_reader(self):
+        remainder = b''
+        while not self.stop_event.is_set():
+            if not select.select([self.notify_fd], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(self.notify_fd, 4096 * NOTIFICATION.size)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            if not data:
+                # No writer (yet or anymore), avoid spinning on EOF
+                time.sleep(0.01)
+                continue
+            data = remainder + data
+            usable = len(data) - len(data) % NOTIFICATION.size
+            remainder = data[usable:]
+            self.ingest_alerts(data[:usable])
+
+    def ingest_alerts(self, data):
+        """
+        Log a batch of notification messages under one lock, stamped with
+        the kernel time of each edge, then run callbacks and edge streams.
+        """
+        alerts = [alert for alert in NOTIFICATION.iter_unpack(data) if alert[4] == 0]
+        if not alerts:
+            return
+        offset = self.tick_clock.offset_for(alerts[0][0])
+        with self.log_lock:
+            logs = self.pin_activity_logs
+            for tick, chip, gpio, level, flags, pad in alerts:
+                if level > 1:
+                    continue  # Watchdog timeout, not an edge
+                if logs.count == logs.capacity:
+                    self.count_dropped(logs, gpio)
+                    if self.overflow_policy != self.DROP_OLDEST:
+                        continue
+                logs.append(gpio, level, tick + offset)
+        callbacks = self.callbacks
+        edge_streams = self.edge_streams
+        if not callbacks and not edge_streams:
+            return
+        # On the same clock as the logged events and the sampled edges
+        for tick, chip, gpio, level, flags, pad in alerts:
+            for cb in callbacks.get(gpio, ()):
+                if level in cb.levels:
+                    cb.func(chip, gpio, level, tick + offset)
+            for stream in edge_streams.get(gpio, ()):
+                stream.push(gpio, level, tick + offset)
+
+    def start_sampling(self, gpios, rate, flag=SET_PULL_NONE):
+        """
+        Read input GPIOs at a fixed rate instead of waiting for their edge
+        alerts, for signals faster than alerts can follow. The GPIOs are
+        claimed as an input group and read with one group read per sample
+        by a thread (see sampler.py, this needs NumPy). The edges between
+        samples are logged, published and passed to callbacks like input
+        edges, stamped with the time of the sample that saw them.
+        sampling_status() reports the achieved rate and missed deadlines.
+
+        :param rate: Samples per second. What Python can reach depends on
+            the board and on the load, check sampling_status().
+        """
+        from sampler import Sampler
+        gpios = list(gpios)
+        if self.sampler is not None:
+            raise ValueError("Already sampling, call stop_sampling() first.")
+        if any(gpio in self.line_modes for gpio in gpios):
+            raise ValueError("GPIOs to sample must not be claimed already.")
+        leader = self.group_claim(gpios, self.INPUT, flag=flag)
+        try:
+            sampler = Sampler(lambda: self.read_group(leader), gpios, rate, self.log_samples)
+        except ValueError:
+            self.group_free(leader)
+            raise
+        self.sampler = sampler
+        sampler.start()
+
+    def stop_sampling(self):
+        """
+        Stop sampling and release the GPIOs. Returns the final status.
+        """
+        sampler = self.sampler
+        if sampler is None:
+            return None
+        sampler.stop()
+        self.sampler = None
+        self.group_free(int(sampler.gpios[0]))
+        return sampler.status()
+
+    def sampling_status(self):
+        """
+        Status of the sampling as a dict (see sampler.Sampler.status()),
+        None when not sampling.
+        """
+        return self.sampler.status() if self.sampler is not None else None
+
+    def log_samples(self, gpios, levels, times_ns):
+        """
+        Log the edges found in a block of samples, called by the sampler.
+        """
+        edges = list(zip(gpios.tolist(), levels.tolist(), times_ns.tolist()))
+        with self.log_lock:
+            logs = self.pin_activity_logs
+            for gpio, level, time_ns in edges:
+                if logs.count == logs.capacity:
+                    self.count_dropped(logs, gpio)
+                    if self.overflow_policy != self.DROP_OLDEST:
+                        continue
+                logs.append(gpio, level, time_ns)
+        callbacks = self.callbacks
+        edge_streams = self.edge_streams
+        if not callbacks and not edge_streams:
+            return
+        for gpio, level, time_ns in edges:
+            for cb in callbacks.get(gpio, ()):
+                if level in cb.levels:
+                    cb.func(self.chip_number, gpio, level, time_ns)
+            for stream in edge_streams.get(gpio, ()):
+                stream.push(gpio, level, time_ns)
+
+    def open_edge_stream(self, gpios, edge, max_pending, keep_first=False):
+        if any(self.line_modes.get(gpio) != 'in' for gpio in gpios):
+            raise ValueError("GPIO must be in INPUT mode to watch its edges.")
+        import asyncio
+        stream = EdgeStream(asyncio.get_running_loop(), edge, max_pending, keep_first)
+        with self.dispatch_lock:
+            for gpio in gpios:
+                self.edge_streams[gpio] = self.edge_streams.get(gpio, ()) + (stream,)
+        return stream
+
+    def close_edge_stream(self, gpios, stream):
+        with self.dispatch_lock:
+            for gpio in gpios:
+                streams = tuple(s for s in self.edge_streams.get(gpio, ()) if s is not stream)
+                if streams:
+                    self.edge_streams[gpio] = streams
+                else:
+                    self.edge_streams.pop(gpio, None)
+
+    async def edges(self, gpios, edge=BOTH_EDGES, max_pending=10000):
+        """
+        Asynchronous iterator over the edges of input GPIOs as
+        (gpio, level, tick) tuples:
+
+            async for gpio, level, tick in pi.edges([4, 17], edge=pi.RISING_EDGE):
+                ...
+
+        tick is the time of the edge as in callback(). Edges arriving
+        together are handed to the event loop as one batch with a single
+        wakeup. If the consumer falls more than max_pending edges behind,
+        the oldest are dropped.
+        """
+        gpios = [gpios] if isinstance(gpios, int) else list(gpios)
+        stream = self.open_edge_stream(gpios, edge, max_pending)
+        try:
+            while True:
+                await stream.wait()
+                while stream.pending:
+                    yield stream.pending.popleft()
+        finally:
+            self.close_edge_stream(gpios, stream)
+
+    async def wait_for_edge(self, gpio, timeout=None, edge=RISING_EDGE):
+        """
+        Wait for the next edge on an input GPIO. Returns the
+        (gpio, level, tick) tuple, or None after timeout seconds.
+        """
+        import asyncio
+        stream = self.open_edge_stream([gpio], edge, 1, keep_first=True)
+        try:
+            await asyncio.wait_for(stream.wait(), timeout)
+            return stream.pending.popleft()
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.close_edge_stream([gpio], stream)
 
     def read(self, gpio):
         if self.line_modes.get(gpio) != 'in':
             raise ValueError("GPIO must be in INPUT mode to read.")
-        return lgpio.gpio_read(self.gpiochip, gpio)
+        # Only lines claimed by the worker, not the members of input groups
+        if self.capture_worker is not None and not any(gpio in g['gpios'] for g in self.groups.values()):
+            return self.capture_worker.level(gpio)
+        return self.lgpio.gpio_read(self.gpiochip, gpio)
 
     def write(self, gpio, level):
         if self.line_modes.get(gpio) != 'out':
             raise ValueError("GPIO must be in OUTPUT mode to write.")
-        lgpio.gpio_write(self.gpiochip, gpio, level)
+        self.lgpio.gpio_write(self.gpiochip, gpio, level)
         self.log_event(gpio, level)
 
+    def group_claim(self, gpios, mode, levels=0, flag=SET_PULL_NONE):
+        """
+        Claim several GPIOs as one group so they can be read or written in a
+        single call. The group is referred to by its first GPIO, the leader.
+        In masks and levels of the group methods, bit i is gpios[i].
+
+        Writes to an output group are published with a 32 bit mask of GPIO
+        numbers, so its GPIOs must be below 32.
+        """
+        if any(gpio in [18, 19] for gpio in gpios):
+            raise ValueError("GPIOs 18 or 19 are reserved for hardware PWM.")
+        if mode == self.OUTPUT and any(gpio >= 32 for gpio in gpios):
+            raise ValueError("The GPIOs of an output group must be below 32.")
+        if mode == self.INPUT:
+            self.lgpio.group_claim_input(self.gpiochip, gpios, flag)
+        elif mode == self.OUTPUT:
+            self.lgpio.group_claim_output(self.gpiochip, gpios, [(levels >> i) & 1 for i in range(len(gpios))], flag)
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+        for gpio in gpios:
+            self.line_modes[gpio] = mode
+        self.groups[gpios[0]] = {'gpios': list(gpios), 'mode': mode}
+        return gpios[0]
+
+    def group_free(self, group):
+        self.lgpio.group_free(self.gpiochip, group)
+        for gpio in self.groups.pop(group)['gpios']:
+            self.line_modes.pop(gpio, None)
+        self.group_levels.pop(group, None)
+        if self.server is not None:
+            self.server.forget(('group', group))
+
+    def read_group(self, group):
+        """
+        Read the levels of all GPIOs of an input group at once, bit i of
+        the result being gpios[i].
+        """
+        if self.groups.get(group, {}).get('mode') != 'in':
+            raise ValueError("Group must be claimed in INPUT mode to read.")
+        status, levels = self.lgpio.group_read(self.gpiochip, group)
+        return levels
+
+    def write_group(self, group, mask, bits):
+        """
+        Set the GPIOs of an output group selected by mask to bits in one call,
+        logged as a single event.
+        """
+        info = self.groups.get(group)
+        if info is None or info['mode'] != 'out':
+            raise ValueError("Group must be claimed in OUTPUT mode to write.")
+        self.lgpio.group_write(self.gpiochip, group, bits, mask)
+        gpio_mask = gpio_levels = 0
+        for i, gpio in enumerate(info['gpios']):
+            if (mask >> i) & 1:
+                gpio_mask |= 1 << gpio
+                gpio_levels |= ((bits >> i) & 1) << gpio
+        self.log_group(group, gpio_mask, gpio_levels)
+
+    def wave_add_new(self):
+        """
+        Start a new wave, discarding the pulses added so far.
+        """
+        self.wave_steps = {}
+        self.wave_length_us = 0
+
+    def wave_add_generic(self, pulses):
+        """
+        Add a list of pulse objects to the wave being built. As in pigpio,
+        every call starts at the beginning of the wave and is merged with the
+        pulses added before, so several GPIOs can be timed independently.
+        Returns the number of pulses in the wave. Wave definitions are
+        published with 32 bit masks, so only GPIOs below 32 can be used.
+        """
+        if any((p.gpio_on | p.gpio_off) >> 32 for p in pulses):
+            raise ValueError("Wave GPIOs must be below 32.")
+        time_us = 0
+        for p in pulses:
+            step = self.wave_steps.setdefault(time_us, [0, 0])
+            step[0] |= p.gpio_on
+            step[1] |= p.gpio_off
+            time_us += p.delay
+        self.wave_length_us = max(self.wave_length_us, time_us)
+        return len(self.wave_steps)
+
+    def wave_create(self):
+        """
+        Compile the wave built so far and return its id. The pulses are
+        packed for lgpio's tx_wave once, so sending the wave does no per-pulse
+        work. Its GPIOs must be one OUTPUT GPIO or belong to one output group
+        (see group_claim), which the wave is sent on.
+
+        The wave is published to subscribers once, its transmissions are then
+        logged as single segments instead of edges.
+        """
+        if not self.wave_steps:
+            raise ValueError("No pulses were added to the wave.")
+        self.open()
+        gpios = 0
+        for on, off in self.wave_steps.values():
+            gpios |= on | off
+        group, positions = self.wave_group([gpio for gpio in range(32) if gpios >> gpio & 1])
+        times = sorted(self.wave_steps)
+        pulses = []
+        definition = []
+        for i, time_us in enumerate(times):
+            on, off = self.wave_steps[time_us]
+            bits = mask = 0
+            for gpio, position in positions.items():
+                if (on | off) >> gpio & 1:
+                    mask |= 1 << position
+                if on >> gpio & 1:
+                    bits |= 1 << position
+            end_us = times[i + 1] if i + 1 < len(times) else self.wave_length_us
+            pulses.append((bits, mask, end_us - time_us))
+            definition.append((time_us * 1000, on, off))
+        wave_id = next(i for i in itertools.count() if i not in self.waves)
+        self.waves[wave_id] = {
+            'group': group,
+            'length_ns': self.wave_length_us * 1000,
+            'packed': b''.join([WAVE_PULSE.pack(*p) for p in pulses]),
+            'pulse_count': len(pulses),
+        }
+        self.log_wave_definition(wave_id, definition)
+        self.wave_add_new()
+        return wave_id
+
+    def wave_group(self, gpios):
+        """
+        Output group a wave on gpios is sent on, and the bit position of
+        every GPIO in that group.
+        """
+        for leader, info in self.groups.items():
+            if info['mode'] == 'out' and all(gpio in info['gpios'] for gpio in gpios):
+                return leader, {gpio: info['gpios'].index(gpio) for gpio in gpios}
+        if len(gpios) == 1 and self.line_modes.get(gpios[0]) == 'out':
+            return gpios[0], {gpios[0]: 0}
+        raise ValueError("The GPIOs of a wave must be one OUTPUT GPIO or an output group.")
+
+    def log_wave_definition(self, wave_id, definition):
+        """
+        Publish the pulses of a wave, one pair per (offset_ns, on, off) step.
+        The server also keeps them for subscribers that connect later.
+        """
+        data = b''.join([RECORD.pack(WIRE_VERSION, FLAG_WAVE_PULSE, 0, 0, wave_id, offset_ns) +
+                         RECORD.pack(WIRE_VERSION, FLAG_WAVE_PULSE | FLAG_PAYLOAD, 0, 0, on, off)
+                         for offset_ns, on, off in definition])
+        with self.log_lock:
+            self.log_control.append(data)
+        self.server.retain(('wave', wave_id), data)
+
+    def wave(self, wave_id):
+        wave = self.waves.get(wave_id)
+        if wave is None:
+            raise ValueError(f"Unknown wave id: {wave_id}")
+        return wave
+
+    def wave_delete(self, wave_id):
+        self.wave(wave_id)
+        for group, (_, _, repeated) in list(self.wave_repeaters.items()):
+            if repeated == wave_id:
+                self.stop_wave_repeat(group)
+        del self.waves[wave_id]
+        if self.server is not None:
+            self.server.forget(('wave', wave_id))
+
+    def wave_clear(self):
+        """
+        Delete all waves and the one being built.
+        """
+        for wave_id in list(self.waves):
+            self.wave_delete(wave_id)
+        self.wave_add_new()
+
+    def submit_wave(self, group, packed):
+        """
+        Queue pulses packed as WAVE_PULSE on a group, returning the room left
+        in its queue.
+
+        With lgpio the packed bytes go straight to its private C binding
+        (_lgpio._tx_wave and the _u2i status check), because the public
+        tx_wave takes pulse objects and packs every pulse again on each
+        call. Backends without them, like the simulated chip or an lgpio
+        version that changed its internals, get pulse objects through the
+        public tx_wave.
+        """
+        lg = self.lgpio
+        binding = getattr(lg, '_lgpio', None)
+        if hasattr(binding, '_tx_wave') and hasattr(lg, '_u2i'):
+            return lg._u2i(binding._tx_wave(self.gpiochip & 0xffff, group, packed))
+        return lg.tx_wave(self.gpiochip, group, [lg.pulse(*p) for p in WAVE_PULSE.iter_unpack(packed)])
+
+    def log_waves(self, group, runs):
+        """
+        Log transmissions queued on a group as one segment per run of (wave
+        id, repeats); a wave id of None is a gap of repeats microseconds. They
+        start when the waves queued before them are done.
+        """
+        segments = []
+        # The repeater thread and the caller may queue on a group at once
+        with self.log_lock:
+            time_ns = max(time.time_ns(), self.wave_queue_end.get(group, 0))
+            for wave_id, repeats in runs:
+                if wave_id is None:
+                    time_ns += repeats * 1000
+                    continue
+                length_ns = self.waves[wave_id]['length_ns']
+                segments.append((time_ns, wave_id, length_ns, repeats))
+                time_ns += length_ns * repeats
+            self.wave_queue_end[group] = time_ns
+        for start_ns, wave_id, length_ns, repeats in segments:
+            self.log_pair(group, 1, start_ns, FLAG_WAVE, wave_id, length_ns, repeats)
+
+    def wave_send_once(self, wave_id):
+        """
+        Queue a wave for transmission once. Returns the room left in the
+        group's queue.
+        """
+        wave = self.wave(wave_id)
+        room = self.submit_wave(wave['group'], wave['packed'])
+        self.log_waves(wave['group'], [(wave_id, 1)])
+        return room
+
+    def wave_send_repeat(self, wave_id):
+        """
+        Transmit a wave over and over until wave_tx_stop(). A thread keeps
+        the group's lgpio queue filled, each refill being logged as one
+        segment with its number of repeats.
+        """
+        wave = self.wave(wave_id)
+        self.stop_wave_repeat(wave['group'])
+        stop = threading.Event()
+        thread = threading.Thread(target=self.wave_repeater, args=(wave_id, wave, stop), daemon=True)
+        self.wave_repeaters[wave['group']] = (thread, stop, wave_id)
+        thread.start()
+
+    def wave_repeater(self, wave_id, wave, stop):
+        # Short waves are queued several at a time to keep the refills rare
+        copies = max(WAVE_REPEAT_NS // max(wave['length_ns'], 1), 1)
+        packed = wave['packed'] * copies
+        lg, handle, group = self.lgpio, self.gpiochip, wave['group']
+        capacity = 1
+        deadline = None
+        while not stop.is_set():
+            room = lg.tx_room(handle, group, TX_WAVE)
+            if deadline is not None:
+                # Woken late, or so late that the queue ran empty
+                self.repeater_late.add(max(time.monotonic_ns() - deadline, 0))
+                if room >= capacity and not lg.tx_busy(handle, group, TX_WAVE):
+                    self.wave_underruns += 1
+            capacity = max(capacity, room)
+            for _ in range(room):
+                self.submit_wave(group, packed)
+            if room:
+                self.log_waves(group, [(wave_id, room * copies)])
+            # Refill when about half of a full queue has been sent
+            wait = max(capacity * copies * wave['length_ns'] / 2e9, 0.001)
+            deadline = time.monotonic_ns() + int(wait * 1e9)
+            stop.wait(wait)
+
+    def stop_wave_repeat(self, group):
+        repeater = self.wave_repeaters.pop(group, None)
+        if repeater is not None:
+            repeater[1].set()
+            repeater[0].join()
+
+    def wave_chain(self, data):
+        """
+        Transmit a chain of waves given in pigpio's format: wave ids,
+        255 0 ... 255 1 x y to repeat a section x + 256*y times, and
+        255 2 x y for a gap of x + 256*y microseconds. The chain is submitted
+        to lgpio as one queue entry made of the compiled waves.
+
+        Looping forever (255 3) cannot be queued, use wave_send_repeat().
+        A chain expanding to more than MAX_CHAIN_PULSES pulses is rejected,
+        repeat a wave that long with wave_send_repeat() too. Returns the room
+        left in the group's queue.
+        """
+        runs = self.parse_chain(list(data))
+        groups = {self.waves[wave_id]['group'] for wave_id, _ in runs if wave_id is not None}
+        if len(groups) != 1:
+            raise ValueError("The waves of a chain must be sent on the same group.")
+        group = groups.pop()
+        packed = [WAVE_PULSE.pack(0, 0, repeats) if wave_id is None else self.waves[wave_id]['packed'] * repeats
+                  for wave_id, repeats in runs]
+        room = self.submit_wave(group, b''.join(packed))
+        self.log_waves(group, runs)
+        return room
+
+    def parse_chain(self, data):
+        """
+        Expand a wave_chain() command list into runs of (wave id, repeats),
+        a wave id of None being a gap of repeats microseconds. A loop over a
+        single wave becomes one run, other loops are written out, and a
+        chain of more than MAX_CHAIN_PULSES pulses is rejected before it is.
+        """
+        sections = [[]]
+        i = 0
+        while i < len(data):
+            if data[i] != 255:
+                self.wave(data[i])
+                add_run(sections[-1], data[i], 1)
+                i += 1
+                continue
+            command = data[i + 1] if i + 1 < len(data) else None
+            if command == 0:
+                sections.append([])
+                i += 2
+                continue
+            if command not in (1, 2) or i + 3 >= len(data):
+                raise ValueError(f"Unsupported wave chain command 255 {command} at position {i}.")
+            count = data[i + 2] + 256 * data[i + 3]
+            if command == 1:
+                if len(sections) == 1:
+                    raise ValueError("Wave chain loop end without a loop start.")
+                section = sections.pop()
+                if len(section) == 1 and section[0][0] is not None:
+                    add_run(sections[-1], section[0][0], section[0][1] * count)
+                else:
+                    if self.chain_pulses(section) * count > MAX_CHAIN_PULSES:
+                        raise ValueError(f"Wave chain longer than {MAX_CHAIN_PULSES} pulses.")
+                    for _ in range(count):
+                        for wave_id, repeats in section:
+                            add_run(sections[-1], wave_id, repeats)
+            else:
+                sections[-1].append((None, count))
+            i += 4
+        if len(sections) != 1:
+            raise ValueError("Wave chain loop start without a loop end.")
+        runs = sections[0]
+        if all(wave_id is None for wave_id, _ in runs):
+            raise ValueError("Wave chain holds no waves.")
+        if self.chain_pulses(runs) > MAX_CHAIN_PULSES:
+            raise ValueError(f"Wave chain longer than {MAX_CHAIN_PULSES} pulses.")
+        return runs
+
+    def chain_pulses(self, runs):
+        """
+        Pulses the runs of a chain expand to, a gap taking one.
+        """
+        return sum(1 if wave_id is None else self.waves[wave_id]['pulse_count'] * repeats
+                   for wave_id, repeats in runs)
+
+    def wave_tx_busy(self):
+        """
+        1 while a wave is being transmitted on any group, else 0.
+        """
+        if self.handle is None:
+            return 0
+        return int(any(self.lgpio.tx_busy(self.handle, group, TX_WAVE)
+                       for group in set(wave['group'] for wave in self.waves.values())))
+
+    def wave_tx_stop(self):
+        """
+        Stop repeating waves. lgpio cannot abort a queued wave, so what is
+        already queued is still transmitted.
+        """
+        for group in list(self.wave_repeaters):
+            self.stop_wave_repeat(group)
+
+    def metrics(self):
+        """
+        Snapshot of the event pipeline counters as a dict:
+
+            produced, produced_per_pin     events logged, in total and by GPIO,
+                                           as of the last flush
+            dropped, dropped_per_pin       events lost: in total, and by GPIO
+                                           those lost in a full buffer
+            subscriber_dropped             lost in subscriber queues
+            buffer_high_water              most events waiting for a flush,
+                                           out of buffer_capacity
+            flushes, flush_ns              flushes with events and their
+                                           duration histogram
+            write_latency_ns               age of the oldest event of each
+                                           flush when it was published
+            bytes_published, bytes_sent    bytes handed to the event server,
+                                           and sent to all subscribers
+            subscribers                    connected subscribers
+            subscriber_errors              subscribers disconnected after
+                                           an unexpected send error
+            wave_underruns                 times a repeated wave queue ran
+                                           empty before the refill
+            repeater_late_ns               how late the wave repeater woke up
+            worker_dropped                 edges lost in a full capture
+                                           worker ring, also in dropped
+            worker_ring_high_water         most edges waiting in the ring
+            sampling                       sampling_status()
+
+        Histograms are summaries like in stats(): count, min_ns, max_ns,
+        mean_ns, p50_ns, p90_ns and p99_ns.
+        """
+        with self.log_lock:
+            server = self.server
+            return {
+                'produced': sum(self.produced),
+                'produced_per_pin': {gpio: count for gpio, count in enumerate(self.produced) if count},
+                'dropped': self.dropped_events,
+                'dropped_per_pin': {gpio: count for gpio, count in enumerate(self.dropped_pins) if count},
+                'subscriber_dropped': self.subscriber_dropped,
+                'buffer_high_water': self.buffer_high_water,
+                'buffer_capacity': self.max_log_size,
+                'flushes': self.flush_times.count,
+                'flush_ns': self.flush_times.summary(),
+                'write_latency_ns': self.write_latency.summary(),
+                'bytes_published': self.bytes_published,
+                'bytes_sent': server.bytes_sent if server is not None else 0,
+                'subscribers': len(server.clients) if server is not None else 0,
+                'subscriber_errors': server.send_errors if server is not None else 0,
+                'wave_underruns': self.wave_underruns,
+                'repeater_late_ns': self.repeater_late.summary(),
+                'worker_dropped': self.worker_dropped,
+                'worker_ring_high_water': self.worker_ring_high_water,
+                'sampling': self.sampling_status(),
+            }
+
+    def stats(self, gpio):
+        """
+        Running statistics of the edges of a GPIO as a dict: edge counts,
+        high and low pulse widths (count, min, max, mean and percentiles in
+        ns from a histogram) and the frequency and duty cycle over the last
+        stats_window seconds. None before the first edge. PWM channels and
+        waves are logged as segments and have no edge statistics.
+
+        The statistics are taken from the published events by the log
+        writer, so they lag by up to one flush and leave out edges lost in
+        a full buffer.
+        """
+        with self.stats_lock:
+            return self.pulse_stats.summary(gpio, time.time_ns())
+
+    def reset_stats(self, gpio=None):
+        """
+        Start the statistics of a GPIO, or of all of them, over.
+        """
+        with self.stats_lock:
+            self.pulse_stats.reset(gpio)
+
     def callback(self, gpio, edge, callback=None):
+        """
+        Call callback(chip, gpio, level, tick) on the given edges of an input
+        GPIO, tick being the time of the edge in time.time_ns() nanoseconds:
+        its kernel timestamp mapped to the wall clock, or the time of the
+        sample that saw it while sampling, the same as in the published
+        events. Without a callback the edges are only counted, see tally().
+        Returns the Callback; cancel() removes it.
+        """
         if self.line_modes.get(gpio) != 'in':
             raise ValueError("GPIO must be in INPUT mode to add a callback.")
-        return lgpio.callback(self.gpiochip, gpio, edge, callback)
+        cb = Callback(self, gpio, edge, callback)
+        with self.dispatch_lock:
+            self.callbacks[gpio] = self.callbacks.get(gpio, ()) + (cb,)
+        return cb
+
+    def remove_callback(self, cb):
+        with self.dispatch_lock:
+            callbacks = tuple(c for c in self.callbacks.get(cb.gpio, ()) if c is not cb)
+            if callbacks:
+                self.callbacks[cb.gpio] = callbacks
+            else:
+                self.callbacks.pop(cb.gpio, None)
 
     def software_PWM(self, gpio, frequency, duty_cycle_percentage=50):
         """
@@ -112,12 +1388,9 @@ class GPIO:
         """
         if self.line_modes.get(gpio) != 'out':
             raise ValueError("GPIO must be in OUTPUT mode to use PWM.")
-        lgpio.tx_pwm(self.gpiochip, gpio, frequency, duty_cycle_percentage, pulse_offset=0, pulse_cycles=0)
+        self.lgpio.tx_pwm(self.gpiochip, gpio, frequency, duty_cycle_percentage, pulse_offset=0, pulse_cycles=0)
         self.pwm_channels[gpio] = {'frequency': frequency, 'duty_cycle_percentage': duty_cycle_percentage}
-        if frequency > 0:
-            self.start_pwm_logging_thread(gpio, frequency, duty_cycle_percentage)
-        else:
-            self.stop_monitoring(gpio)
+        self.log_pwm(gpio, frequency, duty_cycle_percentage)
 
     def hardware_PWM(self, gpio, frequency, duty_cycle_percentage=50):
         """
@@ -132,91 +1405,93 @@ class GPIO:
         """
         if gpio not in [18, 19]:
             raise ValueError("GPIO must be 18 or 19")
-        pwm_channel_number = 2 if gpio == 18 else 3
-        chip = 'pwmchip2'
-        pwm_channel = f'pwm{pwm_channel_number}'
+        self.open()  # For the event server and to be turned off by stop()
         period_ns = int(1e9 / frequency) if frequency > 0 else 0
         duty_cycle_ns = int(period_ns * (duty_cycle_percentage / 100)) if frequency > 0 else 0
-        pwm_path = f'/sys/class/pwm/{chip}'
-        channel_path = f'{pwm_path}/{pwm_channel}'
-        if not os.path.exists(channel_path):
-            with open(f'{pwm_path}/export', 'w') as f:
-                f.write(str(pwm_channel_number))
-        # Disable the PWM channel
-        with open(f'{channel_path}/enable', 'r') as f:
-            enabled = int(f.read())
-        if enabled:
-            with open(f'{channel_path}/enable', 'w') as f:
-                f.write('0')
+        channel = self.pwm_sysfs_channel(gpio)
         if frequency > 0:
-            # Read current period and duty cycle
-            with open(f'{channel_path}/period', 'r') as f:
-                current_period = int(f.read())
-            with open(f'{channel_path}/duty_cycle', 'r') as f:
-                current_duty_cycle = int(f.read())
-
-            # If the current duty cycle is higher than the new period, set the new duty cycle first
-            if current_duty_cycle > period_ns:
-                with open(f'{channel_path}/duty_cycle', 'w') as f:
-                    f.write(str(int(duty_cycle_ns)))
-
-            # If the new duty cycle is higher than the current period, set the new period first
-            if duty_cycle_ns > current_period:
-                with open(f'{channel_path}/period', 'w') as f:
-                    f.write(str(int(period_ns)))
-
-            # Set the duty cycle if it wasn't set before
-            if current_duty_cycle <= period_ns:
-                with open(f'{channel_path}/duty_cycle', 'w') as f:
-                    f.write(str(int(duty_cycle_ns)))
-
-            # Set the period if it wasn't set before
-            if duty_cycle_ns <= current_period:
-                with open(f'{channel_path}/period', 'w') as f:
-                    f.write(str(int(period_ns)))
-
-            with open(f'{channel_path}/enable', 'w') as f:
-                f.write('1')
-        self.pwm_channels[gpio] = {'frequency': frequency, 'duty_cycle_percentage': duty_cycle_percentage}
-        if frequency > 0:
-            self.start_pwm_logging_thread(gpio, frequency, duty_cycle_percentage)
+            if period_ns != channel['period']:
+                # The period can only change while the channel is disabled
+                self.write_pwm_attribute(channel, 'enable', 0)
+                # duty_cycle may never exceed period, so shrink whichever has to go first
+                if channel['duty_cycle'] > period_ns:
+                    self.write_pwm_attribute(channel, 'duty_cycle', duty_cycle_ns)
+                    self.write_pwm_attribute(channel, 'period', period_ns)
+                else:
+                    self.write_pwm_attribute(channel, 'period', period_ns)
+                    self.write_pwm_attribute(channel, 'duty_cycle', duty_cycle_ns)
+            else:
+                # Duty cycle only changes are applied without a glitch
+                self.write_pwm_attribute(channel, 'duty_cycle', duty_cycle_ns)
+            self.write_pwm_attribute(channel, 'enable', 1)
         else:
-            self.stop_monitoring(gpio)
-
-    def start_pwm_logging_thread(self, channel, frequency, duty_cycle_percentage):
-        """
-        Start a thread to simulate PWM signal and log its activity.
-        """
-        def pwm_thread(channel, frequency, duty_cycle_percentage):
-            period_ns = 1e9 / frequency
-            high_time_ns = period_ns * (duty_cycle_percentage / 100)
-            low_time_ns = period_ns - high_time_ns
-            while not self.stop_threads and self.pwm_channels[channel]['frequency'] > 0:
-                self.log_event(channel, 1)
-                time.sleep(high_time_ns / 1e9)
-                self.log_event(channel, 0)
-                time.sleep(low_time_ns / 1e9)
-        if channel in self.callback_threads:
-            self.stop_monitoring(channel)
-        pwm_logging_thread = threading.Thread(target=pwm_thread, args=(channel, frequency, duty_cycle_percentage), daemon=True)
-        self.callback_threads[channel] = pwm_logging_thread
-        pwm_logging_thread.start()
+            self.write_pwm_attribute(channel, 'enable', 0)
+        self.pwm_channels[gpio] = {'frequency': frequency, 'duty_cycle_percentage': duty_cycle_percentage}
+        self.log_pwm(gpio, frequency, duty_cycle_percentage)
+
+    def pwm_sysfs_channel(self, gpio):
+        """
+        Open the sysfs files of a hardware PWM channel once, exporting it if
+        needed, and remember their current values. Later calls reuse the fds
+        and the cached values, so nothing has to be read back.
+        """
+        channel = self.pwm_sysfs.get(gpio)
+        if channel is None:
+            pwm_channel_number = 2 if gpio == 18 else 3
+            pwm_path = os.path.join(self.pwm_sysfs_root, 'pwmchip2')
+            channel_path = os.path.join(pwm_path, f'pwm{pwm_channel_number}')
+            if not os.path.exists(channel_path):
+                with open(os.path.join(pwm_path, 'export'), 'w') as f:
+                    f.write(str(pwm_channel_number))
+            # A plain file standing in for sysfs keeps the digits of a longer
+            # previous value, so those are truncated after each write
+            channel = {'fds': {}, 'truncate': not os.path.realpath(channel_path).startswith('/sys/')}
+            for name in ['period', 'duty_cycle', 'enable']:
+                fd = os.open(os.path.join(channel_path, name), os.O_RDWR)
+                channel['fds'][name] = fd
+                channel[name] = int(os.pread(fd, 32, 0) or 0)
+            self.pwm_sysfs[gpio] = channel
+        return channel
+
+    def write_pwm_attribute(self, channel, name, value):
+        """
+        Write a sysfs PWM attribute unless it already holds value.
+        """
+        if channel[name] != value:
+            data = str(value).encode()
+            fd = channel['fds'][name]
+            os.pwrite(fd, data, 0)
+            if channel['truncate']:
+                os.ftruncate(fd, len(data))
+            channel[name] = value
+
+    def close_pwm_sysfs(self):
+        for channel in self.pwm_sysfs.values():
+            for fd in channel['fds'].values():
+                os.close(fd)
+        self.pwm_sysfs = {}
 
     def stop_monitoring(self, gpio):
         """
-        Stop monitoring a GPIO or PWM channel and its associated thread.
+        Stop publishing the activity of a PWM channel.
         """
-        if gpio in self.callback_threads:
-            if gpio in self.pwm_channels:
-                self.pwm_channels[gpio]['frequency'] = 0
-            del self.callback_threads[gpio]
+        if self.pwm_channels.get(gpio, {}).get('frequency', 0) > 0:
+            self.pwm_channels[gpio]['frequency'] = 0
+            self.log_pwm(gpio, 0, 0)
 
     def cleanup(self):
         self.stop()
 
     def stop(self):
+        """
+        Turn hardware PWM off, join the threads, publish the last events and
+        release the chip and the event socket. The instance can be opened
+        again afterwards.
+        """
+        if self.handle is None:
+            self.stop_recording()
+            return
         print('GPIO cleanup')
-        self.stop_threads = True
 
         # Stop hardware PWM for any active channels
         for gpio in self.pwm_channels:
@@ -224,7 +1499,28 @@ class GPIO:
                 if gpio in [18, 19]:  # Only for GPIO 18/19
                     self.hardware_PWM(gpio, 0)  # Set frequency to 0
 
-        lgpio.gpiochip_close(self.gpiochip)
-
-# Register the cleanup function to run at exit
-atexit.register(GPIO().cleanup) 
+        self.close_pwm_sysfs()
+        self.wave_tx_stop()
+        self.stop_sampling()
+        self.stop_event.set()
+        self.close_notifications()
+        self.close_capture_worker()
+        # Hand out the last events before the server goes away
+        if self.log_thread is not threading.current_thread():
+            self.log_thread.join()
+        self.flush_log()
+        self.stop_recording()
+        self.server.close()
+        serving_paths.discard(self.socket_path)
+        self.backend_module.gpiochip_close(self.handle)
+        self.handle = None
+        self.server = None
+        self.log_thread = None
+        self.line_modes = {}
+        self.groups = {}
+        self.callbacks = {}
+        self.pwm_channels = {}
+        self.group_levels = {}
+        self.waves = {}  # Sent on groups that are released now
+        self.wave_queue_end = {}
+        atexit.unregister(self.stop)
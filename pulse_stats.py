@@ -0,0 +1,264 @@
+"""
+Running pulse statistics per pin, updated in O(1) per edge.
+
+For every pin PulseStats keeps edge counts and, for high and low pulses
+separately, a fixed-bin histogram of the pulse widths with their count,
+min, max and sum. The bins are log-spaced with 8 per octave (the three
+bits after the leading one of the width), so percentiles are exact to
+about 6% from nanoseconds to hours in 512 counters. Frequency and duty
+cycle are estimated from the pulses that ended in a sliding window, kept
+as a few time buckets.
+
+add() takes one edge and only needs the standard library, for the
+producer. add_edges() takes the arrays of one pin's edges and does the
+same with NumPy, for the visualizer; NumPy is only imported there.
+"""
+from collections import deque
+
+BINS_PER_OCTAVE = 8
+HISTOGRAM_BINS = 64 * BINS_PER_OCTAVE
+
+
+def width_bin(width_ns):
+    """
+    Histogram bin of a pulse width: widths below 8 ns get a bin each, then
+    every octave is split in 8 by the bits after the leading one.
+    """
+    if width_ns < BINS_PER_OCTAVE:
+        return max(width_ns, 0)
+    bits = width_ns.bit_length()
+    return (bits - 3) * BINS_PER_OCTAVE + ((width_ns >> (bits - 4)) & 7)
+
+
+def bin_range(index):
+    """
+    (lowest, highest + 1) width in ns of a histogram bin.
+    """
+    if index < BINS_PER_OCTAVE:
+        return index, index + 1
+    shift = index // BINS_PER_OCTAVE - 1
+    low = (BINS_PER_OCTAVE + index % BINS_PER_OCTAVE) << shift
+    return low, low + (1 << shift)
+
+
+class WidthHistogram:
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BINS
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+
+    def add(self, width_ns):
+        if width_ns < BINS_PER_OCTAVE:
+            index = max(width_ns, 0)
+        else:
+            # width_bin() inlined, this runs for every edge the producer logs
+            bits = width_ns.bit_length()
+            index = (bits - 3) * BINS_PER_OCTAVE + ((width_ns >> (bits - 4)) & 7)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ns += width_ns
+        if self.min_ns is None or width_ns < self.min_ns:
+            self.min_ns = width_ns
+        if self.max_ns is None or width_ns > self.max_ns:
+            self.max_ns = width_ns
+
+    def add_many(self, widths_ns):
+        if not len(widths_ns):
+            return
+        import numpy as np
+        widths_ns = np.maximum(widths_ns, 0)
+        # frexp gives the bit length of the widths as the exponent
+        bits = np.frexp(widths_ns.astype(np.float64))[1].astype(np.int64)
+        mantissa = (widths_ns >> np.maximum(bits - 4, 0)) & 7
+        bins = np.where(widths_ns < BINS_PER_OCTAVE, widths_ns, (bits - 3) * BINS_PER_OCTAVE + mantissa)
+        for index, count in zip(*np.unique(bins, return_counts=True)):
+            self.counts[int(index)] += int(count)
+        self.count += len(widths_ns)
+        self.total_ns += int(widths_ns.sum())
+        low, high = int(widths_ns.min()), int(widths_ns.max())
+        self.min_ns = low if self.min_ns is None else min(self.min_ns, low)
+        self.max_ns = high if self.max_ns is None else max(self.max_ns, high)
+
+    def percentile(self, percent):
+        """
+        Width below which percent of the pulses are, to the bin's resolution.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                low, high = bin_range(index)
+                return min(max((low + high) // 2, self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'min_ns': self.min_ns,
+            'max_ns': self.max_ns,
+            'mean_ns': self.total_ns / self.count,
+            'p50_ns': self.percentile(50),
+            'p90_ns': self.percentile(90),
+            'p99_ns': self.percentile(99),
+        }
+
+
+class PinStats:
+    """
+    Statistics of one pin. The window is split in buckets, each holding
+    [bucket number, high sum, high count, low sum, low count] of the pulses
+    that ended in it.
+    """
+    def __init__(self, window_ns, buckets=10):
+        self.bucket_ns = max(window_ns // buckets, 1)
+        self.buckets = buckets
+        self.window = deque()
+        self.edges = 0
+        self.rising = 0
+        self.falling = 0
+        self.level = None
+        self.last_ns = None  # Time of the last level change
+        self.high = WidthHistogram()
+        self.low = WidthHistogram()
+
+    def add(self, level, time_ns):
+        previous = self.level
+        if level == previous:
+            return  # Written again, not an edge
+        if previous is not None:
+            width_ns = time_ns - self.last_ns
+            number = time_ns // self.bucket_ns
+            bucket = self.window[-1] if self.window and self.window[-1][0] == number else self.bucket(number)
+            if previous:
+                self.high.add(width_ns)
+                bucket[1] += width_ns
+                bucket[2] += 1
+            else:
+                self.low.add(width_ns)
+                bucket[3] += width_ns
+                bucket[4] += 1
+        self.edges += 1
+        if level:
+            self.rising += 1
+        else:
+            self.falling += 1
+        self.level = level
+        self.last_ns = time_ns
+
+    def add_edges(self, timestamps, levels):
+        """
+        Add a pin's edges in time order from NumPy arrays.
+        """
+        import numpy as np
+        previous = np.concatenate([[-1 if self.level is None else self.level], levels[:-1]])
+        changed = levels != previous
+        timestamps, levels, previous = timestamps[changed], levels[changed].astype(np.int64), previous[changed]
+        if not len(timestamps):
+            return
+        starts = np.concatenate([[timestamps[0] if self.last_ns is None else self.last_ns], timestamps[:-1]])
+        widths = timestamps - starts
+        high, low = previous == 1, previous == 0
+        self.high.add_many(widths[high])
+        self.low.add_many(widths[low])
+        numbers, inverse = np.unique(timestamps // self.bucket_ns, return_inverse=True)
+        sums = [np.bincount(inverse, weights=np.where(mask, widths, 0), minlength=len(numbers)) for mask in (high, low)]
+        counts = [np.bincount(inverse, weights=mask, minlength=len(numbers)) for mask in (high, low)]
+        for i, number in enumerate(numbers.tolist()):
+            bucket = self.bucket(number)
+            bucket[1] += int(sums[0][i])
+            bucket[2] += int(counts[0][i])
+            bucket[3] += int(sums[1][i])
+            bucket[4] += int(counts[1][i])
+        self.edges += len(timestamps)
+        rising = int(levels.sum())
+        self.rising += rising
+        self.falling += len(levels) - rising
+        self.level = int(levels[-1])
+        self.last_ns = int(timestamps[-1])
+
+    def bucket(self, number):
+        window = self.window
+        if not window or window[-1][0] != number:
+            window.append([number, 0, 0, 0, 0])
+            while window[0][0] <= number - self.buckets:
+                window.popleft()
+        return window[-1]
+
+    def summary(self, now_ns):
+        """
+        The statistics as a dict, frequency and duty cycle over the window
+        ending at now_ns.
+        """
+        oldest = now_ns // self.bucket_ns - self.buckets
+        high_ns = high_count = low_ns = low_count = 0
+        for number, high_sum, highs, low_sum, lows in self.window:
+            if number > oldest:
+                high_ns += high_sum
+                high_count += highs
+                low_ns += low_sum
+                low_count += lows
+        frequency = duty = None
+        if high_count and low_count:
+            mean_high, mean_low = high_ns / high_count, low_ns / low_count
+            frequency = 1e9 / (mean_high + mean_low)
+            duty = 100 * mean_high / (mean_high + mean_low)
+        elif self.level is not None and not high_count and not low_count:
+            # No pulse ended in the window: the line is steady
+            frequency = 0.0
+            duty = 100.0 * self.level
+        return {
+            'edges': self.edges,
+            'rising': self.rising,
+            'falling': self.falling,
+            'level': self.level,
+            'last_edge_ns': self.last_ns,
+            'frequency_hz': frequency,
+            'duty_cycle_percentage': duty,
+            'window_s': self.bucket_ns * self.buckets / 1e9,
+            'high': self.high.summary(),
+            'low': self.low.summary(),
+        }
+
+
+class PulseStats:
+    """
+    PinStats of every pin that had an edge.
+
+    :param window_s: Length of the frequency and duty cycle window.
+    """
+    def __init__(self, window_s=1.0):
+        self.window_ns = int(window_s * 1e9)
+        self.pins = {}
+
+    def pin(self, gpio):
+        stats = self.pins.get(gpio)
+        if stats is None:
+            stats = self.pins[gpio] = PinStats(self.window_ns)
+        return stats
+
+    def add(self, gpio, level, time_ns):
+        stats = self.pins.get(gpio)
+        if stats is None:
+            stats = self.pin(gpio)
+        if level != stats.level:
+            stats.add(level, time_ns)
+
+    def add_edges(self, gpio, timestamps, levels):
+        self.pin(gpio).add_edges(timestamps, levels)
+
+    def summary(self, gpio, now_ns):
+        stats = self.pins.get(gpio)
+        return stats.summary(now_ns) if stats is not None else None
+
+    def reset(self, gpio=None):
+        if gpio is None:
+            self.pins = {}
+        else:
+            self.pins.pop(gpio, None)
@@ -0,0 +1,159 @@
+"""
+Fixed-rate sampling of input lines, for signals faster than edge alerts.
+
+A Sampler thread reads a group of input lines at a fixed rate with one
+group read per sample, like a logic analyzer. The samples are bit-packed,
+one word per sample with bit i the level of the i-th line as group_read
+returns it, collected into NumPy blocks, and each block is run-length
+compressed into the edges between its samples with a few array operations,
+so only edges reach the event stream. An edge is stamped with the time of
+the first sample that saw the new level; pulses shorter than a sample
+period can be missed.
+
+Every sample has a deadline, one period after the previous one. The
+thread sleeps until shortly before it and then spins. A sample taken a
+period or more late counts the deadlines it missed and skips them instead
+of catching up with a burst of reads. The achieved rate and the missed
+deadlines are in status().
+"""
+import threading
+import time
+
+import numpy as np
+
+BLOCK_SAMPLES = 1 << 16  # Most samples compressed at once
+FLUSH_INTERVAL_NS = 50_000_000  # Longest time samples wait to be compressed
+SPIN_NS = 200_000  # Deadlines closer than this are waited for by spinning
+WORD_DTYPES = [(8, '<u1'), (16, '<u2'), (32, '<u4'), (64, '<u8')]
+
+
+def run_length_edges(words, times, previous=None):
+    """
+    Edges in a block of samples as (lines, levels, times) arrays in time
+    order, lines being bit numbers of the words.
+
+    :param previous: Last word of the block before, or None to report the
+        level of every line at the first sample.
+    """
+    changed = np.empty_like(words)
+    changed[1:] = words[1:] ^ words[:-1]
+    changed[0] = words[0] ^ previous if previous is not None else np.iinfo(words.dtype).max
+    samples = np.flatnonzero(changed)
+    width = words.dtype.itemsize * 8
+    if not len(samples):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.int64)
+    # One row of bits per changed sample
+    bits = np.unpackbits(changed[samples].view(np.uint8).reshape(-1, width // 8), axis=1, bitorder='little')
+    levels = np.unpackbits(words[samples].view(np.uint8).reshape(-1, width // 8), axis=1, bitorder='little')
+    rows, lines = np.nonzero(bits)
+    return lines, levels[rows, lines], times[samples[rows]]
+
+
+class Sampler(threading.Thread):
+    """
+    Samples a group of lines at a fixed rate until stop().
+
+    :param read: Function returning the group's levels as an int, bit i
+        being gpios[i].
+    :param rate: Samples per second.
+    :param on_edges: Called from the thread with (gpios, levels, times_ns)
+        arrays of the edges of every block.
+    """
+    def __init__(self, read, gpios, rate, on_edges, block_samples=BLOCK_SAMPLES):
+        super().__init__(daemon=True)
+        if not 0 < len(gpios) <= 64:
+            raise ValueError("Sampling takes 1 to 64 GPIOs.")
+        if not rate > 0:
+            raise ValueError("The sample rate must be positive.")
+        self.read = read
+        self.gpios = np.array(gpios, dtype=np.uint8)
+        self.period_ns = max(round(1e9 / rate), 1)
+        self.on_edges = on_edges
+        self.block_samples = block_samples
+        self.dtype = np.dtype(next(dtype for bits, dtype in WORD_DTYPES if len(gpios) <= bits))
+        self.mask = (1 << len(gpios)) - 1
+        self.previous = None  # Last sample of the last block
+        self.samples = 0
+        self.missed = 0
+        self.started_ns = None
+        self.last_ns = None  # Time of the last sample
+        self.error = None  # Exception that ended the sampling
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        read = self.read
+        clock = time.monotonic_ns
+        sleep = time.sleep
+        period = self.period_ns
+        block_samples = self.block_samples
+        words, stamps = [], []
+        add_word, add_stamp = words.append, stamps.append
+        deadline = self.started_ns = clock()
+        flush_at = deadline + FLUSH_INTERVAL_NS
+        missed = 0
+        try:
+            while True:
+                now = clock()
+                if now < deadline:
+                    if deadline - now > SPIN_NS:
+                        sleep((deadline - now - SPIN_NS) / 1e9)
+                    continue
+                if now - deadline >= period:
+                    late = (now - deadline) // period
+                    missed += late
+                    deadline += late * period
+                add_word(read())
+                add_stamp(now)
+                deadline += period
+                if now >= flush_at or len(words) >= block_samples:
+                    self.missed = missed
+                    self.flush(words, stamps)
+                    flush_at = now + FLUSH_INTERVAL_NS
+                    if self.stopped.is_set():
+                        break
+        except Exception as e:  # e.g. the lines were freed
+            self.error = e
+            self.missed = missed
+            if words:
+                self.flush(words, stamps)
+
+    def flush(self, words, stamps):
+        """
+        Pack the samples into a block, emptying the lists, and hand its
+        edges on.
+        """
+        offset = time.time_ns() - time.monotonic_ns()
+        block = np.array(words, dtype=self.dtype)
+        times = np.array(stamps, dtype=np.int64) + offset
+        self.samples += len(block)
+        self.last_ns = stamps[-1]
+        words.clear()
+        stamps.clear()
+        if self.previous is None:
+            # The first sample reports the level of every line
+            self.previous = ~block[0] & self.dtype.type(self.mask)
+        lines, levels, times = run_length_edges(block, times, self.previous)
+        self.previous = block[-1]
+        if len(lines):
+            self.on_edges(self.gpios[lines], levels, times)
+
+    def status(self):
+        """
+        Sampling status as a dict: gpios, rate (requested samples/s),
+        achieved_rate, samples taken, missed deadlines and error, the
+        exception that stopped the sampling or None.
+        """
+        elapsed = (self.last_ns - self.started_ns) if self.last_ns is not None else 0
+        return {
+            'gpios': self.gpios.tolist(),
+            'rate': 1e9 / self.period_ns,
+            'achieved_rate': (self.samples - 1) * 1e9 / elapsed if elapsed > 0 else 0.0,
+            'samples': self.samples,
+            'missed': self.missed,
+            'error': self.error,
+        }
@@ -0,0 +1,148 @@
+"""
+sigrok session files (.sr), as opened by PulseView.
+
+A session is a zip archive holding a "version" file, a "metadata" file
+naming the probes and the sample rate, and the logic samples in chunk
+files logic-1-1, logic-1-2, ...: one little-endian word per sample with
+bit i the level of the i-th probe.
+
+SigrokWriter turns batches of edges into samples with NumPy, repeating the
+pin levels after each edge up to the next one, and streams them into the
+archive in chunks, so a long capture never has to fit in memory. Edges
+closer than a sample period collapse into the last one.
+"""
+import zipfile
+
+import numpy as np
+
+CHUNK_SAMPLES = 1 << 22  # Samples per chunk file
+UNIT_DTYPES = [(8, np.uint8), (16, np.uint16), (32, np.uint32), (64, np.uint64)]
+
+
+def format_samplerate(samplerate):
+    for unit, scale in (('GHz', 10**9), ('MHz', 10**6), ('kHz', 10**3)):
+        if samplerate >= scale and samplerate % scale == 0:
+            return f"{samplerate // scale} {unit}"
+    return f"{samplerate} Hz"
+
+
+class SigrokWriter:
+    """
+    Streams edges to a sigrok session file.
+
+    :param pins: GPIO numbers to include as probes, at most 64; edges of
+        other pins are dropped.
+    :param start_ns: Wall-clock time of the first sample.
+    :param samplerate: Samples per second, an integer.
+    :param levels: {pin: level} known at start_ns, the others start low.
+    """
+    def __init__(self, path, pins, start_ns, samplerate=1_000_000, levels=None):
+        self.pins = sorted(pins)
+        if not 0 < len(self.pins) <= 64:
+            raise ValueError("A sigrok session holds 1 to 64 pins here.")
+        self.start_ns = start_ns
+        self.samplerate = int(samplerate)
+        self.unitsize, self.dtype = next((bits // 8, dtype) for bits, dtype in UNIT_DTYPES
+                                         if len(self.pins) <= bits)
+        self.bits = np.full(256, -1, dtype=np.int64)  # pin -> probe bit, -1 if not included
+        self.bits[self.pins] = np.arange(len(self.pins))
+        levels = levels or {}
+        self.word = sum(1 << bit for bit, pin in enumerate(self.pins) if levels.get(pin))
+        self.sample = 0  # Samples before this one are written
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)  # Samples repeat a lot, fast is enough
+        self.archive.writestr('version', '2')
+        self.chunks = 0
+        self.chunk = None
+        self.chunk_samples = 0
+
+    def write(self, timestamps, pins, levels):
+        """
+        Write edges given as arrays in time order. Edges before the last
+        written sample are moved to it.
+        """
+        bits = self.bits[pins]
+        included = bits >= 0
+        bits = bits[included]
+        levels = np.asarray(levels)[included].astype(np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)[included]
+        if not len(timestamps):
+            return
+        samples = ((timestamps - self.start_ns) * (self.samplerate / 1e9)).astype(np.int64)
+        samples = np.maximum(np.maximum.accumulate(samples), self.sample)
+        # Probe levels after every edge: the level of the last edge of each
+        # probe so far, or the level before the batch
+        positions = np.arange(len(bits))
+        words = np.zeros(len(bits), dtype=np.int64)
+        for bit in np.unique(bits).tolist():
+            latest = np.maximum.accumulate(np.where(bits == bit, positions, -1))
+            level = np.where(latest >= 0, levels[np.maximum(latest, 0)], self.word >> bit & 1)
+            words |= level << bit
+        others = self.word & ~int(np.bitwise_or.reduce(np.int64(1) << np.unique(bits)))
+        words |= others
+        # Each word lasts from its edge's sample to the next edge's
+        starts = np.concatenate([[self.sample], samples])
+        runs = np.diff(starts)
+        self.emit(np.concatenate([[self.word], words[:-1]]), runs)
+        self.word = int(words[-1])
+        self.sample = int(samples[-1])
+
+    def emit(self, words, runs):
+        """
+        Write runs[i] samples of words[i], in chunk files of CHUNK_SAMPLES.
+        """
+        keep = runs > 0
+        words, runs = words[keep].astype(self.dtype), runs[keep]
+        ends = np.cumsum(runs)
+        first = 0
+        done = 0  # Samples of words[first] already written
+        while first < len(words):
+            room = CHUNK_SAMPLES - self.chunk_samples
+            # Runs that fit completely, then part of the next one
+            last = int(np.searchsorted(ends, ends[first] - runs[first] + done + room, 'right'))
+            if last > first:
+                counts = runs[first:last].copy()
+                counts[0] -= done
+                self.write_samples(np.repeat(words[first:last], counts))
+                first, done = last, 0
+            else:
+                count = min(room, int(runs[first]) - done)
+                self.write_samples(np.full(count, words[first], dtype=self.dtype))
+                done += count
+                if done == runs[first]:
+                    first, done = first + 1, 0
+
+    def write_samples(self, samples):
+        if self.chunk is None:
+            self.chunks += 1
+            self.chunk = self.archive.open(f'logic-1-{self.chunks}', 'w')
+        self.chunk.write(samples.astype(f'<{samples.dtype.str[1:]}').tobytes())
+        self.chunk_samples += len(samples)
+        if self.chunk_samples >= CHUNK_SAMPLES:
+            self.chunk.close()
+            self.chunk = None
+            self.chunk_samples = 0
+
+    def close(self, end_ns=None):
+        """
+        :param end_ns: Wall-clock time the recording ended, the last levels
+            are repeated up to it.
+        """
+        end = self.sample + 1
+        if end_ns is not None:
+            end = max(end, int((end_ns - self.start_ns) * self.samplerate / 1e9))
+        self.emit(np.array([self.word]), np.array([end - self.sample]))
+        if self.chunk is not None:
+            self.chunk.close()
+        probes = '\n'.join(f'probe{i + 1}=GPIO{pin}' for i, pin in enumerate(self.pins))
+        self.archive.writestr('metadata', f"""[global]
+sigrok version=0.5.2
+
+[device 1]
+capturefile=logic-1
+total probes={len(self.pins)}
+samplerate={format_samplerate(self.samplerate)}
+total analog=0
+{probes}
+unitsize={self.unitsize}
+""")
+        self.archive.close()
@@ -0,0 +1,395 @@
+"""
+In-process stand-in for the lgpio module, used with GPIO(backend='sim').
+
+It implements the part of the lgpio API that pigpio_lgpio uses on a
+simulated chip whose lines keep their level in memory, so the logging
+and visualizer paths can be exercised and measured on any Linux host.
+
+inject() drives an input line with an edge train at a given rate and
+timing jitter. Edges are delivered from the train's own thread in batches
+of everything that fell due since its last wakeup: written to the
+notification pipe the line was claimed with, like lgpio does with kernel
+line events, or else passed to the callbacks. The tick of an edge is its
+nominal time in ns since the epoch.
+"""
+import os
+import random
+import select
+import struct
+import threading
+import time
+
+SET_ACTIVE_LOW = 4
+SET_OPEN_DRAIN = 8
+SET_OPEN_SOURCE = 16
+SET_PULL_UP = 32
+SET_PULL_DOWN = 64
+SET_PULL_NONE = 128
+
+RISING_EDGE = 1
+FALLING_EDGE = 2
+BOTH_EDGES = 3
+
+GROUP_ALL = 0xffffffffffffffff
+
+TX_PWM = 0
+TX_WAVE = 1
+TX_QUEUE_SIZE = 16  # Entries of a simulated wave queue
+
+TIMEOUT = 2
+
+# Like lgpio: LG_WD, else the working directory at import
+WORK_DIR = os.environ.get('LG_WD') or os.getcwd()
+
+NOTIFICATION = struct.Struct('<QBBBBI')  # tick, chip, gpio, level, flags, padding
+
+
+class error(Exception):
+    pass
+
+
+class SimChip:
+    def __init__(self, number):
+        self.number = number
+        self.levels = {}
+        self.modes = {}  # gpio -> 'in', 'alert' or 'out'
+        self.notify = {}  # alert gpio -> notification handle
+        self.groups = {}  # leader gpio -> list of gpios
+        self.callbacks = {}  # gpio -> list of _callback
+        self.debounce = {}
+        self.pwm = {}
+        self.wave_queues = {}  # group leader -> end times (ns) of the queued waves
+        self.lock = threading.Lock()
+
+    def claim(self, gpio, mode, level=0):
+        self.modes[gpio] = mode
+        self.levels.setdefault(gpio, level)
+        if mode == 'out':
+            self.levels[gpio] = level
+
+    def check(self, gpio, modes):
+        if self.modes.get(gpio) not in modes:
+            raise error('GPIO not allocated' if gpio not in self.modes else 'bad GPIO mode')
+
+    def set_levels(self, gpio, edges):
+        """
+        Apply a batch of (level, tick) changes to a line as the outside world
+        would and report them for an alert line.
+        """
+        if not edges:
+            return
+        self.levels[gpio] = edges[-1][0]
+        if self.modes.get(gpio) != 'alert':
+            return
+        handle = self.notify.get(gpio)
+        if handle is not None:
+            notifications[handle].send(b''.join([NOTIFICATION.pack(tick, self.number, gpio, level, 0, 0)
+                                                for level, tick in edges]))
+            return
+        with self.lock:
+            callbacks = list(self.callbacks.get(gpio, ()))
+        for level, tick in edges:
+            for cb in callbacks:
+                if cb.edge & (RISING_EDGE if level else FALLING_EDGE):
+                    cb.func(self.number, gpio, level, tick)
+
+
+class Notification:
+    """
+    Notification pipe, a FIFO named like lgpio's in the same directory.
+    Messages that do not fit are dropped and counted.
+    """
+    def __init__(self, handle):
+        self.path = os.path.join(WORK_DIR, f'.lgd-nfy{handle}')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.mkfifo(self.path)
+        # O_RDWR opens a FIFO without waiting for a reader
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        self.dropped = 0
+
+    def send(self, data):
+        # Writes up to PIPE_BUF bytes are all or nothing, so messages are
+        # never split, and a full pipe drops the rest like a full kernel
+        # event queue would
+        for offset in range(0, len(data), select.PIPE_BUF):
+            try:
+                os.write(self.fd, data[offset:offset + select.PIPE_BUF])
+            except BlockingIOError:
+                self.dropped += (len(data) - offset) // NOTIFICATION.size
+                return
+
+    def close(self):
+        os.close(self.fd)
+        os.unlink(self.path)
+
+
+chips = {}
+notifications = {}
+next_handle = 100  # Clear of the .lgd-nfy pipes lgpio itself opens on import
+
+
+def chip(handle):
+    try:
+        return chips[handle]
+    except KeyError:
+        raise error('unknown handle') from None
+
+
+def gpiochip_open(gpiochip):
+    global next_handle
+    handle = next_handle
+    next_handle += 1
+    chips[handle] = SimChip(gpiochip)
+    return handle
+
+
+def gpiochip_close(handle):
+    chips.pop(handle, None)
+    return 0
+
+
+def gpio_claim_input(handle, gpio, lFlags=0):
+    chip(handle).claim(gpio, 'in')
+    return 0
+
+
+def gpio_claim_alert(handle, gpio, eFlags, lFlags=0, notify_handle=None):
+    c = chip(handle)
+    c.claim(gpio, 'alert')
+    if notify_handle is None:
+        c.notify.pop(gpio, None)
+    else:
+        c.notify[gpio] = notify_handle
+    return 0
+
+
+def notify_open():
+    global next_handle
+    handle = next_handle
+    next_handle += 1
+    notifications[handle] = Notification(handle)
+    return handle
+
+
+def notify_close(handle):
+    notification = notifications.pop(handle, None)
+    if notification is None:
+        raise error('bad handle')
+    notification.close()
+    return 0
+
+
+def gpio_claim_output(handle, gpio, level=0, lFlags=0):
+    chip(handle).claim(gpio, 'out', level)
+    return 0
+
+
+def gpio_free(handle, gpio):
+    chip(handle).modes.pop(gpio, None)
+    return 0
+
+
+def gpio_set_debounce_micros(handle, gpio, debounce_micros):
+    chip(handle).debounce[gpio] = debounce_micros
+    return 0
+
+
+def gpio_read(handle, gpio):
+    c = chip(handle)
+    c.check(gpio, ('in', 'alert', 'out'))
+    return c.levels[gpio]
+
+
+def gpio_write(handle, gpio, level):
+    c = chip(handle)
+    c.check(gpio, ('out',))
+    c.levels[gpio] = 1 if level else 0
+    return 0
+
+
+def tx_pwm(handle, gpio, pwm_frequency, pwm_duty_cycle, pulse_offset=0, pulse_cycles=0):
+    c = chip(handle)
+    c.check(gpio, ('out',))
+    c.pwm[gpio] = (pwm_frequency, pwm_duty_cycle)
+    return 0
+
+
+def group_claim_input(handle, gpio, lFlags=0):
+    c = chip(handle)
+    for g in gpio:
+        c.claim(g, 'in')
+    c.groups[gpio[0]] = list(gpio)
+    return 0
+
+
+def group_claim_output(handle, gpio, levels=[0], lFlags=0):
+    c = chip(handle)
+    for i, g in enumerate(gpio):
+        c.claim(g, 'out', levels[i] if i < len(levels) else 0)
+    c.groups[gpio[0]] = list(gpio)
+    return 0
+
+
+def group_free(handle, gpio):
+    c = chip(handle)
+    for g in c.groups.pop(gpio, ()):
+        c.modes.pop(g, None)
+    return 0
+
+
+def group_read(handle, gpio):
+    """
+    [status, levels] like lgpio, bit i of levels being the i-th line.
+    """
+    c = chip(handle)
+    if gpio not in c.groups:
+        raise error('GPIO not allocated')
+    return [0, sum(c.levels[g] << i for i, g in enumerate(c.groups[gpio]))]
+
+
+def group_write(handle, gpio, group_bits, group_mask=GROUP_ALL):
+    c = chip(handle)
+    if gpio not in c.groups:
+        raise error('GPIO not allocated')
+    for i, g in enumerate(c.groups[gpio]):
+        if (group_mask >> i) & 1:
+            c.levels[g] = (group_bits >> i) & 1
+    return 0
+
+
+class pulse:
+    def __init__(self, group_bits, group_mask, pulse_delay):
+        self.group_bits = group_bits
+        self.group_mask = group_mask
+        self.pulse_delay = pulse_delay
+
+
+def wave_queue(c, gpio):
+    """
+    Queued wave end times of a group, without the waves already sent.
+    """
+    now = time.time_ns()
+    queue = [end for end in c.wave_queues.get(gpio, ()) if end > now]
+    c.wave_queues[gpio] = queue
+    return queue
+
+
+def tx_wave(handle, gpio, pulses):
+    """
+    Queue a wave on an output group or line. Its pulses are applied to the
+    levels at once, the queue only keeps track of the time it would take.
+    """
+    c = chip(handle)
+    lines = c.groups.get(gpio) or [gpio]
+    c.check(lines[0], ('out',))
+    queue = wave_queue(c, gpio)
+    if len(queue) >= TX_QUEUE_SIZE:
+        raise error('no room in queue')
+    for p in pulses:
+        for i, g in enumerate(lines):
+            if (p.group_mask >> i) & 1:
+                c.levels[g] = (p.group_bits >> i) & 1
+    start = queue[-1] if queue else time.time_ns()
+    queue.append(start + sum(p.pulse_delay for p in pulses) * 1000)
+    return TX_QUEUE_SIZE - len(queue)
+
+
+def tx_room(handle, gpio, kind):
+    return TX_QUEUE_SIZE - len(wave_queue(chip(handle), gpio)) if kind == TX_WAVE else TX_QUEUE_SIZE
+
+
+def tx_busy(handle, gpio, kind):
+    return int(bool(wave_queue(chip(handle), gpio))) if kind == TX_WAVE else int(gpio in chip(handle).pwm)
+
+
+class _callback:
+    """
+    Same interface as lgpio's callback objects.
+    """
+    def __init__(self, handle, gpio, edge=RISING_EDGE, func=None):
+        self.chip = chip(handle)
+        self.gpio = gpio
+        self.edge = edge
+        self.count = 0
+        self.func = func or self._tally
+        with self.chip.lock:
+            self.chip.callbacks.setdefault(gpio, []).append(self)
+
+    def cancel(self):
+        with self.chip.lock:
+            self.chip.callbacks[self.gpio].remove(self)
+
+    def _tally(self, chip, gpio, level, tick):
+        self.count += 1
+
+    def tally(self):
+        return self.count
+
+    def reset_tally(self):
+        self.count = 0
+
+
+def callback(handle, gpio, edge=RISING_EDGE, func=None):
+    return _callback(handle, gpio, edge, func)
+
+
+class EdgeTrain(threading.Thread):
+    """
+    Toggles a line rate times per second with Gaussian timing jitter until
+    count edges were sent, duration seconds passed or stop() is called.
+    """
+    def __init__(self, handle, gpio, rate, count=None, duration=None, jitter_ns=0, seed=None):
+        super().__init__(daemon=True)
+        self.chip = chip(handle)
+        self.gpio = gpio
+        self.interval_ns = 1e9 / rate
+        self.count = count
+        self.duration = duration
+        self.jitter_ns = jitter_ns
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.late_ns = 0  # Largest delay between an edge's time and its delivery
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def run(self):
+        start_ns = time.time_ns()
+        end_ns = start_ns + int(self.duration * 1e9) if self.duration is not None else None
+        level = self.chip.levels.get(self.gpio, 0)
+        last_tick = start_ns
+        while not self.stopped.is_set():
+            now = time.time_ns()
+            due = int((now - start_ns) / self.interval_ns) + 1
+            if self.count is not None:
+                due = min(due, self.count)
+            edges = []
+            while self.sent < due:
+                tick = start_ns + int(self.sent * self.interval_ns)
+                if self.jitter_ns:
+                    tick += int(self.random.gauss(0, self.jitter_ns))
+                # Jitter never reorders edges
+                tick = max(tick, last_tick + 1)
+                last_tick = tick
+                level ^= 1
+                edges.append((level, tick))
+                self.sent += 1
+            self.chip.set_levels(self.gpio, edges)
+            self.late_ns = max(self.late_ns, now - last_tick)
+            if self.count is not None and self.sent >= self.count or end_ns is not None and now >= end_ns:
+                break
+            next_ns = start_ns + self.sent * self.interval_ns
+            self.stopped.wait(max(next_ns - time.time_ns(), 0) / 1e9)
+
+
+def inject(handle, gpio, rate, count=None, duration=None, jitter_ns=0, seed=None):
+    """
+    Start an EdgeTrain on an input line and return it; join() it to wait
+    for the train to finish.
+    """
+    train = EdgeTrain(handle, gpio, rate, count, duration, jitter_ns, seed)
+    train.start()
+    return train
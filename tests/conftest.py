@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pigpio_lgpio
+
+
+@pytest.fixture
+def gpio(tmp_path):
+    """
+    A GPIO instance on the simulated backend serving its events in tmp_path.
+    """
+    gpio = pigpio_lgpio.GPIO(backend='sim', socket_path=str(tmp_path / 'events'),
+                             pwm_sysfs_root=str(tmp_path / 'pwm'))
+    yield gpio
+    gpio.stop()
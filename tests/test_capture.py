@@ -0,0 +1,62 @@
+import pytest
+
+from capture import CaptureReader, CaptureWriter
+from event_format import FLAG_GROUP, FLAG_PAYLOAD, RECORD, WIRE_VERSION, encode_events
+
+
+def write_capture(directory, count, close=True):
+    """
+    A capture of count edges toggling GPIO17, one every 1000 ns from 1000,
+    in small blocks and segments so lookups cross both.
+    """
+    writer = CaptureWriter(str(directory), block_records=16, segment_records=64)
+    events = [(17, i & 1, 1000 * (i + 1)) for i in range(count)]
+    for i in range(0, count, 10):
+        writer.write([encode_events(events[i:i + 10])])
+    if close:
+        writer.close()
+    return writer
+
+
+@pytest.mark.parametrize('time_ns, record', [
+    (0, 0),
+    (1000, 0),
+    (1001, 1),
+    (16000, 15),
+    (16500, 16),
+    (64000, 63),
+    (64001, 64),
+    (200000, 199),
+    (200001, 200),
+])
+def test_find(tmp_path, time_ns, record):
+    write_capture(tmp_path / 'capture', 200)
+    assert CaptureReader(str(tmp_path / 'capture')).find(time_ns) == record
+
+
+def test_find_in_unindexed_tail(tmp_path):
+    writer = write_capture(tmp_path / 'capture', 200, close=False)
+    reader = CaptureReader(str(tmp_path / 'capture'))
+    # The last 8 records are in a block that is not in the index yet
+    assert len(reader.index) == 12
+    assert reader.find(195000) == 194
+    writer.close()
+
+
+def test_find_skips_payload_records(tmp_path):
+    writer = CaptureWriter(str(tmp_path / 'capture'), block_records=16, segment_records=64)
+    # A group write pair: the payload's timestamp field is a mask, not a time
+    writer.write([RECORD.pack(WIRE_VERSION, FLAG_GROUP, 5, 0, 0b100000, 1000) +
+                  RECORD.pack(WIRE_VERSION, FLAG_GROUP | FLAG_PAYLOAD, 5, 0, 0, 1 << 40) +
+                  encode_events([(17, 1, 2000)])])
+    writer.close()
+    assert CaptureReader(str(tmp_path / 'capture')).find(1500) == 2
+
+
+def test_read_levels_before(tmp_path):
+    write_capture(tmp_path / 'capture', 200)
+    records, known, levels = CaptureReader(str(tmp_path / 'capture')).read(40500, 50000)
+    # From the start of the block holding 40500 (records 32 to 47) to 50000
+    assert records['timestamp'].tolist() == [1000 * (i + 1) for i in range(32, 50)]
+    assert known == 1 << 17
+    assert levels == 1 << 17  # Record 31 set GPIO17 high
@@ -0,0 +1,90 @@
+import struct
+import threading
+
+import pytest
+
+import pigpio_lgpio
+from capture_worker import COMMITTED, MESSAGE_SIZE, WRITE_INDEX, SharedRing, commit_word
+
+NOTIFICATION = struct.Struct('<QBBBBI')
+
+
+def messages(first, count):
+    """
+    Notification messages of GPIO4 with ticks first to first + count - 1.
+    """
+    return b''.join([NOTIFICATION.pack(tick, 0, 4, tick & 1, 0, 0) for tick in range(first, first + count)])
+
+
+def ticks(data):
+    return [message[0] for message in NOTIFICATION.iter_unpack(data)]
+
+
+@pytest.fixture
+def ring():
+    consumer = SharedRing(capacity=8)
+    producer = SharedRing(capacity=8, name=consumer.name)
+    yield consumer, producer
+    producer.close()
+    consumer.close(unlink=True)
+
+
+def test_messages_carry_commit_words(ring):
+    consumer, producer = ring
+    assert producer.put(messages(0, 3)) == 3
+    data = consumer.take()
+    for index, (message, commit) in enumerate(COMMITTED.iter_unpack(data)):
+        assert commit == commit_word(message, index)
+    assert ticks(data) == [0, 1, 2]
+    assert consumer.take() == b''
+
+
+def test_wraps_around_and_drops_when_full(ring):
+    consumer, producer = ring
+    taken = []
+    for first in range(0, 40, 5):
+        assert producer.put(messages(first, 5)) == 5
+        taken += ticks(consumer.take())
+    assert taken == list(range(40))
+    assert producer.put(messages(40, 10)) == 8
+    assert producer.dropped == 2
+    assert len(consumer) == 8
+    assert ticks(consumer.take()) == list(range(40, 48))
+
+
+def test_take_stops_at_uncommitted_message(ring):
+    consumer, producer = ring
+    producer.put(messages(0, 8))
+    consumer.take()
+    # The write index of three more messages is seen before the last one
+    # landed: its slot still holds the message of index 2, one lap earlier
+    producer.put(messages(8, 2))
+    producer.counters[WRITE_INDEX] += 1
+    assert ticks(consumer.take()) == [8, 9]
+    assert len(consumer) == 1
+    # Once the message is written its commit word matches
+    message = messages(10, 1)
+    COMMITTED.pack_into(producer.slots, 2 * MESSAGE_SIZE, message[:12], commit_word(message[:12], 10))
+    assert ticks(consumer.take()) == [10]
+
+
+def test_capture_worker_delivers_edges(tmp_path, monkeypatch):
+    # The worker opens its notification pipe in its working directory
+    monkeypatch.chdir(tmp_path)
+    gpio = pigpio_lgpio.GPIO(backend='sim', socket_path=str(tmp_path / 'events'), capture_process=True)
+    try:
+        gpio.set_mode(4, gpio.INPUT)
+        received = []
+        done = threading.Event()
+
+        def edge(chip, pin, level, tick):
+            received.append(level)
+            if len(received) == 100:
+                done.set()
+        gpio.callback(4, gpio.EITHER_EDGE, edge)
+        gpio.capture_worker.call('inject', 4, 10000, count=100)
+        assert done.wait(5)
+        assert received == [1, 0] * 50
+        assert gpio.metrics()['worker_dropped'] == 0
+    finally:
+        gpio.stop()
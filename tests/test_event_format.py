@@ -0,0 +1,53 @@
+from event_format import (DUTY_SCALE, FLAG_PAYLOAD, FLAG_PWM, RECORD, RECORD_SIZE, WIRE_VERSION, EventDecoder,
+                          split_pwm)
+
+
+def pwm_pair(pin, running, start_ns, duty_ppb, period_ns):
+    return (RECORD.pack(WIRE_VERSION, FLAG_PWM, pin, running, duty_ppb, start_ns) +
+            RECORD.pack(WIRE_VERSION, FLAG_PWM | FLAG_PAYLOAD, pin, 0, 0, period_ns))
+
+
+def edge(pin, level, time_ns):
+    return RECORD.pack(WIRE_VERSION, 0, pin, level, 0, time_ns)
+
+
+def test_decoder_keeps_partial_records():
+    decoder = EventDecoder()
+    data = edge(17, 1, 1000) + edge(17, 0, 2000)
+    assert len(decoder.feed(data[:RECORD_SIZE + 5])) == 1
+    records = decoder.feed(data[RECORD_SIZE + 5:])
+    assert records['timestamp'].tolist() == [2000]
+
+
+def test_decoder_holds_pair_head_until_payload():
+    decoder = EventDecoder()
+    pair = pwm_pair(18, 1, 5000, DUTY_SCALE // 4, 1000000)
+    records = decoder.feed(edge(17, 1, 1000) + pair[:RECORD_SIZE])
+    assert records['pin'].tolist() == [17]
+    records = decoder.feed(pair[RECORD_SIZE:])
+    assert records['flags'].tolist() == [FLAG_PWM, FLAG_PWM | FLAG_PAYLOAD]
+
+
+def test_decoder_counts_unknown_versions():
+    decoder = EventDecoder()
+    records = decoder.feed(RECORD.pack(WIRE_VERSION + 1, 0, 17, 1, 0, 1000) + edge(17, 0, 2000))
+    assert records['timestamp'].tolist() == [2000]
+    assert decoder.errors == 1
+
+
+def test_split_pwm():
+    records = EventDecoder().feed(edge(17, 1, 1000) + pwm_pair(18, 1, 5000, DUTY_SCALE // 4, 1000000) +
+                                  edge(17, 0, 6000))
+    edges, segments = split_pwm(records)
+    assert edges['timestamp'].tolist() == [1000, 6000]
+    assert len(segments) == 1
+    segment = segments[0]
+    assert (segment['pin'], segment['level'], segment['timestamp']) == (18, 1, 5000)
+    assert (segment['period_ns'], segment['high_ns']) == (1000000, 250000)
+
+
+def test_split_pwm_drops_segment_without_payload():
+    data = pwm_pair(18, 1, 5000, DUTY_SCALE // 2, 1000000)[:RECORD_SIZE] + edge(17, 1, 6000)
+    edges, segments = split_pwm(EventDecoder().decode(data))
+    assert edges['timestamp'].tolist() == [6000]
+    assert len(segments) == 0
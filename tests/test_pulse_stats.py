@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from event_format import FLAG_GROUP, FLAG_PAYLOAD, EventRing
+from pigpio_lgpio import GPIO
+from pulse_stats import HISTOGRAM_BINS, PulseStats, WidthHistogram, bin_range, width_bin
+
+
+def test_width_bin_round_trip():
+    for index in range(HISTOGRAM_BINS - 8):
+        low, high = bin_range(index)
+        assert width_bin(low) == index
+        assert width_bin(high - 1) == index
+        assert width_bin(high) == index + 1
+
+
+@pytest.mark.parametrize('width_ns', [0, 1, 7, 8, 9, 15, 16, 1000, 999999, 10**9, 3600 * 10**9])
+def test_width_bin_contains_width(width_ns):
+    low, high = bin_range(width_bin(width_ns))
+    assert low <= width_ns < high
+    # 8 bins per octave
+    assert high - low <= max(low // 8, 1)
+
+
+def test_add_many_matches_add():
+    widths = np.random.default_rng(1).integers(0, 10**10, 10000)
+    one, many = WidthHistogram(), WidthHistogram()
+    for width in widths.tolist():
+        one.add(width)
+    many.add_many(widths)
+    assert many.counts == one.counts
+    assert many.summary() == one.summary()
+
+
+def test_add_edges_matches_add():
+    timestamps = np.cumsum(np.random.default_rng(2).integers(1, 10**6, 1000))
+    levels = np.arange(1000) % 2
+    levels[500] = levels[499]  # Written again, not an edge
+    one, many = PulseStats(), PulseStats()
+    for level, time_ns in zip(levels.tolist(), timestamps.tolist()):
+        one.add(17, level, time_ns)
+    many.add_edges(17, timestamps[:300], levels[:300])
+    many.add_edges(17, timestamps[300:], levels[300:])
+    now_ns = int(timestamps[-1])
+    assert many.summary(17, now_ns) == one.summary(17, now_ns)
+
+
+def test_square_wave_summary():
+    stats = PulseStats(window_s=0.01)
+    # 1 kHz at 25%: 250 us high, 750 us low
+    timestamps = np.cumsum(np.tile([250000, 750000], 50))
+    stats.add_edges(2, timestamps, np.tile([0, 1], 50))
+    summary = stats.summary(2, int(timestamps[-1]))
+    assert summary['frequency_hz'] == pytest.approx(1000)
+    assert summary['duty_cycle_percentage'] == pytest.approx(25)
+    assert summary['high']['p50_ns'] == 250000
+
+
+def test_drained_batch_statistics_without_numpy_agree():
+    rng = np.random.default_rng(3)
+    events = []
+    time_ns = 10**15
+    for i in range(400):
+        time_ns += int(rng.integers(1000, 50000))
+        if i % 7 == 0:
+            # A group write of GPIO6 to 8
+            events.append((6, 0, time_ns, FLAG_GROUP, int(rng.integers(0, 8)) << 6))
+            events.append((6, 0, 0b111 << 6, FLAG_GROUP | FLAG_PAYLOAD, 0))
+        else:
+            events.append((int(rng.integers(4, 6)), i & 1, time_ns, 0, 0))
+    # Leave 137 free records at the end of the ring, so the events wrap
+    # around between the records of the group pair at 136, overwriting the
+    # oldest filler records on GPIO20
+    ring = EventRing(500)
+    for _ in range(ring.capacity - 137):
+        ring.append(20, 0, 0)
+    for event in events:
+        ring.append(*event)
+    chunks = [bytes(chunk) for chunk in ring.drain()]
+    assert len(chunks) == 2 and events[136][3] == FLAG_GROUP
+    arrays, records = GPIO(backend='sim'), GPIO(backend='sim')
+    arrays.count_batch(chunks)
+    records.count_records(chunks)
+    assert arrays.produced == records.produced
+    assert sum(arrays.produced[4:9]) == 400
+    for pin in range(4, 9):
+        assert arrays.pulse_stats.summary(pin, time_ns) == records.pulse_stats.summary(pin, time_ns)
+    assert arrays.pulse_stats.summary(7, time_ns)['edges'] > 0
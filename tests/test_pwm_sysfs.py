@@ -0,0 +1,25 @@
+def make_pwm_sysfs(root, values):
+    """
+    Lay out pwmchip2/pwm2 like sysfs with plain files holding values.
+    """
+    channel = root / 'pwmchip2' / 'pwm2'
+    channel.mkdir(parents=True)
+    for name, value in values.items():
+        (channel / name).write_text(str(value))
+    return channel
+
+
+def test_hardware_pwm_writes_attributes(gpio, tmp_path):
+    channel = make_pwm_sysfs(tmp_path / 'pwm', {'period': 10000000, 'duty_cycle': 5000000, 'enable': 0})
+    gpio.hardware_PWM(18, 1000, 25)
+    assert (channel / 'period').read_text() == '1000000'
+    assert (channel / 'duty_cycle').read_text() == '250000'
+    assert (channel / 'enable').read_text() == '1'
+
+
+def test_hardware_pwm_stop_disables_channel(gpio, tmp_path):
+    channel = make_pwm_sysfs(tmp_path / 'pwm', {'period': 0, 'duty_cycle': 0, 'enable': 0})
+    gpio.hardware_PWM(18, 2000, 50)
+    gpio.hardware_PWM(18, 0)
+    assert (channel / 'enable').read_text() == '0'
+    assert (channel / 'period').read_text() == '500000'
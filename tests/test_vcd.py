@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from capture import CaptureReader, CaptureWriter
+from convert import export_capture
+from event_format import RECORD_DTYPE, WIRE_VERSION
+from vcd import VCDReader, VCDWriter, import_vcd, wire_pins
+
+START_NS = 1_700_000_000_000_000_000
+
+
+def random_edges(count, pins, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = START_NS + np.cumsum(rng.integers(0, 10**7, count))
+    return timestamps, rng.choice(pins, count).astype(np.uint8), rng.integers(0, 2, count).astype(np.uint8)
+
+
+def read_all(reader):
+    batches = list(reader.batches())
+    return tuple(np.concatenate([batch[i] for batch in batches]) for i in range(3))
+
+
+@pytest.mark.parametrize('chunk_bytes', [7, 1000, 1 << 24])
+def test_writer_reader_round_trip(tmp_path, chunk_bytes):
+    pins = [2, 17, 27]
+    timestamps, edge_pins, levels = random_edges(5000, pins)
+    path = str(tmp_path / 'edges.vcd')
+    writer = VCDWriter(path, pins, START_NS)
+    for start in range(0, 5000, 1234):
+        writer.write(timestamps[start:start + 1234], edge_pins[start:start + 1234], levels[start:start + 1234])
+    writer.close()
+    reader = VCDReader(path, chunk_bytes=chunk_bytes)
+    assert reader.start_ns == START_NS
+    assert wire_pins(reader.wires) == pins
+    read_timestamps, wires, read_levels = read_all(reader)
+    assert read_timestamps.tolist() == timestamps.tolist()
+    assert np.array(pins)[wires].tolist() == edge_pins.tolist()
+    assert read_levels.tolist() == levels.tolist()
+
+
+def test_reader_skips_vectors_comments_and_unknown_values(tmp_path):
+    path = tmp_path / 'other.vcd'
+    path.write_text('$timescale 10 us $end\n'
+                    '$scope module top $end\n'
+                    '$var wire 1 ! clk $end\n'
+                    '$var wire 8 " data $end\n'
+                    '$var wire 1 # GPIO9 $end\n'
+                    '$upscope $end\n'
+                    '$enddefinitions $end\n'
+                    '#0\n$dumpvars\nx!\nb0 "\n0# $end\n'
+                    '#5\n1! $comment 1# $end b101 "\n'
+                    '#7\n0!\n1#\n')
+    reader = VCDReader(str(path))
+    assert wire_pins(reader.wires) == [2, 9]
+    timestamps, wires, levels = read_all(reader)
+    assert timestamps.tolist() == [0, 50000, 70000, 70000]
+    assert wires.tolist() == [1, 0, 0, 1]
+    assert levels.tolist() == [0, 1, 0, 1]
+
+
+def test_capture_export_import_round_trip(tmp_path):
+    timestamps, pins, levels = random_edges(3000, [4, 5, 6], seed=1)
+    records = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+    records['version'] = WIRE_VERSION
+    records['pin'] = pins
+    records['level'] = levels
+    records['timestamp'] = timestamps
+    writer = CaptureWriter(str(tmp_path / 'capture'), block_records=256, segment_records=1024)
+    writer.write([records.tobytes()])
+    writer.close()
+    export_capture(str(tmp_path / 'capture'), str(tmp_path / 'capture.vcd'))
+    imported = CaptureReader(import_vcd(str(tmp_path / 'capture.vcd'), str(tmp_path / 'imported')))
+    read = imported.records(0, len(imported))
+    assert read['timestamp'].tolist() == timestamps.tolist()
+    assert read['pin'].tolist() == pins.tolist()
+    assert read['level'].tolist() == levels.tolist()
@@ -0,0 +1,65 @@
+import pytest
+
+from pigpio_lgpio import MAX_CHAIN_PULSES, pulse
+
+
+@pytest.fixture
+def waves(gpio):
+    """
+    Ids of two waves on GPIO5, of 2 and 4 pulses.
+    """
+    gpio.set_mode(5, gpio.OUTPUT)
+    gpio.wave_add_generic([pulse(1 << 5, 0, 10), pulse(0, 1 << 5, 10)])
+    a = gpio.wave_create()
+    gpio.wave_add_generic([pulse(1 << 5, 0, 5), pulse(0, 1 << 5, 5)] * 2)
+    b = gpio.wave_create()
+    return a, b
+
+
+def test_parse_chain_plain(gpio, waves):
+    a, b = waves
+    assert gpio.parse_chain([a, a, b, a]) == [(a, 2), (b, 1), (a, 1)]
+
+
+def test_parse_chain_single_wave_loop_is_one_run(gpio, waves):
+    a, b = waves
+    # 255 1 x y repeats the loop x + 256 * y times
+    assert gpio.parse_chain([b, 255, 0, a, 255, 1, 0, 1]) == [(b, 1), (a, 256)]
+
+
+def test_parse_chain_writes_out_other_loops(gpio, waves):
+    a, b = waves
+    chain = [255, 0, a, 255, 2, 100, 0, b, 255, 1, 2, 0]
+    assert gpio.parse_chain(chain) == [(a, 1), (None, 100), (b, 1), (a, 1), (None, 100), (b, 1)]
+
+
+def test_parse_chain_nested_loops(gpio, waves):
+    a, b = waves
+    chain = [255, 0, b, 255, 0, a, 255, 1, 3, 0, 255, 1, 2, 0]
+    assert gpio.parse_chain(chain) == [(b, 1), (a, 3), (b, 1), (a, 3)]
+
+
+@pytest.mark.parametrize('chain, message', [
+    ([255, 0, 0], 'without a loop end'),
+    ([0, 255, 1, 2, 0], 'without a loop start'),
+    ([0, 255, 3, 0, 0], 'Unsupported'),
+    ([255, 2, 10, 0], 'no waves'),
+])
+def test_parse_chain_errors(gpio, waves, chain, message):
+    with pytest.raises(ValueError, match=message):
+        gpio.parse_chain(chain)
+
+
+def test_parse_chain_rejects_huge_chains(gpio, waves):
+    a, b = waves
+    # Nested loops of two waves, 65535 * 65535 * 6 pulses, rejected before
+    # they are written out
+    chain = [255, 0, 255, 0, a, b, 255, 1, 255, 255, 255, 1, 255, 255]
+    with pytest.raises(ValueError, match=str(MAX_CHAIN_PULSES)):
+        gpio.parse_chain(chain)
+
+
+def test_wave_chain_is_sent(gpio, waves):
+    a, b = waves
+    gpio.wave_chain([a, 255, 0, b, 255, 1, 3, 0])
+    assert gpio.wave_tx_busy() == 1
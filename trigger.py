@@ -0,0 +1,166 @@
+"""
+Scope-style triggers on the edges of the event stream.
+
+A trigger is fed every batch of plain edge records (flags 0, sorted by
+timestamp) with find(), which returns the timestamps at which it fired in
+that batch. The levels and edge times it needs are carried over from one
+batch to the next, so a condition spanning two batches is still found.
+Everything is evaluated with NumPy on whole batches, per pin involved.
+
+Triggers are written as short specs, see parse_trigger():
+
+    rising:17 falling:17 edge:17   an edge on GPIO17
+    pattern:5=1,6=0                GPIO5 high and GPIO6 low, fires when the
+                                   pins start matching
+    high:17>50us low:17<2ms        a high (low) pulse on GPIO17 longer
+                                   (shorter) than the width, fires at the
+                                   end of the pulse
+"""
+import abc
+import re
+
+import numpy as np
+
+UNITS_NS = {'ns': 1, 'us': 10**3, 'ms': 10**6, 's': 10**9}
+
+
+def parse_duration(text):
+    """
+    Nanoseconds in a duration like '50us', '1.5ms' or '200' (ns).
+    """
+    match = re.fullmatch(r'\s*([0-9.]+)\s*(ns|us|ms|s)?\s*', text)
+    if match is None:
+        raise ValueError(f"Bad duration: {text}")
+    return int(float(match.group(1)) * UNITS_NS[match.group(2) or 'ns'])
+
+
+def parse_trigger(spec):
+    """
+    The Trigger described by a spec string, see the module docstring.
+    """
+    kind, _, arguments = spec.strip().partition(':')
+    try:
+        if kind in ('rising', 'falling', 'edge'):
+            return EdgeTrigger(int(arguments), kind)
+        if kind == 'pattern':
+            levels = {}
+            for term in arguments.split(','):
+                pin, level = term.split('=')
+                if level.strip() not in ('0', '1'):
+                    raise ValueError
+                levels[int(pin)] = int(level)
+            return PatternTrigger(levels)
+        if kind in ('high', 'low'):
+            pin, operator, width = re.fullmatch(r'(\d+)\s*([<>])(.+)', arguments.strip()).groups()
+            return PulseTrigger(int(pin), 1 if kind == 'high' else 0, parse_duration(width), operator == '>')
+    except (ValueError, AttributeError):
+        pass
+    raise ValueError(f"Bad trigger: {spec}")
+
+
+class Trigger(abc.ABC):
+    """
+    Base class keeping the last known level of the pins it watches.
+    """
+    def __init__(self, pins):
+        self.pins = list(pins)
+        self.last = {}  # pin -> (level, timestamp) of its last level change
+
+    def reset(self):
+        self.last = {}
+
+    def transitions(self, records, pin):
+        """
+        (timestamps, levels, previous levels, previous timestamps) of the
+        level changes of pin in the records. The first edge of a pin counts
+        as a change from level -1, unknown.
+        """
+        mine = records['pin'] == pin
+        timestamps = records['timestamp'][mine]
+        levels = records['level'][mine].astype(np.int8)
+        if not len(timestamps):
+            return timestamps, levels, levels, timestamps
+        last_level, last_ns = self.last.get(pin, (-1, int(timestamps[0])))
+        previous = np.concatenate([[last_level], levels[:-1]]).astype(np.int8)
+        changed = levels != previous
+        timestamps, levels, previous = timestamps[changed], levels[changed], previous[changed]
+        if len(timestamps):
+            self.last[pin] = (int(levels[-1]), int(timestamps[-1]))
+        previous_ns = np.concatenate([[last_ns], timestamps[:-1]]).astype(np.int64)
+        return timestamps, levels, previous, previous_ns
+
+    @abc.abstractmethod
+    def find(self, records):
+        """
+        Timestamps at which the trigger fired in a batch of edge records.
+        """
+
+
+class EdgeTrigger(Trigger):
+    """
+    Fires on a rising, falling or any edge of one pin.
+    """
+    def __init__(self, pin, edge='rising'):
+        if edge not in ('rising', 'falling', 'edge'):
+            raise ValueError(f"Unknown edge: {edge}")
+        super().__init__([pin])
+        self.edge = edge
+
+    def find(self, records):
+        timestamps, levels, _, _ = self.transitions(records, self.pins[0])
+        if self.edge == 'edge':
+            return timestamps
+        return timestamps[levels == (1 if self.edge == 'rising' else 0)]
+
+
+class PatternTrigger(Trigger):
+    """
+    Fires when the levels of several pins start to match a pattern.
+
+    :param levels: {pin: level} the pins must have at the same time.
+    """
+    def __init__(self, levels):
+        super().__init__(sorted(levels))
+        self.levels = dict(levels)
+        self.matched = False
+
+    def reset(self):
+        super().reset()
+        self.matched = False
+
+    def find(self, records):
+        records = records[np.isin(records['pin'], self.pins)]
+        if not len(records):
+            return records['timestamp']
+        positions = np.arange(len(records))
+        match = np.ones(len(records), dtype=bool)
+        for pin, wanted in self.levels.items():
+            mine = records['pin'] == pin
+            # Level of the pin after every record: its own last edge so far
+            latest = np.maximum.accumulate(np.where(mine, positions, -1))
+            last_level = self.last.get(pin, (-1, 0))[0]
+            levels = np.where(latest >= 0, records['level'][np.maximum(latest, 0)], last_level)
+            match &= levels == wanted
+            if mine.any():
+                self.last[pin] = (int(records['level'][mine][-1]), int(records['timestamp'][mine][-1]))
+        previous = np.concatenate([[self.matched], match[:-1]])
+        self.matched = bool(match[-1])
+        return records['timestamp'][match & ~previous]
+
+
+class PulseTrigger(Trigger):
+    """
+    Fires at the end of a pulse of the given level on one pin that is
+    longer (or shorter) than width_ns.
+    """
+    def __init__(self, pin, level, width_ns, longer=True):
+        super().__init__([pin])
+        self.level = level
+        self.width_ns = width_ns
+        self.longer = longer
+
+    def find(self, records):
+        timestamps, _, previous, previous_ns = self.transitions(records, self.pins[0])
+        widths = timestamps - previous_ns
+        qualifies = widths > self.width_ns if self.longer else widths < self.width_ns
+        return timestamps[(previous == self.level) & qualifies]
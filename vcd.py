@@ -0,0 +1,268 @@
+"""
+Value Change Dump files, as read by GTKWave and PulseView.
+
+VCDWriter turns batches of edges into VCD text without a Python loop per
+edge: every edge becomes a fixed-width row of bytes (an optional #time
+line and the value change line) in a NumPy array, and the unused bytes are
+masked out in one go. VCDReader does the opposite on chunks of the file,
+splitting the tokens in C and classifying them with NumPy, so both run in
+constant memory at roughly the speed of the disk.
+
+Every pin is a 1 bit wire named GPIO<n>. Times are written in ns from the
+start of the file; the wall-clock time of that start is kept in a
+"start_ns" comment, so a file written here is read back at its original
+times.
+"""
+import re
+import time
+
+import numpy as np
+
+from capture import CaptureWriter
+from event_format import RECORD_DTYPE, WIRE_VERSION
+
+TIMESCALES_NS = {'s': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1, 'ps': 1e-3, 'fs': 1e-6}
+POWERS_OF_TEN = 10 ** np.arange(1, 19, dtype=np.int64)
+FIRST_PIN = 2  # Pins given to wires that are not named GPIO<n>
+# Keywords whose content up to $end is not value changes
+BLOCK_KEYWORDS = (b'$comment', b'$date', b'$version', b'$timescale', b'$scope', b'$upscope', b'$var')
+
+
+def identifier(index):
+    """
+    VCD identifier code of the index-th wire: printable characters from '!'.
+    """
+    if not 0 <= index < 94:
+        raise ValueError("A VCD file holds at most 94 pins here.")
+    return chr(33 + index).encode()
+
+
+class VCDWriter:
+    """
+    Streams edges to a VCD file.
+
+    :param pins: GPIO numbers to declare, edges of other pins are dropped.
+    :param start_ns: Wall-clock time of VCD time 0.
+    :param levels: {pin: level} known at start_ns, the others start as x.
+    """
+    def __init__(self, path, pins, start_ns, levels=None):
+        self.pins = sorted(pins)
+        self.start_ns = start_ns
+        self.codes = np.zeros(256, dtype=np.uint8)  # pin -> identifier byte, 0 if not declared
+        for index, pin in enumerate(self.pins):
+            self.codes[pin] = identifier(index)[0]
+        self.file = open(path, 'wb')
+        levels = levels or {}
+        lines = [f"$date {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_ns / 1e9))} $end",
+                 "$version pigpio_lgpio $end",
+                 f"$comment start_ns {start_ns} $end",
+                 "$timescale 1 ns $end",
+                 "$scope module gpio $end"]
+        lines += [f"$var wire 1 {chr(self.codes[pin])} GPIO{pin} $end" for pin in self.pins]
+        lines += ["$upscope $end", "$enddefinitions $end", "#0", "$dumpvars"]
+        lines += [f"{levels.get(pin, 'x')}{chr(self.codes[pin])}" for pin in self.pins]
+        lines += ["$end", ""]
+        self.file.write('\n'.join(lines).encode())
+        self.last_ns = 0  # VCD time of the last #time line
+
+    def write(self, timestamps, pins, levels):
+        """
+        Write edges given as arrays in time order. Edges before the last
+        written time are moved to it, VCD times cannot go back.
+        """
+        codes = self.codes[pins]
+        declared = codes != 0
+        times = np.maximum(np.asarray(timestamps, dtype=np.int64)[declared] - self.start_ns, self.last_ns)
+        codes = codes[declared]
+        levels = np.asarray(levels)[declared]
+        n = len(times)
+        if not n:
+            return
+        # Rows as wide as the longest time in the batch
+        width = int(1 + np.searchsorted(POWERS_OF_TEN, times[-1], 'right'))
+        rows = np.empty((n, width + 5), dtype=np.uint8)
+        shown = np.zeros(rows.shape, dtype=bool)
+        # '#' digits '\n', only where the time changes
+        new_time = np.empty(n, dtype=bool)
+        new_time[0] = times[0] != self.last_ns
+        new_time[1:] = times[1:] != times[:-1]
+        digits = 1 + np.searchsorted(POWERS_OF_TEN, times, 'right')
+        rows[:, 0] = ord('#')
+        # Digits are computed a whole column at a time, right to left
+        columns = np.empty((width, n), dtype=np.uint8)
+        rest = times.copy()
+        for column in range(width - 1, -1, -1):
+            columns[column] = rest % 10
+            rest //= 10
+        rows[:, 1:width + 1] = columns.T
+        rows[:, 1:width + 1] += ord('0')
+        rows[:, width + 1] = ord('\n')
+        shown[:, 1:width + 1] = np.arange(width - 1, -1, -1) < digits[:, None]
+        shown[:, :width + 2] &= new_time[:, None]
+        shown[:, 0] = shown[:, width + 1] = new_time
+        # Value change: level, identifier, '\n'
+        rows[:, width + 2] = levels + ord('0')
+        rows[:, width + 3] = codes
+        rows[:, width + 4] = ord('\n')
+        shown[:, width + 2:] = True
+        self.file.write(rows[shown].tobytes())
+        self.last_ns = int(times[-1])
+
+    def close(self, end_ns=None):
+        """
+        :param end_ns: Wall-clock time the recording ended, written as a
+            last time so viewers show the final levels up to it.
+        """
+        if end_ns is not None and end_ns - self.start_ns > self.last_ns:
+            self.file.write(f"#{end_ns - self.start_ns}\n".encode())
+        self.file.close()
+
+
+class VCDReader:
+    """
+    Reads the 1 bit wires of a VCD file in chunks.
+
+    After construction self.wires lists (code, name) of the 1 bit wires,
+    self.scale_ns the length of a VCD time unit and self.start_ns the
+    wall-clock time of time 0 if the file has one, else 0.
+    """
+    def __init__(self, path, chunk_bytes=1 << 24):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.wires = []
+        self.scale_ns = 1
+        self.start_ns = 0
+        with open(path, 'rb') as f:
+            header = b''
+            while b'$enddefinitions' not in header:
+                data = f.read(1 << 16)
+                if not data:
+                    raise ValueError(f"{path} is not a VCD file.")
+                header += data
+        end = header.index(b'$enddefinitions')
+        self.body_offset = header.index(b'$end', end + len(b'$enddefinitions')) + len(b'$end')
+        self.parse_header(header[:end].decode(errors='replace'))
+
+    def parse_header(self, text):
+        for keyword, content in re.findall(r'\$(\w+)\s(.*?)\$end', text, re.S):
+            fields = content.split()
+            if keyword == 'timescale':
+                match = re.fullmatch(r'(\d+)\s*(s|ms|us|ns|ps|fs)', ''.join(fields))
+                if match is None:
+                    raise ValueError(f"Bad timescale: {content.strip()}")
+                self.scale_ns = int(match.group(1)) * TIMESCALES_NS[match.group(2)]
+            elif keyword == 'comment' and len(fields) == 2 and fields[0] == 'start_ns':
+                self.start_ns = int(fields[1])
+            elif keyword == 'var' and len(fields) >= 4 and fields[1] == '1':
+                if fields[2] not in [code for code, _ in self.wires]:
+                    self.wires.append((fields[2], fields[3]))
+
+    def batches(self):
+        """
+        Yield (timestamps, wires, levels) arrays of the value changes of
+        the 1 bit wires in file order: wall-clock time in ns, index into
+        self.wires and level. x and z values are skipped.
+        """
+        lookup = {b'0' + code.encode(): index for index, (code, _) in enumerate(self.wires)}
+        now = 0  # Current VCD time
+        skipping = False  # Inside a $comment-like block
+        skip_first = False  # The first token of the next chunk is a vector's identifier
+        remainder = b''
+        with open(self.path, 'rb') as f:
+            f.seek(self.body_offset)
+            while True:
+                data = f.read(self.chunk_bytes)
+                chunk = remainder + data
+                if data:
+                    # Only whole tokens, the last one may continue in the next chunk
+                    cut = max(chunk.rfind(b' '), chunk.rfind(b'\n'), chunk.rfind(b'\t'), chunk.rfind(b'\r')) + 1
+                    chunk, remainder = chunk[:cut], chunk[cut:]
+                tokens = chunk.split()
+                if tokens:
+                    result, now, skipping, skip_first = self.parse(tokens, lookup, now, skipping, skip_first)
+                    if len(result[0]):
+                        yield result
+                if not data:
+                    break
+
+    def parse(self, tokens, lookup, now, skipping, skip_first):
+        tokens = np.array(tokens)
+        n = len(tokens)
+        first = tokens.view(np.uint8).reshape(n, tokens.itemsize)[:, 0]
+        ignored = np.zeros(n, dtype=bool)
+        ignored[0] = skip_first
+        # Keywords are rare, the blocks they open are masked in Python
+        opened = 0 if skipping else None
+        for i in np.flatnonzero(first == ord('$')).tolist():
+            ignored[i] = True
+            if opened is None:
+                if tokens[i] in BLOCK_KEYWORDS:
+                    opened = i
+            elif tokens[i] == b'$end':
+                ignored[opened:i + 1] = True
+                opened = None
+        if opened is not None:
+            ignored[opened:] = True
+        skipping = opened is not None
+        vector = np.isin(first, np.frombuffer(b'bBrR', dtype=np.uint8)) & ~ignored
+        skip_first = bool(vector[-1])
+        ignored[np.flatnonzero(vector[:-1]) + 1] = True
+        timed = (first == ord('#')) & ~ignored
+        times = tokens[timed].copy()
+        times.view(np.uint8).reshape(len(times), tokens.itemsize)[:, 0] = ord('0')
+        times = times.astype(np.int64)
+        scalar = np.isin(first, np.frombuffer(b'01', dtype=np.uint8)) & ~ignored
+        # Time of every token: the last #time before it
+        positions = np.maximum.accumulate(np.where(timed, np.arange(n), -1))
+        all_times = np.empty(n, dtype=np.int64)
+        all_times[:] = now
+        set_time = positions >= 0
+        all_times[set_time] = times[np.searchsorted(np.flatnonzero(timed), positions[set_time])]
+        if len(times):
+            now = int(times[-1])
+        changes = tokens[scalar]
+        levels = first[scalar] - ord('0')
+        codes = changes.copy()
+        codes.view(np.uint8).reshape(len(codes), tokens.itemsize)[:, 0] = ord('0')
+        wires = np.full(len(codes), -1, dtype=np.int64)
+        unique, inverse = np.unique(codes, return_inverse=True)
+        for i, code in enumerate(unique.tolist()):
+            wires[inverse == i] = lookup.get(code, -1)
+        known = wires >= 0
+        timestamps = self.start_ns + (all_times[scalar][known] * self.scale_ns).astype(np.int64)
+        return (timestamps, wires[known], levels[known].astype(np.uint8)), now, skipping, skip_first
+
+
+def wire_pins(wires):
+    """
+    GPIO number of each wire: n for wires named GPIO<n>, else the lowest
+    free numbers from FIRST_PIN up.
+    """
+    pins = []
+    for _, name in wires:
+        match = re.fullmatch(r'GPIO(\d+)', name)
+        pins.append(int(match.group(1)) if match and int(match.group(1)) < 256 else None)
+    free = (pin for pin in range(FIRST_PIN, 256) if pin not in pins)
+    return [pin if pin is not None else next(free) for pin in pins]
+
+
+def import_vcd(path, directory, **kwargs):
+    """
+    Convert a VCD file into a capture directory, to be opened with
+    visualizer.py --capture. Only 1 bit wires are imported. Returns the
+    directory.
+    """
+    reader = VCDReader(path)
+    pins = np.array(wire_pins(reader.wires) or [0], dtype=np.uint8)
+    writer = CaptureWriter(directory, **kwargs)
+    try:
+        for timestamps, wires, levels in reader.batches():
+            records = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+            records['version'] = WIRE_VERSION
+            records['pin'] = pins[wires]
+            records['level'] = levels
+            records['timestamp'] = timestamps
+            writer.write([records.tobytes()])
+    finally:
+        writer.close()
+    return directory
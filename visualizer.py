@@ -1,13 +1,26 @@
 import os
 import errno
-import ast
+import fcntl
+import select
 import sys
-from collections import defaultdict
+import tempfile
+import termios
+import threading
 import time
+import numpy as np
 from PySide6 import QtWidgets, QtCore, QtGui
 import pyqtgraph as pg
 from pyqtgraph import LabelItem, InfiniteLine, ViewBox
 from PySide6.QtCore import Signal
+from capture import CaptureReader
+from convert import ExportWriter, edge_array, export_capture
+from event_format import (FLAG_PWM, RECORD_DTYPE, RECORD_SIZE, EventDecoder, TextEventDecoder, WaveTable,
+                          expand_groups, split_pwm, split_stats)
+from decoders import parse_decoder
+from event_server import EVENT_SOCKET_NAME, subscribe
+from pulse_stats import PulseStats, WidthHistogram
+from trigger import parse_duration, parse_trigger
+from vcd import import_vcd
 
 class CustomViewBox(ViewBox):
     rangeChanged = Signal(float)  # Define a signal to emit the range delta
@@ -29,17 +42,302 @@ class CustomViewBox(ViewBox):
 # Constants
 NUM_GPIO_PINS = 26
 GPIO_PIN_RANGE = range(2, 28)
+MAX_EVENTS = 10000  # Events retained per pin
+EXPORT_SAMPLERATES = [10**8, 10**7, 10**6, 10**5, 10**4, 10**3]  # Tried in order for sigrok exports
+EXPORT_MAX_SAMPLES = 1 << 28  # Samples of a sigrok export of the visible range
+MAX_SEGMENTS = 64  # PWM segments retained per pin
+CAPTURE_RAW_LIMIT = 200000  # Records drawn one by one when browsing a capture
+TRIGGER_MODES = ['free', 'auto', 'normal', 'single']
+FRAME_LATENCY_NS = 300_000_000  # How late the events of a frame may arrive
+AUTO_TIMEOUT_NS = 1_000_000_000  # Auto mode shows an untriggered frame after this
+MAX_LABELS = 200  # Annotation texts drawn per decoder row, boxes are always drawn
+LABEL_PIXELS = 30  # Narrowest annotation that gets its text drawn
+READ_SIZE = 1 << 20  # Bytes ingested at once by the reader thread
+READ_TIMEOUT = 0.05  # Seconds the reader thread waits for events
+STATUS_INTERVAL_NS = 1_000_000_000  # Time between status bar updates
 
-# Create the named pipe if it does not exist
-pipe_name = 'log_pipe'
-if not os.path.exists(pipe_name):
-    os.mkfifo(pipe_name)
+def lod_bin_ns(span_ns, pixels):
+    """Power of two bin width giving at most one bin per pixel column."""
+    return 1 << max(int(np.ceil(np.log2(max(span_ns, 1) / pixels))), 0)
+
+
+def decimate(timestamps, states, bin_ns):
+    """
+    Min/max decimation of a step signal. Bins aligned to multiples of bin_ns
+    that hold two or more edges are replaced by a pair of points showing both
+    levels, which pyqtgraph draws as a solid toggling bar, ending on the
+    bin's last level. Bins with a single edge keep it at full resolution.
+    """
+    if len(timestamps) < 2:
+        return timestamps, states
+    bins = timestamps // bin_ns
+    starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+    counts = np.diff(np.append(starts, len(bins)))
+    busy = counts >= 2
+    if not busy.any():
+        return timestamps, states
+    keep = np.repeat(~busy, counts)
+    last_state = states[(starts + counts - 1)[busy]]
+    left = bins[starts[busy]] * bin_ns
+    x = np.concatenate([timestamps[keep], left, left + bin_ns // 2])
+    y = np.concatenate([states[keep], 1 - last_state, last_state])
+    order = np.argsort(x, kind='stable')
+    return x[order], y[order]
+
+
+def format_stats(summary):
+    """
+    One line of pulse statistics: frequency, duty cycle and median high and
+    low pulse widths.
+    """
+    parts = []
+    frequency = summary['frequency_hz']
+    if frequency:
+        for unit, scale in (('MHz', 1e6), ('kHz', 1e3), ('Hz', 1)):
+            if frequency >= scale or scale == 1:
+                parts.append(f'{frequency / scale:.3g} {unit}')
+                break
+    if summary['duty_cycle_percentage'] is not None:
+        parts.append(f"{summary['duty_cycle_percentage']:.1f}%")
+    for name, key in (('H', 'high'), ('L', 'low')):
+        if summary[key]['count']:
+            parts.append(f"{name} {GPIOPlotter.format_distance(summary[key]['p50_ns'])}")
+    parts.append(f"{summary['edges']} edges")
+    return '  '.join(parts)
+
+
+def pwm_steps(start_ns, period_ns, high_ns, a, b, bin_ns):
+    """
+    Step data of a PWM segment started at start_ns, between a and b. Exact
+    edges are generated only for [a, b); if the period is shorter than two
+    bins the waveform is drawn as a toggling bar with one pair of points per
+    bin, like decimate() does.
+    """
+    if high_ns <= 0 or high_ns >= period_ns:
+        return np.array([a], dtype=np.int64), np.array([1 if high_ns > 0 else 0], dtype=np.uint8)
+    if period_ns < 2 * bin_ns:
+        left = np.arange(a, b, bin_ns, dtype=np.int64)
+        x = np.empty(2 * len(left), dtype=np.int64)
+        x[0::2] = left
+        x[1::2] = np.minimum(left + bin_ns // 2, b)
+        y = np.tile(np.array([1, 0], dtype=np.uint8), len(left))
+        return x, y
+    rises = start_ns + np.arange((a - start_ns) // period_ns, (b - start_ns) // period_ns + 1, dtype=np.int64) * period_ns
+    x = np.empty(2 * len(rises), dtype=np.int64)
+    x[0::2] = rises
+    x[1::2] = rises + high_ns
+    y = np.tile(np.array([1, 0], dtype=np.uint8), len(rises))
+    inside = (x > a) & (x < b)
+    level_at_a = 1 if (a - start_ns) % period_ns < high_ns else 0
+    return np.append(a, x[inside]), np.append(np.uint8(level_at_a), y[inside])
+
+
+class DecimatedLevel:
+    """
+    One level of detail of a pin's history, decimated at a fixed bin width.
+
+    Bins are aligned to absolute multiples of the bin width, so a bin can no
+    longer change once a newer sample exists. Those sealed bins are cached
+    and each frame only decimates the samples that arrived since.
+    """
+    def __init__(self, bin_ns):
+        self.bin_ns = bin_ns
+        self.timestamps = np.empty(1024, dtype=np.int64)
+        self.states = np.empty(1024, dtype=np.uint8)
+        self.size = 0
+        self.sealed_ns = np.iinfo(np.int64).min  # Samples before this are cached
+
+    def append(self, timestamps, states, oldest_ns):
+        n = len(timestamps)
+        if self.size + n > len(self.timestamps):
+            # Forget points the pin history no longer has, then grow if needed
+            drop = max(int(np.searchsorted(self.timestamps[:self.size], oldest_ns, 'right')) - 1, 0)
+            self.size -= drop
+            capacity = max(len(self.timestamps), 2 * (self.size + n))
+            for name in ('timestamps', 'states'):
+                old = getattr(self, name)
+                new = old if capacity == len(old) else np.empty(capacity, dtype=old.dtype)
+                new[:self.size] = old[drop:drop + self.size]
+                setattr(self, name, new)
+        self.timestamps[self.size:self.size + n] = timestamps
+        self.states[self.size:self.size + n] = states
+        self.size += n
+
+    def window(self, timestamps, states, start_ns, end_ns):
+        """
+        Bring the cache up to date with the pin history and return the
+        decimated points covering [start_ns, end_ns] plus the unsealed tail.
+        """
+        new = int(np.searchsorted(timestamps, self.sealed_ns, 'left'))
+        x, y = decimate(timestamps[new:], states[new:], self.bin_ns)
+        # Every bin before the one holding the newest sample is complete
+        sealed_ns = int(timestamps[-1]) // self.bin_ns * self.bin_ns
+        split = int(np.searchsorted(x, sealed_ns, 'left'))
+        self.append(x[:split], y[:split], int(timestamps[0]))
+        self.sealed_ns = sealed_ns
+        cached = self.timestamps[:self.size]
+        first = max(int(np.searchsorted(cached, start_ns, 'right')) - 1, 0)
+        last = int(np.searchsorted(cached, end_ns, 'right')) + 1
+        return (np.concatenate([cached[first:last], x[split:]]),
+                np.concatenate([self.states[first:last], y[split:]]))
+
+
+class PinHistory:
+    """
+    Circular buffer of (timestamp, state) samples for one GPIO pin.
+
+    Every sample is written twice, at i and i + capacity, so the newest
+    samples are always one contiguous slice that can be searched with
+    np.searchsorted and handed to pyqtgraph without copying the history.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.states = np.zeros(2 * capacity, dtype=np.uint8)
+        self.head = 0  # Next write position, always < capacity
+        self.count = 0
+        self.levels = {}  # bin width in ns -> DecimatedLevel
+        self.segments = []  # PWM segments: [start_ns, stop_ns or None, period_ns, high_ns]
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, timestamps, states):
+        n = len(timestamps)
+        if n > self.capacity:
+            timestamps, states = timestamps[-self.capacity:], states[-self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self.head)
+        for buf, values in ((self.timestamps, timestamps), (self.states, states)):
+            for offset in (0, self.capacity):
+                buf[offset + self.head:offset + self.head + first] = values[:first]
+                buf[offset:offset + n - first] = values[first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def view(self):
+        """Return (timestamps, states) of the retained samples, oldest first."""
+        start = self.head - self.count
+        end = self.head
+        if start < 0:
+            start += self.capacity
+            end += self.capacity
+        return self.timestamps[start:end], self.states[start:end]
+
+    def snapshot(self, start_ns, end_ns):
+        """
+        A new PinHistory holding copies of the samples and PWM segments
+        covering [start_ns, end_ns], which later events do not change.
+        """
+        timestamps, states = self.view()
+        first = max(int(np.searchsorted(timestamps, start_ns, 'right')) - 1, 0)
+        last = int(np.searchsorted(timestamps, end_ns, 'right'))
+        history = PinHistory(max(last - first, 1))
+        history.extend(timestamps[first:last], states[first:last])
+        history.segments = [list(segment) for segment in self.segments
+                            if segment[0] <= end_ns and (segment[1] is None or segment[1] >= start_ns)]
+        return history
+
+    def add_segment(self, start_ns, period_ns, high_ns, running):
+        """Start a PWM segment, or stop the current one if not running."""
+        if self.segments and self.segments[-1][1] is None:
+            self.segments[-1][1] = start_ns
+        if running:
+            self.segments.append([start_ns, None, period_ns, high_ns])
+            del self.segments[:-MAX_SEGMENTS]
+
+    def window(self, start_ns, end_ns, latest_ns, pixels):
+        """
+        Return step curve data (x has one more point than y) covering
+        [start_ns, end_ns], or None if the pin has no samples before end_ns.
+
+        When the window holds more edges than the plot is wide, the data comes
+        from the min/max decimated level matching the zoom instead. PWM
+        segments are expanded on top for the visible part only.
+        """
+        timestamps, states = self.view()
+        first = max(int(np.searchsorted(timestamps, start_ns, 'right')) - 1, 0)
+        last = int(np.searchsorted(timestamps, end_ns, 'right'))
+        if last == 0:
+            if not self.segments:
+                return None
+            x, y, end = self.overlay_segments(timestamps[:0], states[:0], start_ns, start_ns, end_ns, latest_ns, pixels)
+            return (np.append(x, end), y) if len(y) else None
+        if last - first > 2 * pixels:
+            bin_ns = lod_bin_ns(end_ns - start_ns, pixels)
+            level = self.levels.get(bin_ns)
+            if level is None:
+                level = self.levels[bin_ns] = DecimatedLevel(bin_ns)
+            timestamps, states = level.window(timestamps, states, start_ns, end_ns)
+            first = max(int(np.searchsorted(timestamps, start_ns, 'right')) - 1, 0)
+            last = int(np.searchsorted(timestamps, end_ns, 'right'))
+        # The last visible level lasts until the next sample, or until the
+        # newest event seen on any pin
+        end = timestamps[last] if last < len(timestamps) else max(latest_ns, timestamps[last - 1])
+        x, y = timestamps[first:last], states[first:last]
+        if self.segments:
+            x, y, end = self.overlay_segments(x, y, end, start_ns, end_ns, latest_ns, pixels)
+        return np.append(x, end), y
+
+    def overlay_segments(self, x, y, end, start_ns, end_ns, latest_ns, pixels):
+        """
+        Replace the samples covered by PWM segments with the segments'
+        waveform, after each segment resuming at the level the samples had.
+        """
+        bin_ns = lod_bin_ns(end_ns - start_ns, pixels)
+        for seg_start, seg_stop, period_ns, high_ns in self.segments:
+            a = int(max(seg_start, start_ns))
+            b = int(min(latest_ns if seg_stop is None else seg_stop, end_ns))
+            if a >= b:
+                continue
+            seg_x, seg_y = pwm_steps(seg_start, period_ns, high_ns, a, b, bin_ns)
+            before = int(np.searchsorted(x, a, 'left'))
+            after = int(np.searchsorted(x, b, 'left'))
+            tail_x, tail_y = x[after:], y[after:]
+            if after > 0 and b < end and (after == len(x) or x[after] > b):
+                tail_x = np.insert(tail_x, 0, b)
+                tail_y = np.insert(tail_y, 0, y[after - 1])
+            x = np.concatenate([x[:before], seg_x, tail_x])
+            y = np.concatenate([y[:before], seg_y, tail_y])
+            end = max(end, b)
+        return x, y, end
+
+def capture_history(timestamps, states, segments):
+    """
+    A PinHistory holding one pin's samples from a capture and its PWM
+    segments, so captures are drawn by the same code as live data.
+    """
+    stops = segments[segments['level'] == 0]
+    timestamps = np.concatenate([timestamps, stops['timestamp']])
+    states = np.concatenate([states, np.zeros(len(stops), dtype=np.uint8)])
+    order = np.argsort(timestamps, kind='stable')
+    history = PinHistory(max(len(timestamps), 1))
+    history.extend(timestamps[order], states[order])
+    for gpio, running, start_ns, period_ns, high_ns in segments.tolist():
+        history.add_segment(start_ns, period_ns, high_ns, running)
+    return history
 
 # Initialize data storage for each GPIO pin
-gpio_data = defaultdict(lambda: {'timestamps': [], 'states': [], 'last_state': None})
+gpio_data = {gpio: PinHistory(MAX_EVENTS) for gpio in GPIO_PIN_RANGE}
 
 class GPIOPlotter(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, text_format=False, capture=None, socket_path=EVENT_SOCKET_NAME,
+                 trigger=None, trigger_mode='free', pre_trigger_ns=1_000_000, post_trigger_ns=4_000_000,
+                 decoders=()):
+        """
+        :param capture: Directory of a recorded capture to browse instead of
+            following the live events.
+        :param socket_path: Event server to subscribe to for live events.
+        :param trigger: Trigger spec, see trigger.parse_trigger().
+        :param trigger_mode: One of TRIGGER_MODES. 'free' scrolls through the
+            last seconds; the others freeze the display on a frame of
+            pre_trigger_ns before and post_trigger_ns after each trigger:
+            'single' stops after one frame until re-armed, 'normal' shows
+            every new frame and 'auto' also shows an untriggered frame when
+            no trigger came for a second.
+        :param decoders: Protocol decoder specs, see decoders.parse_decoder().
+            Each one gets an annotation row under the last of its pins.
+        """
         super(GPIOPlotter, self).__init__(parent)
         
         self.layout = QtWidgets.QVBoxLayout()
@@ -51,6 +349,13 @@ class GPIOPlotter(QtWidgets.QWidget):
         self.plotWidget = pg.GraphicsLayoutWidget()
         self.plots = []
         self.curves = []
+        self.decoderSpecs = list(decoders)
+        self.decoders = [parse_decoder(spec) for spec in self.decoderSpecs]
+        for decoder in self.decoders:
+            if not all(pin in GPIO_PIN_RANGE for pin in decoder.pins):
+                raise ValueError(f"Decoder pins must be GPIO{GPIO_PIN_RANGE.start} to GPIO{GPIO_PIN_RANGE[-1]}.")
+        self.decoderRows = []
+        self.statsTexts = []
         plot_height = 20
         for i in GPIO_PIN_RANGE:
             # Create a label for the GPIO pin and add it to the layout
@@ -68,7 +373,15 @@ class GPIOPlotter(QtWidgets.QWidget):
             curve = plot.plot([], [], pen='y' if i % 2 == 0 else 'r', stepMode=True)  # Set color based on index
             self.plots.append(plot)
             self.curves.append(curve)
+            # Pulse statistics overlay, fixed in the top left corner of the plot
+            statsText = pg.TextItem(color='w', fill=(0, 0, 0, 160), anchor=(0, 0))
+            statsText.setParentItem(plot.getViewBox())
+            statsText.hide()
+            self.statsTexts.append(statsText)
             self.plotWidget.nextRow()
+            for decoder in self.decoders:
+                if max(decoder.pins) == i:
+                    self.addDecoderRow(decoder)
             
             # Set y-axis range and hide labels
             plot.setRange(yRange=[-.1, 1.1], disableAutoRange=True)
@@ -78,17 +391,51 @@ class GPIOPlotter(QtWidgets.QWidget):
         # Set all plots to share the same x-axis
         for i in range(len(self.plots) - 1):
             self.plots[i].setXLink(self.plots[-1])
+        for row in self.decoderRows:
+            row['plot'].setXLink(self.plots[-1])
+        self.plots[-1].getViewBox().sigXRangeChanged.connect(self.onXRangeChanged)
+        self.latestTime = 0  # Newest event timestamp seen on any pin
     
         self.layout.addWidget(self.plotWidget)
 
         # Timer for updating plots
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.updatePlots)
-        self.timer.start(100)
-
-        # Open the named pipe in non-blocking mode
-        self.pipe_fd = os.open(pipe_name, os.O_RDONLY | os.O_NONBLOCK)
-        self.pipe = os.fdopen(self.pipe_fd, 'r')
+        self.capture = CaptureReader(capture) if capture else None
+        self.socket_path = socket_path
+        self.events = None  # Subscription socket, owned by the reader thread
+        self.text_format = text_format
+        self.decoder = TextEventDecoder() if text_format else EventDecoder()
+        self.waves = WaveTable()
+        self.trigger = parse_trigger(trigger) if trigger else None
+        self.triggerMode = trigger_mode
+        self.preTrigger = pre_trigger_ns
+        self.postTrigger = post_trigger_ns
+        self.armed = True
+        self.pendingTrigger = None  # Trigger time waiting for its post-trigger events
+        self.rearmTime = 0  # Triggers before the end of the last frame are ignored
+        self.lastFrameTime = time.time_ns()
+        self.frame = None  # gpio -> frozen PinHistory of the displayed frame
+        self.frameEnd = 0
+        self.triggerLines = []
+        # The reader thread stores the events as they arrive, frames only
+        # take what changed since the last one under the lock
+        self.dataLock = threading.Lock()
+        self.dirtyPins = set()
+        self.triggerHits = []
+        self.backlog = 0  # Events received but not stored yet, read without the lock
+        self.stopReading = threading.Event()
+        # Status bar counters: ingest times are taken under the lock, render
+        # times only in the GUI thread
+        self.received = 0
+        self.invalidRecords = 0
+        self.ingestTimes = WidthHistogram()
+        self.renderTimes = WidthHistogram()
+        self.producerMetrics = {}  # Latest stats report of the GPIO side
+        self.producerRate = None
+        self.producerMetricsTime = 0
+        self.lastStatus = (time.time_ns(), 0)  # Time and events received at the last update
+        self.reader = threading.Thread(target=self.readLoop, name='visualizer reader', daemon=True)
 
         # Create a horizontal layout for the distance label and pause button
         self.bottomLayout = QtWidgets.QHBoxLayout()
@@ -108,6 +455,16 @@ class GPIOPlotter(QtWidgets.QWidget):
         self.pauseButton = QtWidgets.QPushButton("Pause")
         self.pauseButton.clicked.connect(self.togglePause)
         self.bottomLayout.addWidget(self.pauseButton)
+
+        # Running pulse statistics of every pin, shown on top of its plot
+        self.pulseStats = PulseStats()
+        self.statsButton = QtWidgets.QPushButton("Stats")
+        self.statsButton.setCheckable(True)
+        self.statsButton.toggled.connect(self.updateStats)
+        self.bottomLayout.addWidget(self.statsButton)
+        self.exportButton = QtWidgets.QPushButton("Export")
+        self.exportButton.clicked.connect(self.exportVisible)
+        self.bottomLayout.addWidget(self.exportButton)
         
         # Initialize zoom in button, set its clicked signal to zoomIn method.
         self.range = 10
@@ -118,8 +475,31 @@ class GPIOPlotter(QtWidgets.QWidget):
         self.zoomOutButton.clicked.connect(self.zoomOut)
         self.bottomLayout.addWidget(self.zoomOutButton)
 
+        # Trigger controls
+        self.triggerModeBox = QtWidgets.QComboBox()
+        self.triggerModeBox.addItems([mode.capitalize() for mode in TRIGGER_MODES])
+        self.triggerModeBox.setCurrentIndex(TRIGGER_MODES.index(trigger_mode))
+        self.triggerModeBox.currentIndexChanged.connect(self.setTriggerMode)
+        self.bottomLayout.addWidget(self.triggerModeBox)
+        self.triggerEdit = QtWidgets.QLineEdit(trigger or '')
+        self.triggerEdit.setPlaceholderText('Trigger, e.g. rising:17')
+        self.triggerEdit.editingFinished.connect(self.setTrigger)
+        self.bottomLayout.addWidget(self.triggerEdit)
+        self.armButton = QtWidgets.QPushButton("Arm")
+        self.armButton.clicked.connect(self.arm)
+        self.bottomLayout.addWidget(self.armButton)
+        self.triggerLabel = QtWidgets.QLabel()
+        self.bottomLayout.addWidget(self.triggerLabel)
+        self.updateTriggerLabel()
+        self.backlogLabel = QtWidgets.QLabel()
+        self.bottomLayout.addWidget(self.backlogLabel)
+
         # Add the horizontal layout to the main vertical layout
         self.layout.addLayout(self.bottomLayout)
+        # Health of the producer and of the visualizer itself
+        self.statusBar = QtWidgets.QStatusBar()
+        self.statusBar.setSizeGripEnabled(False)
+        self.layout.addWidget(self.statusBar)
 
         # Connect the click event
         self.plotWidget.scene().sigMouseClicked.connect(self.onClick)
@@ -127,15 +507,174 @@ class GPIOPlotter(QtWidgets.QWidget):
         self.clickCount = 0  # Add this line to track the number of clicks
         self.clickPositions = []  # List to store x-axis positions of the clicks in nanoseconds
 
+        if self.capture is not None and len(self.capture):
+            # Show the whole capture; browsing it redraws through onXRangeChanged
+            self.pauseButton.hide()
+            self.statsButton.hide()
+            self.statusBar.hide()
+            for widget in (self.triggerModeBox, self.triggerEdit, self.armButton, self.triggerLabel):
+                widget.hide()
+            self.plots[-1].setXRange(*self.capture.time_range(), padding=0)
+        if self.capture is None:
+            self.reader.start()
+            self.timer.start(100)
+
+    def addDecoderRow(self, decoder):
+        """
+        Add a row for the annotations of a decoder: a box per decoded frame,
+        with its text where there is room.
+        """
+        self.plotWidget.addItem(LabelItem(decoder.name, size='6pt'))
+        plot = self.plotWidget.addPlot()
+        plot.setMouseEnabled(x=True, y=False)
+        plot.setFixedHeight(24)
+        plot.setContentsMargins(0, 0, 0, 0)
+        plot.setRange(yRange=[0, 1], disableAutoRange=True)
+        plot.getAxis('bottom').setStyle(showValues=False)
+        boxes = plot.plot([], [], pen='c', connect='finite')
+        self.decoderRows.append({'plot': plot, 'boxes': boxes, 'labels': []})
+        self.plotWidget.nextRow()
+
     def updateRange(self, newRange):
         self.range = newRange / 1e9  # Update the range with the new value
         xRange = self.plots[-1].getViewBox().viewRange()[0]
         self.xRangeLabel.setText(f'X Range: {self.format_distance(xRange[1] - xRange[0])}')
 
+    def updateStats(self):
+        shown = self.statsButton.isChecked()
+        now_ns = time.time_ns()
+        with self.dataLock:
+            summaries = [self.pulseStats.summary(gpio, now_ns) if shown else None for gpio in GPIO_PIN_RANGE]
+        for statsText, summary in zip(self.statsTexts, summaries):
+            if summary is None:
+                statsText.hide()
+                continue
+            statsText.setText(format_stats(summary))
+            statsText.show()
+
+    def exportVisible(self):
+        """
+        Save the visible range to a VCD or sigrok file for GTKWave or
+        PulseView.
+        """
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export visible range", 'gpio.vcd',
+                                                        "VCD (*.vcd);;sigrok session (*.sr)")
+        if not path:
+            return
+        if not path.endswith(('.vcd', '.sr')):
+            path += '.vcd'
+        start_ns, end_ns = (int(x) for x in self.plots[-1].getViewBox().viewRange()[0])
+        try:
+            self.exportRange(path, start_ns, end_ns)
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self, "Export failed", str(e))
+
+    def exportRange(self, path, start_ns, end_ns):
+        """
+        Write [start_ns, end_ns] of the capture, the displayed trigger
+        frame or the live pin histories to a VCD or sigrok file.
+        """
+        samplerate = next((rate for rate in EXPORT_SAMPLERATES
+                           if (end_ns - start_ns) * rate // 10**9 <= EXPORT_MAX_SAMPLES), EXPORT_SAMPLERATES[-1])
+        if self.capture is not None:
+            export_capture(self.capture.directory, path, start_ns, end_ns, samplerate=samplerate)
+            return
+        with self.dataLock:
+            histories = self.frame or {gpio: gpio_data[gpio].snapshot(start_ns, end_ns) for gpio in GPIO_PIN_RANGE}
+        levels, edges, segments = {}, [], []
+        for gpio, history in histories.items():
+            timestamps, states = history.view()
+            inside = (timestamps >= start_ns) & (timestamps <= end_ns)
+            if len(timestamps) and timestamps[0] < start_ns:
+                levels[gpio] = int(states[0])
+            edges.append(edge_array(timestamps[inside], gpio, states[inside]))
+            segments += [(gpio, seg_start, period_ns, high_ns, seg_stop)
+                         for seg_start, seg_stop, period_ns, high_ns in history.segments]
+        writer = ExportWriter(path, pins=GPIO_PIN_RANGE, samplerate=samplerate, levels=levels)
+        writer.start(start_ns)
+        writer.add_edges(np.concatenate(edges), segments)
+        writer.close(end_ns)
+
     def togglePause(self):
         self.isPaused = not self.isPaused
         self.pauseButton.setText("Resume" if self.isPaused else "Pause")
     
+    def triggered(self):
+        return self.triggerMode != 'free' and self.trigger is not None
+
+    def setTriggerMode(self, index):
+        self.triggerMode = TRIGGER_MODES[index]
+        if self.triggerMode == 'free':
+            self.frame = None
+            self.showTriggerLine(None)
+        self.arm()
+
+    def setTrigger(self):
+        spec = self.triggerEdit.text().strip()
+        try:
+            self.trigger = parse_trigger(spec) if spec else None
+        except ValueError as e:
+            self.trigger = None
+            self.triggerLabel.setText(str(e))
+            return
+        self.arm()
+
+    def arm(self):
+        """
+        Wait for the next trigger, e.g. after a single shot.
+        """
+        self.armed = True
+        self.pendingTrigger = None
+        self.rearmTime = 0
+        self.lastFrameTime = time.time_ns()
+        with self.dataLock:
+            self.triggerHits = []
+            if self.trigger is not None:
+                self.trigger.reset()
+        self.updateTriggerLabel()
+
+    def updateTriggerLabel(self):
+        if not self.triggered():
+            self.triggerLabel.setText("")
+        elif self.pendingTrigger is not None:
+            self.triggerLabel.setText("Triggered")
+        else:
+            self.triggerLabel.setText("Armed" if self.armed else "Stopped")
+
+    def updateBacklogLabel(self, backlog):
+        self.backlogLabel.setText(f"Behind by {backlog:,} events" if backlog else "")
+
+    def updateStatus(self, now_ns):
+        """
+        Show the producer's last stats report and our own receive rate,
+        ingest and render times since the last update.
+        """
+        with self.dataLock:
+            received, ingestTimes, self.ingestTimes = self.received, self.ingestTimes, WidthHistogram()
+            metrics = self.producerMetrics
+        renderTimes, self.renderTimes = self.renderTimes, WidthHistogram()
+        last_ns, last_received = self.lastStatus
+        self.lastStatus = (now_ns, received)
+        parts = []
+        if metrics:
+            capacity = max(metrics['buffer_capacity'], 1)
+            rate = f"{self.producerRate:,.0f} ev/s, " if self.producerRate is not None else ""
+            parts.append(f"GPIO: {rate}{metrics['dropped']:,} dropped, "
+                         f"buffer peak {100 * metrics['buffer_peak'] / capacity:.0f}%, "
+                         f"flush max {self.format_distance(metrics['flush_max_ns'])}, "
+                         f"latency max {self.format_distance(metrics['latency_max_ns'])}, "
+                         f"{metrics['subscribers']} subscribers")
+            if metrics.get('sample_rate'):
+                parts.append(f"Sampling: {metrics['sample_rate']:,} S/s, {metrics['missed_samples']:,} missed")
+        visualizer = f"Visualizer: {(received - last_received) * 1e9 / max(now_ns - last_ns, 1):,.0f} ev/s"
+        for name, times in (('ingest', ingestTimes), ('render', renderTimes)):
+            if times.count:
+                visualizer += f", {name} p99 {self.format_distance(times.percentile(99))}"
+        errors = self.decoder.errors + self.invalidRecords
+        visualizer += f", {errors:,} bad records"
+        parts.append(visualizer)
+        self.statusBar.showMessage("  |  ".join(parts))
+
     def zoomIn(self):
         self.range = self.range / 2
         current_range = self.plots[-1].getViewBox().viewRange()[0]
@@ -150,96 +689,341 @@ class GPIOPlotter(QtWidgets.QWidget):
         self.plots[len(self.plots)-1].setXRange(new_min, current_range[1], padding=0)
         self.xRangeLabel.setText(f'X Range: {self.format_distance(current_range[1] - new_min)}')
 
-    def trimData(self):
-        """Trim the data for each GPIO pin to keep only the last 2000 events."""
-        max_events = 10000  # Maximum number of events to retain
-        for gpio in GPIO_PIN_RANGE:
-            data = gpio_data[gpio]
-            if len(data['timestamps']) > max_events:
-                # Calculate the number of items to remove
-                num_to_remove = len(data['timestamps']) - max_events
-                # Remove the oldest items
-                data['timestamps'] = data['timestamps'][num_to_remove:]
-                data['states'] = data['states'][num_to_remove:]
-
     def updatePlots(self):
+        """
+        One frame: redraw if the reader thread stored anything since the
+        last one. The events themselves are ingested by readLoop().
+        """
+        with self.dataLock:
+            dirty, self.dirtyPins = self.dirtyPins, set()
+            hits = np.concatenate(self.triggerHits) if self.triggerHits else np.empty(0, dtype=np.int64)
+            self.triggerHits = []
+        self.updateBacklogLabel(self.backlog)
+        # Get the current time in nanoseconds
+        current_time_ns = time.time_ns()
+        if current_time_ns - self.lastStatus[0] >= STATUS_INTERVAL_NS:
+            self.updateStatus(current_time_ns)
         if self.isPaused:
             return  # Skip updating plots if paused
 
-        # Get the current time in nanoseconds
-        current_time_ns = time.time_ns()
-        # Define the start of the trailing window (10 seconds ago)
-        window_start_ns = current_time_ns - self.range * 1e9  # 10 seconds in nanoseconds
+        # Define the start of the trailing window
+        window_start_ns = current_time_ns - self.range * 1e9
         xRange = self.plots[-1].getViewBox().viewRange()[0]
         self.xRangeLabel.setText(f'X Range: {self.format_distance(xRange[1] - xRange[0])}')
 
-        # Call trim_data here to ensure each GPIO pin's data is trimmed before updating plots
-        self.trimData()
+        if self.statsButton.isChecked():
+            self.updateStats()
+        if self.triggered():
+            self.updateTrigger(hits, current_time_ns)
+            return
+        # Running PWM channels keep the view scrolling without any events
+        with self.dataLock:
+            pwm_running = any(gpio_data[gpio].segments and gpio_data[gpio].segments[-1][1] is None for gpio in GPIO_PIN_RANGE)
+        if pwm_running:
+            self.latestTime = max(self.latestTime, current_time_ns)
+        if dirty or pwm_running:
+            # Redraws through onXRangeChanged
+            self.plots[-1].setXRange(window_start_ns, current_time_ns, padding=0)
+
+    def readLoop(self):
+        """
+        Reader thread: ingest the events as they arrive, independently of
+        the frame rate, so nothing piles up while the GUI is busy.
+        """
+        while not self.stopReading.is_set():
+            try:
+                data = self.readEvents()
+            except IOError as e:
+                if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
+                    raise
+                data = b''
+            self.ingest(data, time.time_ns())
+            self.backlog = max(self.backlog - len(data) // RECORD_SIZE, 0)
+        if self.events is not None:
+            self.events.close()
+            self.events = None
 
+    def ingest(self, data, current_time_ns):
+        """
+        Decode events and store them in the pin histories, pulse statistics
+        and decoders, noting the changed pins and trigger hits for the next
+        frame.
+        """
+        start = time.perf_counter_ns()
+        window_start_ns = current_time_ns - self.range * 1e9
+        records = self.decoder.feed(data)
+        metrics = {}
+        invalid = 0
+        if len(records):
+            records, metrics = split_stats(records)
+            records = self.waves.expand(expand_groups(records))
+            valid = np.isin(records['pin'], GPIO_PIN_RANGE)
+            if not valid.all():
+                invalid = int(len(records) - valid.sum())
+                records = records[valid]
+        segments = None
+        if len(records):
+            records, segments = split_pwm(records)
+        edges = records[records['flags'] == 0]
+        edges = edges[np.argsort(edges['timestamp'], kind='stable')]
+        with self.dataLock:
+            if segments is not None and len(segments):
+                records = np.concatenate([records, self.storeSegments(segments)])
+            if len(records):
+                self.storeEvents(records, window_start_ns)
+                self.dirtyPins.update(np.unique(records['pin']).tolist())
+            if len(edges):
+                pins = edges['pin']
+                for gpio in np.unique(pins).tolist():
+                    mine = pins == gpio
+                    self.pulseStats.add_edges(gpio, edges['timestamp'][mine], edges['level'][mine])
+            for decoder in self.decoders:
+                # Events may arrive that late, frames ending with an idle line
+                # are complete once it has passed
+                decoder.feed(edges, current_time_ns - FRAME_LATENCY_NS)
+            trigger = self.trigger if self.triggered() else None
+            if trigger is not None and len(edges):
+                self.triggerHits.append(trigger.find(edges))
+            if metrics:
+                if self.producerMetrics:
+                    self.producerRate = ((metrics['produced'] - self.producerMetrics['produced']) * 1e9 /
+                                         max(current_time_ns - self.producerMetricsTime, 1))
+                self.producerMetrics = metrics
+                self.producerMetricsTime = current_time_ns
+            self.received += len(records)
+            self.invalidRecords += invalid
+            if len(data):
+                self.ingestTimes.add(time.perf_counter_ns() - start)
+
+    def updateTrigger(self, hits, now_ns):
+        """
+        Take the trigger times found since the last frame and draw the frame
+        once its post-trigger events are in. Nothing is drawn while waiting.
+        """
+        if self.armed and self.pendingTrigger is None:
+            hits = hits[hits >= self.rearmTime]
+            if len(hits):
+                self.pendingTrigger = int(hits[0])
+                self.updateTriggerLabel()
+        if self.pendingTrigger is not None:
+            end_ns = self.pendingTrigger + self.postTrigger
+            if self.latestTime >= end_ns or now_ns >= end_ns + FRAME_LATENCY_NS:
+                self.showFrame(self.pendingTrigger)
+                self.pendingTrigger = None
+                self.rearmTime = end_ns
+                self.armed = self.triggerMode != 'single'
+                self.updateTriggerLabel()
+        elif self.triggerMode == 'auto' and self.armed and now_ns - self.lastFrameTime > AUTO_TIMEOUT_NS:
+            self.showFrame(None, now_ns - FRAME_LATENCY_NS)
+
+    def showFrame(self, trigger_ns, end_ns=None):
+        """
+        Freeze the display on the frame around trigger_ns, or on an
+        untriggered frame ending at end_ns.
+        """
+        if trigger_ns is not None:
+            end_ns = trigger_ns + self.postTrigger
+        start_ns = end_ns - self.preTrigger - self.postTrigger
+        with self.dataLock:
+            self.frame = {gpio: gpio_data[gpio].snapshot(start_ns, end_ns) for gpio in GPIO_PIN_RANGE}
+        self.frameEnd = end_ns
+        self.lastFrameTime = time.time_ns()
+        self.showTriggerLine(trigger_ns)
+        # Redraws through onXRangeChanged
+        self.plots[-1].setXRange(start_ns, end_ns, padding=0)
+
+    def showTriggerLine(self, trigger_ns):
+        if not self.triggerLines and trigger_ns is not None:
+            for plot in self.plots:
+                line = InfiniteLine(angle=90, movable=False, pen=pg.mkPen('g', style=QtCore.Qt.DashLine))
+                plot.addItem(line)
+                self.triggerLines.append(line)
+        for line in self.triggerLines:
+            if trigger_ns is not None:
+                line.setPos(trigger_ns)
+            line.setVisible(trigger_ns is not None)
+
+    def storeSegments(self, segments):
+        """
+        Record PWM segments. Returns the stop samples to store as events: the
+        line is low after a PWM channel stops.
+        """
+        for gpio, running, start_ns, period_ns, high_ns in segments.tolist():
+            gpio_data[gpio].add_segment(start_ns, period_ns, high_ns, running)
+            self.latestTime = max(self.latestTime, start_ns)
+        stops = segments[segments['level'] == 0]
+        records = np.zeros(len(stops), dtype=RECORD_DTYPE)
+        records['flags'] = FLAG_PWM
+        for name in ('pin', 'level', 'timestamp'):
+            records[name] = stops[name]
+        return records
+
+    def storeEvents(self, records, window_start_ns):
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+        self.latestTime = max(self.latestTime, int(records['timestamp'][-1]))
+        pins = records['pin']
+        for gpio in np.unique(pins).tolist():
+            events = records[pins == gpio]
+            history = gpio_data[gpio]
+            if not len(history) and not events['flags'][0]:
+                # Assume the opposite state before the first event, backfilled
+                # at the start of the window
+                history.extend([window_start_ns], [1 - events['level'][0]])
+            history.extend(events['timestamp'], events['level'])
+
+    def renderPlots(self, start_ns, end_ns):
+        """Draw only the samples inside [start_ns, end_ns]."""
+        start = time.perf_counter_ns()
+        pixels = max(int(self.plots[-1].getViewBox().width()), 100)
+        if self.capture is not None:
+            self.renderCapture(start_ns, end_ns, pixels)
+            return
+        if self.frame is not None:
+            # A frozen trigger frame, browsed without the newer events
+            empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+            for gpio, curve in zip(GPIO_PIN_RANGE, self.curves):
+                data = self.frame[gpio].window(start_ns, end_ns, self.frameEnd, pixels)
+                curve.setData(*(data if data is not None else empty))
+        else:
+            with self.dataLock:
+                windows = [gpio_data[gpio].window(start_ns, end_ns, self.latestTime, pixels) for gpio in GPIO_PIN_RANGE]
+            for data, curve in zip(windows, self.curves):
+                if data is not None:
+                    curve.setData(*data)
+        with self.dataLock:
+            self.renderAnnotations(self.decoders, start_ns, end_ns, pixels)
+        self.renderTimes.add(time.perf_counter_ns() - start)
+
+    def renderAnnotations(self, decoders, start_ns, end_ns, pixels):
+        """
+        Draw the decoded frames inside [start_ns, end_ns] in the decoder rows.
+        """
+        for decoder, row in zip(decoders, self.decoderRows):
+            annotations = decoder.window(start_ns, end_ns)
+            starts, ends = annotations['start_ns'], annotations['end_ns']
+            x = np.empty((len(annotations), 6))
+            x[:, 0] = x[:, 1] = x[:, 4] = starts
+            x[:, 2] = x[:, 3] = ends
+            x[:, 5] = np.nan
+            y = np.tile([0.15, 0.85, 0.85, 0.15, 0.15, np.nan], len(annotations))
+            row['boxes'].setData(x.ravel(), y, connect='finite')
+            wide = (ends - starts) * pixels >= LABEL_PIXELS * max(end_ns - start_ns, 1)
+            shown = annotations[wide][:MAX_LABELS] if wide.sum() <= MAX_LABELS else annotations[:0]
+            while len(row['labels']) < len(shown):
+                label = pg.TextItem(anchor=(0, 0.5), color='w')
+                row['plot'].addItem(label)
+                row['labels'].append(label)
+            for label, (start, _, kind, value) in zip(row['labels'], shown.tolist()):
+                label.setText(decoder.label(kind, value))
+                label.setPos(start, 0.5)
+                label.show()
+            for label in row['labels'][len(shown):]:
+                label.hide()
+
+    def renderCapture(self, start_ns, end_ns, pixels):
+        """
+        Draw a recorded capture. Only the records of the visible range are
+        read from the memory map; if there are too many the range is drawn
+        from the capture index summary instead.
+        """
+        reader = self.capture
+        if not len(reader):
+            return
+        start_ns, end_ns = int(start_ns), int(end_ns)
+        if reader.find(end_ns + 1) - reader.find(start_ns) > CAPTURE_RAW_LIMIT:
+            samples = reader.overview(start_ns, end_ns, GPIO_PIN_RANGE)
+            decoders = [parse_decoder(spec) for spec in self.decoderSpecs]  # Nothing decoded
+        else:
+            edges, known, levels = self.captureEdges(start_ns, end_ns)
+            samples = self.captureSamples(edges, known, levels, start_ns)
+            # Decoded from scratch for the records read
+            decoders = [parse_decoder(spec) for spec in self.decoderSpecs]
+            for decoder in decoders:
+                decoder.feed(edges, end_ns)
+        latest_ns = reader.time_range()[1]
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        for gpio, curve in zip(GPIO_PIN_RANGE, self.curves):
+            timestamps, states = samples.get(gpio, empty)
+            history = capture_history(timestamps, states, reader.pwm[reader.pwm['pin'] == gpio])
+            data = history.window(start_ns, end_ns, latest_ns, pixels)
+            curve.setData(*(data if data is not None else empty))
+        self.renderAnnotations(decoders, start_ns, end_ns, pixels)
+
+    def captureEdges(self, start_ns, end_ns):
+        """
+        The captured edges around the range in time order, and the (known,
+        levels) pin masks before them.
+        """
+        records, known, levels = self.capture.read(start_ns, end_ns)
+        edges = self.capture.waves.expand(expand_groups(records))
+        edges = edges[edges['flags'] == 0]
+        return edges[np.argsort(edges['timestamp'], kind='stable')], known, levels
+
+    def captureSamples(self, edges, known, levels, start_ns):
+        """
+        Per-pin (timestamps, states) of captured edges, starting with each
+        pin's level before them where the index knows it.
+        """
+        first_ns = int(edges['timestamp'][0]) if len(edges) else start_ns
+        edges = edges[np.lexsort((edges['timestamp'], edges['pin']))]
+        bounds = np.searchsorted(edges['pin'], np.arange(GPIO_PIN_RANGE.start, GPIO_PIN_RANGE.stop + 1), 'left')
+        samples = {}
+        for gpio, first, last in zip(GPIO_PIN_RANGE, bounds[:-1], bounds[1:]):
+            timestamps, states = edges['timestamp'][first:last], edges['level'][first:last]
+            if known & (1 << gpio):
+                timestamps = np.append(first_ns, timestamps)
+                states = np.append(np.uint8((levels >> gpio) & 1), states)
+            samples[gpio] = timestamps, states
+        return samples
+
+    def onXRangeChanged(self, viewBox, xRange):
+        # Every scroll, zoom or pan redraws the visible window, which also
+        # picks the level of detail for the new range
+        self.renderPlots(*xRange)
+
+    def connectEvents(self):
+        """
+        Subscribe to the pins we draw. Retried every frame until the GPIO
+        side has started its event server.
+        """
         try:
-            raw_data = self.pipe.readlines()
-            if raw_data:
-                events = []
-                most_recent_event_time = None
-                for line in raw_data:
-                    try:
-                        event = ast.literal_eval(line)
-                        if event[0] in GPIO_PIN_RANGE:
-                            events.append(event)
-                            # Update most_recent_event_time with the latest timestamp
-                            if most_recent_event_time is None or event[2] > most_recent_event_time:
-                                most_recent_event_time = event[2]
-                        else:
-                            print(f"Invalid GPIO pin number: {event[0]}")
-                    except (SyntaxError, ValueError) as e:
-                        print(f"Error parsing data: {e}")
-
-                for gpio, state, timestamp in events:
-                    # Initialize gpio_data for new GPIO
-                    if gpio not in gpio_data:
-                        gpio_data[gpio] = {'timestamps': [], 'states': [], 'last_state': None}
-
-                    # Check if this is the first event for the GPIO
-                    if not gpio_data[gpio]['timestamps']:
-                        # Assume opposite state prior to the first event
-                        opposite_state = 0 if state == 1 else 1
-                        # Backfill an event with the opposite state at the start of the window
-                        gpio_data[gpio]['timestamps'].append(window_start_ns)
-                        gpio_data[gpio]['states'].append(opposite_state)
-
-                    gpio_data[gpio]['timestamps'].append(timestamp)
-                    gpio_data[gpio]['states'].append(state)
-                    gpio_data[gpio]['last_state'] = state
-
-                # If we have events, update all GPIOs to the most recent event's timestamp
-                if most_recent_event_time:
-                    for gpio in GPIO_PIN_RANGE:
-                        if gpio not in gpio_data:
-                            continue  # Skip GPIOs that have not been initialized
-                        # Only update if the last timestamp is older than the most recent event's timestamp
-                        if gpio_data[gpio]['timestamps'] and gpio_data[gpio]['timestamps'][-1] < most_recent_event_time:
-                            last_state = gpio_data[gpio]['last_state']
-                            gpio_data[gpio]['timestamps'].append(most_recent_event_time)
-                            gpio_data[gpio]['states'].append(last_state)
-                
-                for gpio, curve in zip(GPIO_PIN_RANGE, self.curves):
-                    if gpio not in gpio_data:
-                        continue  # Skip curves for GPIOs that have not been initialized
-                    data = gpio_data[gpio]
-                    if data['timestamps']:
-                        # Logic for extending timestamps and updating curves remains unchanged
-
-                        if len(data['timestamps']) > 1:
-                            timestamps_extended = data['timestamps'] + [data['timestamps'][-1] + (data['timestamps'][-1] - data['timestamps'][-2])]
-                        else:
-                            timestamps_extended = data['timestamps'] + [data['timestamps'][-1]] if data['timestamps'] else data['timestamps']
-                        
-                        curve.setData(timestamps_extended, data['states'])
-                    self.plots[gpio-2].setXRange(window_start_ns, current_time_ns, padding=0)
-
-        except IOError as e:
-            if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
-                raise
+            self.events = subscribe(self.socket_path, pins=GPIO_PIN_RANGE)
+        except OSError:
+            self.events = None
+            return False
+        # A new stream, nothing may be left over from the last one
+        self.decoder = TextEventDecoder() if self.text_format else EventDecoder()
+        self.waves = WaveTable()  # The server sends the current definitions first
+        return True
+
+    def readEvents(self):
+        """
+        Wait up to READ_TIMEOUT for events and read at most READ_SIZE bytes
+        of them, noting how many were received but are not stored yet.
+        """
+        if self.events is None and not self.connectEvents():
+            self.stopReading.wait(READ_TIMEOUT)
+            return b''
+        if not select.select([self.events], [], [], READ_TIMEOUT)[0]:
+            self.backlog = 0
+            return b''
+        try:
+            chunk = self.events.recv(READ_SIZE)
+        except BlockingIOError:
+            return b''
+        except OSError:
+            chunk = b''
+        if not chunk:
+            # The server went away, start over with the next one
+            self.events.close()
+            self.events = None
+            self.backlog = 0
+            return b''
+        waiting = bytearray(4)
+        fcntl.ioctl(self.events, termios.FIONREAD, waiting)
+        # Approximate for the text format
+        self.backlog = (len(chunk) + int.from_bytes(waiting, sys.byteorder)) // RECORD_SIZE
+        return chunk
 
     def onClick(self, event):
         self.clickCount += 1  # Increment click count on each click
@@ -285,14 +1069,39 @@ class GPIOPlotter(QtWidgets.QWidget):
         else:
             return f"{distance_ns:.0f} ns"
 
+    def stopReader(self):
+        """
+        Stop the frames and the reader thread and wait for it; the reader
+        closes the subscription on its way out.
+        """
+        self.timer.stop()
+        self.stopReading.set()
+        if self.reader.is_alive():
+            self.reader.join()
+
     def closeEvent(self, event):
-        self.pipe.close()
-        os.close(self.pipe_fd)
+        self.stopReader()
         super(GPIOPlotter, self).closeEvent(event)
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
-    mainWin = GPIOPlotter()
+    def option(name, default=None):
+        return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+    capture = option('--capture')
+    if capture is not None and capture.endswith('.vcd'):
+        # Opened through a temporary capture, kept until the window closes
+        imported = tempfile.TemporaryDirectory()
+        capture = import_vcd(capture, os.path.join(imported.name, 'capture'))
+    socket_path = option('--socket', EVENT_SOCKET_NAME)
+    # e.g. --trigger 'high:17<50us' --trigger-mode single --pre 100us --post 1ms
+    trigger = option('--trigger')
+    # --decode may be given several times, e.g. --decode uart:15:115200 --decode i2c:2,3
+    decoders = [sys.argv[i + 1] for i, arg in enumerate(sys.argv[:-1]) if arg == '--decode']
+    mainWin = GPIOPlotter(text_format='--text' in sys.argv, capture=capture, socket_path=socket_path,
+                          trigger=trigger, trigger_mode=option('--trigger-mode', 'normal' if trigger else 'free'),
+                          pre_trigger_ns=parse_duration(option('--pre', '1ms')),
+                          post_trigger_ns=parse_duration(option('--post', '4ms')), decoders=decoders)
     mainWin.show()
     sys.exit(app.exec())
 